@@ -0,0 +1,370 @@
+"""
+    Binary game archive: every ply is stored as its 16-bit move (see bitboard.encode_move),
+    so a game takes 2 bytes per ply instead of a FEN per position.
+
+    An archive is two files:
+        games.bin       header, then the games one after the other
+        games.bin.idx   64-bit offsets: where every game starts in games.bin, and where the last one ends
+    Game N spans offsets N to N + 1, so it can be found without reading the games before it,
+    and ply K of it is at a fixed place in it.
+
+    A game is stored as:
+        result          1 byte, ONGOING, WHITE_WINS, BLACK_WINS or DRAW
+        FEN length      1 byte, 0 if the game starts from the start position
+        FEN             the start position, ASCII
+        moves           2 bytes each, little endian
+
+    Games are appended and only the last one can be extended, the data is written before the index,
+    so an archive cut short by a crash still reads as the games the index holds.
+
+    Usage:
+        python archive.py import games.pgn games.bin
+        python archive.py show games.bin 10 [ply]
+        python archive.py bench games.bin
+"""
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+
+from constants import *
+from bitboard import move_to_uci
+from board import Board
+from pgn import replay
+
+MAGIC = b"CHESSARC"
+VERSION = 1
+HEADER = struct.Struct("<8sH")
+GAME_HEADER = struct.Struct("<BB")
+OFFSET = struct.Struct("<Q")
+MOVE = struct.Struct("<H")
+
+## Result of a game
+ONGOING = 0
+WHITE_WINS = 1
+BLACK_WINS = 2
+DRAW = 3
+RESULT_TO_STRING = {ONGOING: "*", WHITE_WINS: "1-0", BLACK_WINS: "0-1", DRAW: "1/2-1/2"}
+STRING_TO_RESULT = {string: result for result, string in RESULT_TO_STRING.items()}
+
+
+def index_path(path):
+    return path + ".idx"
+
+
+def pack_moves(moves):
+    """Returns the moves as little endian 16-bit integers"""
+    moves = array("H", moves)
+    if sys.byteorder == "big":
+        moves.byteswap()
+    return moves.tobytes()
+
+
+def unpack_moves(data):
+    """Returns the moves packed by pack_moves, as an array of integers"""
+    moves = array("H")
+    moves.frombytes(data)
+    if sys.byteorder == "big":
+        moves.byteswap()
+    return moves
+
+
+class ArchiveWriter:
+    """Appends games to an archive, creating it if it doesn't exist"""
+
+    def __init__(self, path):
+        """Opens the archive, and drops what a crash left past its last indexed game
+
+        Raises:
+            ValueError: If the file is not an archive, or its index is missing, empty or past the end of the data
+        """
+        self.path = path
+        if not os.path.exists(path):
+            with open(path, "wb") as file:
+                file.write(HEADER.pack(MAGIC, VERSION))
+            with open(index_path(path), "wb") as file:
+                file.write(OFFSET.pack(HEADER.size))
+        elif not os.path.exists(index_path(path)):
+            raise ValueError(f"{path} has no index {index_path(path)}")
+        self.data = open(path, "r+b")
+        self.index = open(index_path(path), "r+b")
+        header = self.data.read(HEADER.size)
+        data_size = self.data.seek(0, os.SEEK_END)
+        index_size = self.index.seek(0, os.SEEK_END)
+        # An index entry cut short by a crash is dropped, with the game it ended
+        self.games = index_size // OFFSET.size - 1
+        self.end = None
+        if self.games >= 0:
+            self.index.seek(self.games * OFFSET.size)
+            self.end = OFFSET.unpack(self.index.read(OFFSET.size))[0]
+        # Checked before anything is truncated, a damaged archive is left as it is
+        error = None
+        if len(header) < HEADER.size or HEADER.unpack(header) != (MAGIC, VERSION):
+            error = f"{path} is not a game archive of version {VERSION}"
+        elif self.end is None:
+            error = f"The index of {path} is empty"
+        elif not HEADER.size <= self.end <= data_size:
+            error = f"The index of {path} points past the end of its data"
+        if error is not None:
+            self.close()
+            raise ValueError(error)
+        self.index.truncate(self.games * OFFSET.size + OFFSET.size)
+        # Drop what a crash left past the last indexed game
+        self.data.truncate(self.end)
+
+    def __len__(self):
+        return self.games
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+
+    def append(self, moves=(), fen=START_FEN, result=ONGOING):
+        """Appends a game
+
+        Args:
+            moves (list): The moves of the game, encoded as in bitboard.encode_move
+            fen (str): The position the game starts from
+            result (int): ONGOING, WHITE_WINS, BLACK_WINS or DRAW
+
+        Returns:
+            int: The number of the game
+        """
+        fen = b"" if fen == START_FEN else fen.encode("ascii")
+        if len(fen) > 255:
+            raise ValueError(f"FEN too long: {fen!r}")
+        self.write(GAME_HEADER.pack(result, len(fen)) + fen + pack_moves(moves))
+        self.index.seek(0, os.SEEK_END)
+        self.index.write(OFFSET.pack(self.end))
+        self.index.flush()
+        self.games += 1
+        return self.games - 1
+
+    def extend(self, moves):
+        """Appends moves to the last game"""
+        if not self.games:
+            raise IndexError("The archive has no game to extend")
+        self.write(pack_moves(moves))
+        self.index.seek(-OFFSET.size, os.SEEK_END)
+        self.index.write(OFFSET.pack(self.end))
+        self.index.flush()
+
+    def set_result(self, game, result):
+        """Changes the result of a game"""
+        if not 0 <= game < self.games:
+            raise IndexError(f"No game {game} in the archive")
+        self.index.seek(game * OFFSET.size)
+        start = OFFSET.unpack(self.index.read(OFFSET.size))[0]
+        self.data.seek(start)
+        self.data.write(bytes((result,)))
+        self.data.flush()
+
+    def write(self, data):
+        self.data.seek(self.end)
+        self.data.write(data)
+        # The index may only point at data that made it to the file
+        self.data.flush()
+        self.end += len(data)
+
+
+class ArchiveReader:
+    """Reads the games of an archive through memory maps, only the games asked for are read
+
+    The archive is read as it is when opened, games appended later are seen after reopening it.
+    """
+
+    def __init__(self, path):
+        """Maps the archive
+
+        Raises:
+            ValueError: If the file is not an archive, or its index is empty or past the end of the data
+        """
+        with open(path, "rb") as file, open(index_path(path), "rb") as index:
+            # mmap can't map an empty file
+            if not os.fstat(file.fileno()).st_size or os.fstat(index.fileno()).st_size < OFFSET.size:
+                raise ValueError(f"{path} is not a game archive of version {VERSION}")
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.index = mmap.mmap(index.fileno(), 0, access=mmap.ACCESS_READ)
+        self.games = len(self.index) // OFFSET.size - 1
+        if (len(self.data) < HEADER.size or HEADER.unpack_from(self.data) != (MAGIC, VERSION)
+                or OFFSET.unpack_from(self.index, self.games * OFFSET.size)[0] > len(self.data)):
+            self.close()
+            raise ValueError(f"{path} is not a game archive of version {VERSION}, or its index is damaged")
+
+    def __len__(self):
+        return self.games
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+
+    def span(self, game):
+        """Returns where the game starts and ends in the data"""
+        if not 0 <= game < self.games:
+            raise IndexError(f"No game {game} in the archive")
+        return struct.unpack_from("<QQ", self.index, game * OFFSET.size)
+
+    def header(self, game):
+        """Returns the FEN the game starts from, its result, and where its moves start and end in the data"""
+        start, end = self.span(game)
+        result, fen_length = GAME_HEADER.unpack_from(self.data, start)
+        moves = start + GAME_HEADER.size + fen_length
+        fen = self.data[start + GAME_HEADER.size:moves].decode("ascii") if fen_length else START_FEN
+        return fen, result, moves, end
+
+    def fen(self, game):
+        return self.header(game)[0]
+
+    def result(self, game):
+        return self.header(game)[1]
+
+    def plies(self, game):
+        _, _, moves, end = self.header(game)
+        return (end - moves) // MOVE.size
+
+    def moves(self, game):
+        """Returns the moves of the game, as an array of integers"""
+        _, _, moves, end = self.header(game)
+        return unpack_moves(self.data[moves:end])
+
+    def move(self, game, ply):
+        """Returns the move played at ply of the game, counted from 0"""
+        _, _, moves, end = self.header(game)
+        if not 0 <= ply < (end - moves) // MOVE.size:
+            raise IndexError(f"No ply {ply} in game {game}")
+        return MOVE.unpack_from(self.data, moves + ply * MOVE.size)[0]
+
+    def board(self, game, ply=None, calc_moves=True):
+        """Replays the game on a Board
+
+        Args:
+            game (int): The number of the game
+            ply (int): The number of moves to play, all of them if None
+            calc_moves (bool): False to leave valid_moves empty, see Board.calc_moves
+
+        Returns:
+            Board: The position after the moves, with them in its history
+        """
+        fen, _, _, _ = self.header(game)
+        moves = self.moves(game)
+        board = Board.from_fen(fen, calc_moves=False)
+        for move in moves[:ply]:
+            board.make_move(move)
+        if calc_moves:
+            board.calc_moves()
+        return board
+
+    def __iter__(self):
+        """Yields the FEN, result and moves of every game"""
+        for game in range(self.games):
+            fen, result, moves, end = self.header(game)
+            yield fen, result, unpack_moves(self.data[moves:end])
+
+
+def import_pgn(pgn_path, path):
+    """Appends the games of a PGN file to the archive, returns the number of games and of errors"""
+    games = errors = 0
+    with open(pgn_path, encoding="utf-8", errors="replace") as file, ArchiveWriter(path) as archive:
+        for headers, moves, board, error in replay(file):
+            if error is not None or board is None:
+                errors += 1
+                continue
+            archive.append(moves, headers.get("FEN", START_FEN), STRING_TO_RESULT.get(headers.get("Result"), ONGOING))
+            games += 1
+    return games, errors
+
+
+def benchmark(path, samples=10000):
+    """Compares the size of the archive and the time to reach a ply with the same games stored as JSON lists of FENs"""
+    with ArchiveReader(path) as reader:
+        games = list(reader)
+        plies = sum(len(moves) for _, _, moves in games)
+        json_games = []
+        for game in range(len(reader)):
+            board = Board.from_fen(games[game][0], calc_moves=False)
+            fens = [board.to_fen()]
+            for move in games[game][2]:
+                board.make_move(move)
+                fens.append(board.to_fen())
+            json_games.append(fens)
+    json_path = path + ".json"
+    with open(json_path, "w") as file:
+        json.dump(json_games, file)
+    binary_size = os.path.getsize(path) + os.path.getsize(index_path(path))
+    json_size = os.path.getsize(json_path)
+    print(f"Games: {len(games)}  plies: {plies}")
+    print(f"Archive  {binary_size:10d} bytes  {binary_size / plies:6.2f} bytes/ply")
+    print(f"JSON     {json_size:10d} bytes  {json_size / plies:6.2f} bytes/ply")
+
+    targets = [(game, len(games[game][2]) // 2) for game in range(0, len(games), max(len(games) // samples, 1))]
+    start = time.perf_counter()
+    with open(json_path) as file:
+        data = json.load(file)
+    for game, ply in targets:
+        Board.from_fen(data[game][ply], calc_moves=False)
+    elapsed = time.perf_counter() - start
+    print(f"JSON     load and reach {len(targets)} plies: {elapsed:.3f} s")
+    start = time.perf_counter()
+    with ArchiveReader(path) as reader:
+        for game, ply in targets:
+            reader.board(game, ply, calc_moves=False)
+    elapsed = time.perf_counter() - start
+    print(f"Archive  open and replay {len(targets)} plies: {elapsed:.3f} s")
+    start = time.perf_counter()
+    with ArchiveReader(path) as reader:
+        for game, ply in targets:
+            reader.move(game, ply)
+    elapsed = time.perf_counter() - start
+    print(f"Archive  open and read {len(targets)} moves: {elapsed:.3f} s")
+    os.remove(json_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Builds and reads binary game archives")
+    commands = parser.add_subparsers(dest="command", required=True)
+    command = commands.add_parser("import", help="append the games of a PGN file to an archive")
+    command.add_argument("pgn")
+    command.add_argument("archive")
+    command = commands.add_parser("show", help="print a game, or the position at one of its plies")
+    command.add_argument("archive")
+    command.add_argument("game", type=int)
+    command.add_argument("ply", type=int, nargs="?")
+    command = commands.add_parser("bench", help="compare the archive with the same games as JSON lists of FENs")
+    command.add_argument("archive")
+    args = parser.parse_args(argv)
+
+    if args.command == "import":
+        start = time.perf_counter()
+        games, errors = import_pgn(args.pgn, args.archive)
+        print(f"Imported {games} games, {errors} errors, in {time.perf_counter() - start:.2f} s")
+    elif args.command == "show":
+        with ArchiveReader(args.archive) as reader:
+            if args.ply is None:
+                print(f"{reader.fen(args.game)}  {RESULT_TO_STRING[reader.result(args.game)]}")
+                print(" ".join(move_to_uci(move) for move in reader.moves(args.game)))
+            else:
+                print(reader.board(args.game, args.ply, calc_moves=False).to_fen())
+    else:
+        benchmark(args.archive)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
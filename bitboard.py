@@ -0,0 +1,546 @@
+"""
+    SQUARES:
+        A square is an integer in 0..63, equal to y * 8 + x for the Pos(x, y) used by Board,
+        so square 0 is a8 (top left) and square 63 is h1 (bottom right).
+        Bit n of a bitboard is set if square n is in the set.
+    MOVES:
+        A move is packed into 16 bits: from square (6), to square (6), flag (4).
+"""
+
+from constants import *
+
+FULL = 0xFFFFFFFFFFFFFFFF
+
+## Move flags
+QUIET = 0
+DOUBLE_PUSH = 1
+KING_CASTLE = 2
+QUEEN_CASTLE = 3
+CAPTURE = 4
+EN_PASSANT = 5
+PROMOTION = 8
+PROMOTION_CAPTURE = 12
+
+## Promotion flag offset to piece type
+PROMOTION_ROLES = (KNIGHT, BISHOP, ROOK, QUEEN)
+
+## Directions as (dx, dy), the first four are orthogonal, the last four diagonal
+DIRECTIONS = ((0, -1), (1, 0), (0, 1), (-1, 0), (1, -1), (1, 1), (-1, 1), (-1, -1))
+ORTHOGONAL = (0, 1, 2, 3)
+DIAGONAL = (4, 5, 6, 7)
+## True if stepping in the direction increases the square index
+POSITIVE = tuple(dy * 8 + dx > 0 for dx, dy in DIRECTIONS)
+
+KNIGHT_OFFSETS = ((1, 2), (2, 1), (-1, 2), (-2, 1), (1, -2), (2, -1), (-1, -2), (-2, -1))
+KING_OFFSETS = ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1))
+## White pawns move towards y = 0, black pawns towards y = 7
+PAWN_DIRECTION = {W: -1, B: 1}
+
+
+def square(x, y):
+    return y * 8 + x
+
+
+def lsb(bb):
+    """Returns the index of the lowest set bit"""
+    return (bb & -bb).bit_length() - 1
+
+
+def msb(bb):
+    """Returns the index of the highest set bit"""
+    return bb.bit_length() - 1
+
+
+def squares_of(bb):
+    """Yields the index of every set bit, lowest first"""
+    while bb:
+        low = bb & -bb
+        yield low.bit_length() - 1
+        bb ^= low
+
+
+def popcount(bb):
+    return bin(bb).count("1")
+
+
+def square_to_notation(sq):
+    return f"{chr(sq % 8 + 97)}{8 - sq // 8}"
+
+
+def notation_to_square(notation):
+    return square(ord(notation[0]) - 97, 8 - int(notation[1]))
+
+
+def encode_move(frm, to, flag=QUIET):
+    return frm | to << 6 | flag << 12
+
+
+def move_to_uci(move):
+    """Returns the move in long algebraic notation, e.g. e2e4 or e7e8q"""
+    uci = square_to_notation(move & 63) + square_to_notation(move >> 6 & 63)
+    flag = move >> 12
+    if flag & PROMOTION:
+        uci += "nbrq"[flag & 3]
+    return uci
+
+
+def _step_table(offsets):
+    table = []
+    for sq in range(64):
+        x, y = sq % 8, sq // 8
+        bb = 0
+        for dx, dy in offsets:
+            if 0 <= x + dx < SIZE and 0 <= y + dy < SIZE:
+                bb |= 1 << square(x + dx, y + dy)
+        table.append(bb)
+    return table
+
+
+def _ray_table():
+    rays = []
+    for dx, dy in DIRECTIONS:
+        direction = []
+        for sq in range(64):
+            x, y = sq % 8 + dx, sq // 8 + dy
+            bb = 0
+            while 0 <= x < SIZE and 0 <= y < SIZE:
+                bb |= 1 << square(x, y)
+                x, y = x + dx, y + dy
+            direction.append(bb)
+        rays.append(direction)
+    return rays
+
+
+def _line_tables():
+    between = [[0] * 64 for _ in range(64)]
+    line = [[0] * 64 for _ in range(64)]
+    for sq in range(64):
+        for d, (dx, dy) in enumerate(DIRECTIONS):
+            full_line = RAYS[d][sq] | RAYS[(d + 2) % 4 + d // 4 * 4][sq] | 1 << sq
+            x, y = sq % 8 + dx, sq // 8 + dy
+            path = 0
+            while 0 <= x < SIZE and 0 <= y < SIZE:
+                target = square(x, y)
+                between[sq][target] = path
+                line[sq][target] = full_line
+                path |= 1 << target
+                x, y = x + dx, y + dy
+    return between, line
+
+
+KNIGHT_ATTACKS = _step_table(KNIGHT_OFFSETS)
+KING_ATTACKS = _step_table(KING_OFFSETS)
+PAWN_ATTACKS = {W: _step_table(((1, -1), (-1, -1))), B: _step_table(((1, 1), (-1, 1)))}
+RAYS = _ray_table()
+## BETWEEN[a][b]: squares strictly between two aligned squares, LINE[a][b]: the whole line through them
+BETWEEN, LINE = _line_tables()
+ROOK_RAYS = [RAYS[0][sq] | RAYS[1][sq] | RAYS[2][sq] | RAYS[3][sq] for sq in range(64)]
+BISHOP_RAYS = [RAYS[4][sq] | RAYS[5][sq] | RAYS[6][sq] | RAYS[7][sq] for sq in range(64)]
+
+## Castling squares per color and side: king from, king to, rook from, rook to, must be empty, must not be attacked
+CASTLING = {
+    W: {
+        KING_SIDE: (60, 62, 63, 61, 1 << 61 | 1 << 62, (61, 62)),
+        QUEEN_SIDE: (60, 58, 56, 59, 1 << 57 | 1 << 58 | 1 << 59, (59, 58)),
+    },
+    B: {
+        KING_SIDE: (4, 6, 7, 5, 1 << 5 | 1 << 6, (5, 6)),
+        QUEEN_SIDE: (4, 2, 0, 3, 1 << 1 | 1 << 2 | 1 << 3, (3, 2)),
+    },
+}
+
+
+def slider_attacks(sq, occupied, directions):
+    attacks = 0
+    for d in directions:
+        ray = RAYS[d][sq]
+        blockers = ray & occupied
+        if blockers:
+            if POSITIVE[d]:
+                ray ^= RAYS[d][(blockers & -blockers).bit_length() - 1]
+            else:
+                ray ^= RAYS[d][blockers.bit_length() - 1]
+        attacks |= ray
+    return attacks
+
+
+def rook_attacks(sq, occupied):
+    return slider_attacks(sq, occupied, ORTHOGONAL)
+
+
+def bishop_attacks(sq, occupied):
+    return slider_attacks(sq, occupied, DIAGONAL)
+
+
+def piece_attacks(color, role, sq, occupied):
+    """Returns the squares attacked by a piece on sq, given the occupancy"""
+    if role is PAWN:
+        return PAWN_ATTACKS[color][sq]
+    if role is KNIGHT:
+        return KNIGHT_ATTACKS[sq]
+    if role is KING:
+        return KING_ATTACKS[sq]
+    if role is ROOK:
+        return rook_attacks(sq, occupied)
+    if role is BISHOP:
+        return bishop_attacks(sq, occupied)
+    return rook_attacks(sq, occupied) | bishop_attacks(sq, occupied)
+
+
+class AttackMap:
+    """The number of pieces of each color attacking every square, kept up to date by BitBoard.put and remove
+
+    Putting or removing a piece only rescans that piece and the sliders whose attacks reach its square,
+    as those are the only attacks a change of occupancy there can change.
+    """
+
+    def __init__(self, bitboard):
+        self.bitboard = bitboard
+        # Attackers of every square, indexed as counts[color][sq]
+        self.counts = [[0] * 64, [0] * 64]
+        # Squares attacked at least once by each color
+        self.held = [0, 0]
+        # Squares attacked by the piece on every square, 0 if it is empty
+        self.attacks_from = [0] * 64
+        for sq in squares_of(bitboard.occupied):
+            self.add(sq)
+
+    def add(self, sq):
+        """Counts the attacks of the piece on sq"""
+        bitboard = self.bitboard
+        color = bitboard.colors[sq]
+        attacks = piece_attacks(color, bitboard.roles[sq], sq, bitboard.occupied)
+        self.attacks_from[sq] = attacks
+        counts = self.counts[color]
+        held = self.held[color]
+        for to in squares_of(attacks):
+            counts[to] += 1
+            held |= 1 << to
+        self.held[color] = held
+
+    def subtract(self, sq):
+        """Takes the counted attacks of the piece on sq away"""
+        color = self.bitboard.colors[sq]
+        counts = self.counts[color]
+        held = self.held[color]
+        for to in squares_of(self.attacks_from[sq]):
+            counts[to] -= 1
+            if not counts[to]:
+                held ^= 1 << to
+        self.held[color] = held
+        self.attacks_from[sq] = 0
+
+    def sliders_through(self, sq):
+        """Returns the squares of the sliders that attack sq, their attacks change when it is emptied or filled"""
+        bitboard = self.bitboard
+        sliders = 0
+        for color in (W, B):
+            pieces = bitboard.pieces[color]
+            sliders |= pieces[BISHOP] | pieces[ROOK] | pieces[QUEEN]
+        attacks_from = self.attacks_from
+        return [slider for slider in squares_of(sliders) if attacks_from[slider] >> sq & 1]
+
+
+class BitBoard:
+    """Piece placement stored as one 64-bit integer per color and piece type, with a legal move generator"""
+    __slots__ = ("pieces", "occupancy", "occupied", "colors", "roles", "attack_map")
+
+    def __init__(self):
+        self.pieces = [[0] * 6, [0] * 6]
+        self.occupancy = [0, 0]
+        self.occupied = 0
+        # Square to color/role lookup, None if the square is empty
+        self.colors = [None] * 64
+        self.roles = [None] * 64
+        # AttackMap kept up to date as pieces move, None until track_attacks is called
+        self.attack_map = None
+
+    def track_attacks(self):
+        """Starts keeping attack_map up to date, and returns it"""
+        if self.attack_map is None:
+            self.attack_map = AttackMap(self)
+        return self.attack_map
+
+    def put(self, color, role, sq):
+        attack_map = self.attack_map
+        if attack_map is not None:
+            sliders = attack_map.sliders_through(sq)
+            for slider in sliders:
+                attack_map.subtract(slider)
+        bit = 1 << sq
+        self.pieces[color][role] |= bit
+        self.occupancy[color] |= bit
+        self.occupied |= bit
+        self.colors[sq] = color
+        self.roles[sq] = role
+        if attack_map is not None:
+            for slider in sliders:
+                attack_map.add(slider)
+            attack_map.add(sq)
+
+    def remove(self, sq):
+        color = self.colors[sq]
+        if color is None:
+            return None, None
+        attack_map = self.attack_map
+        if attack_map is not None:
+            attack_map.subtract(sq)
+            sliders = attack_map.sliders_through(sq)
+            for slider in sliders:
+                attack_map.subtract(slider)
+        role = self.roles[sq]
+        bit = 1 << sq
+        self.pieces[color][role] ^= bit
+        self.occupancy[color] ^= bit
+        self.occupied ^= bit
+        self.colors[sq] = None
+        self.roles[sq] = None
+        if attack_map is not None:
+            for slider in sliders:
+                attack_map.add(slider)
+        return color, role
+
+    def move(self, frm, to):
+        """Moves the piece on frm to to, returns the color and role of the captured piece"""
+        captured = self.remove(to)
+        color, role = self.remove(frm)
+        self.put(color, role, to)
+        return captured
+
+    def king_square(self, color):
+        return lsb(self.pieces[color][KING])
+
+    def attackers_to(self, sq, color, occupied):
+        """Returns the pieces of color that attack sq, given the occupancy"""
+        pieces = self.pieces[color]
+        return ((KNIGHT_ATTACKS[sq] & pieces[KNIGHT])
+                | (KING_ATTACKS[sq] & pieces[KING])
+                | (PAWN_ATTACKS[color ^ 1][sq] & pieces[PAWN])
+                | (rook_attacks(sq, occupied) & (pieces[ROOK] | pieces[QUEEN]))
+                | (bishop_attacks(sq, occupied) & (pieces[BISHOP] | pieces[QUEEN])))
+
+    def pins(self, color):
+        """Finds the pieces of color that are pinned to their own king
+
+        Returns:
+            tuple: Bitboard of pinned pieces, and a dict of pinned square to the line it may move along
+        """
+        king = self.king_square(color)
+        enemy = self.pieces[color ^ 1]
+        snipers = ((ROOK_RAYS[king] & (enemy[ROOK] | enemy[QUEEN]))
+                   | (BISHOP_RAYS[king] & (enemy[BISHOP] | enemy[QUEEN])))
+        pinned = 0
+        pin_lines = {}
+        for sniper in squares_of(snipers):
+            blockers = BETWEEN[king][sniper] & self.occupied
+            # Exactly one piece in between, and it is ours
+            if blockers and not blockers & (blockers - 1) and blockers & self.occupancy[color]:
+                pinned |= blockers
+                pin_lines[lsb(blockers)] = LINE[king][sniper]
+        return pinned, pin_lines
+
+    def legal_moves(self, color, castles, en_passant):
+        """Generates every legal move for color
+
+        Args:
+            color (int): The side to move
+            castles (list): Castling rights, indexed as castles[color][side]
+            en_passant (int): The en passant target square, or None
+
+        Returns:
+            list: The legal moves, encoded with encode_move
+        """
+        moves = []
+        append = moves.append
+        enemy_color = color ^ 1
+        pieces = self.pieces[color]
+        own = self.occupancy[color]
+        enemy = self.occupancy[enemy_color]
+        occupied = self.occupied
+        king = lsb(pieces[KING])
+        checkers = self.attackers_to(king, enemy_color, occupied)
+
+        for to in squares_of(self.king_targets(color)):
+            append(king | to << 6 | (CAPTURE if enemy >> to & 1 else QUIET) << 12)
+
+        if checkers & (checkers - 1):
+            # Double check, only the king can move
+            return moves
+        if checkers:
+            checker = lsb(checkers)
+            target_mask = (BETWEEN[king][checker] | checkers) & ~own
+        else:
+            target_mask = ~own & FULL
+            moves += self.castling_moves(color, castles)
+
+        pinned, pin_lines = self.pins(color)
+
+        for frm in squares_of(pieces[KNIGHT] & ~pinned):
+            for to in squares_of(KNIGHT_ATTACKS[frm] & target_mask):
+                append(frm | to << 6 | (CAPTURE if enemy >> to & 1 else QUIET) << 12)
+        for frm in squares_of(pieces[BISHOP] | pieces[QUEEN]):
+            mask = target_mask & pin_lines[frm] if pinned >> frm & 1 else target_mask
+            for to in squares_of(bishop_attacks(frm, occupied) & mask):
+                append(frm | to << 6 | (CAPTURE if enemy >> to & 1 else QUIET) << 12)
+        for frm in squares_of(pieces[ROOK] | pieces[QUEEN]):
+            mask = target_mask & pin_lines[frm] if pinned >> frm & 1 else target_mask
+            for to in squares_of(rook_attacks(frm, occupied) & mask):
+                append(frm | to << 6 | (CAPTURE if enemy >> to & 1 else QUIET) << 12)
+
+        step = PAWN_DIRECTION[color] * 8
+        start_row = 6 if color is W else 1
+        last_row = 0 if color is W else 7
+        empty = ~occupied
+        for frm in squares_of(pieces[PAWN]):
+            mask = target_mask & pin_lines[frm] if pinned >> frm & 1 else target_mask
+            targets = []
+            one = frm + step
+            if empty >> one & 1:
+                if mask >> one & 1:
+                    targets.append((one, QUIET))
+                two = one + step
+                if frm // 8 == start_row and empty >> two & 1 and mask >> two & 1:
+                    targets.append((two, DOUBLE_PUSH))
+            for to in squares_of(PAWN_ATTACKS[color][frm] & enemy & mask):
+                targets.append((to, CAPTURE))
+            for to, flag in targets:
+                if to // 8 == last_row:
+                    promotion = PROMOTION_CAPTURE if flag is CAPTURE else PROMOTION
+                    for offset in range(4):
+                        append(frm | to << 6 | (promotion | offset) << 12)
+                else:
+                    append(frm | to << 6 | flag << 12)
+
+        if en_passant is not None:
+            for frm in squares_of(PAWN_ATTACKS[enemy_color][en_passant] & pieces[PAWN]):
+                if self.en_passant_is_legal(color, frm, en_passant):
+                    append(frm | en_passant << 6 | EN_PASSANT << 12)
+        return moves
+
+    def check_mask(self, color):
+        """Finds the checks on the king of color
+
+        Returns:
+            tuple: Bitboard of the checking pieces, and of the squares other pieces than the king may move to:
+                   every square if there is no check, none in double check, else the checker and the squares between
+        """
+        king = self.king_square(color)
+        checkers = self.attackers_to(king, color ^ 1, self.occupied)
+        if not checkers:
+            return checkers, FULL
+        if checkers & (checkers - 1):
+            return checkers, 0
+        return checkers, BETWEEN[king][lsb(checkers)] | checkers
+
+    def king_targets(self, color):
+        """Returns the squares the king of color can step to without being attacked"""
+        king = self.king_square(color)
+        # Checked against the occupancy without the king, so it can't step back along a ray
+        without_king = self.occupied ^ (1 << king)
+        targets = 0
+        for to in squares_of(KING_ATTACKS[king] & ~self.occupancy[color]):
+            if not self.attackers_to(to, color ^ 1, without_king):
+                targets |= 1 << to
+        return targets
+
+    def castling_moves(self, color, castles):
+        """Returns the legal castling moves of color, whose king must not be in check"""
+        moves = []
+        king = self.king_square(color)
+        for side in (KING_SIDE, QUEEN_SIDE):
+            if not castles[color][side]:
+                continue
+            king_from, king_to, rook_from, _, empty, safe = CASTLING[color][side]
+            if king != king_from or not self.pieces[color][ROOK] >> rook_from & 1 or self.occupied & empty:
+                continue
+            if any(self.attackers_to(sq, color ^ 1, self.occupied) for sq in safe):
+                continue
+            moves.append(king_from | king_to << 6 | (KING_CASTLE if side is KING_SIDE else QUEEN_CASTLE) << 12)
+        return moves
+
+    def en_passant_is_legal(self, color, frm, en_passant):
+        """Returns True if the pawn of color on frm may capture en passant without leaving its king attacked
+
+        The capture is simulated, as two pawns leave the rank at once, so pins can't be used here.
+        """
+        king = self.king_square(color)
+        captured = en_passant - PAWN_DIRECTION[color] * 8
+        after = self.occupied ^ (1 << frm) ^ (1 << captured) | (1 << en_passant)
+        enemy_pieces = self.pieces[color ^ 1]
+        if rook_attacks(king, after) & (enemy_pieces[ROOK] | enemy_pieces[QUEEN]):
+            return False
+        if bishop_attacks(king, after) & (enemy_pieces[BISHOP] | enemy_pieces[QUEEN]):
+            return False
+        return not ((KNIGHT_ATTACKS[king] & enemy_pieces[KNIGHT])
+                    or (PAWN_ATTACKS[color][king] & enemy_pieces[PAWN] & ~(1 << captured)))
+
+    def legal_moves_to(self, color, role, to, en_passant):
+        """Generates the legal moves of the pieces of one type that end on a square, castling left out
+
+        Much cheaper than legal_moves when the destination is known, as when reading algebraic notation.
+        Every candidate is made on the occupancy and kept if the king is not attacked after it.
+
+        Args:
+            color (int): The side to move
+            role (int): The type of the pieces to move
+            to (int): The destination square
+            en_passant (int): The en passant target square, or None
+
+        Returns:
+            list: The legal moves, encoded with encode_move
+        """
+        moves = []
+        if self.occupancy[color] >> to & 1:
+            return moves
+        enemy_color = color ^ 1
+        pieces = self.pieces[color]
+        occupied = self.occupied
+        capture = self.occupancy[enemy_color] >> to & 1
+        step = PAWN_DIRECTION[color] * 8
+
+        if role is PAWN:
+            if capture or to == en_passant:
+                origins = PAWN_ATTACKS[enemy_color][to] & pieces[PAWN]
+            else:
+                origins = 0
+                one = to - step
+                if 0 <= one < 64:
+                    if pieces[PAWN] >> one & 1:
+                        origins = 1 << one
+                    elif not occupied >> one & 1 and to // 8 == (4 if color is W else 3):
+                        origins = pieces[PAWN] & 1 << (one - step)
+        elif role is KNIGHT:
+            origins = KNIGHT_ATTACKS[to] & pieces[KNIGHT]
+        elif role is BISHOP:
+            origins = bishop_attacks(to, occupied) & pieces[BISHOP]
+        elif role is ROOK:
+            origins = rook_attacks(to, occupied) & pieces[ROOK]
+        elif role is QUEEN:
+            origins = (rook_attacks(to, occupied) | bishop_attacks(to, occupied)) & pieces[QUEEN]
+        else:
+            origins = KING_ATTACKS[to] & pieces[KING]
+
+        king = lsb(pieces[KING])
+        last_row = 0 if color is W else 7
+        for frm in squares_of(origins):
+            captured = to
+            if capture:
+                flag = CAPTURE
+            elif role is PAWN and to == en_passant:
+                flag = EN_PASSANT
+                captured = to - step
+            elif role is PAWN and abs(to - frm) == 16:
+                flag = DOUBLE_PUSH
+            else:
+                flag = QUIET
+            after = occupied & ~(1 << frm) & ~(1 << captured) | 1 << to
+            # The captured piece attacks nothing anymore
+            if self.attackers_to(to if role is KING else king, enemy_color, after) & ~(1 << captured):
+                continue
+            if role is PAWN and to // 8 == last_row:
+                promotion = PROMOTION_CAPTURE if capture else PROMOTION
+                for offset in range(4):
+                    moves.append(frm | to << 6 | (promotion | offset) << 12)
+            else:
+                moves.append(frm | to << 6 | flag << 12)
+        return moves
@@ -0,0 +1,633 @@
+"""
+    GRAMMAR:
+        COLOR: 
+            0 - WHITE
+            1 - BLACK
+        PIECE:
+            0 - PAWN
+            1 - KNIGHT
+            2 - BISHOP
+            3 - KING
+            4 - ROOK
+            5 - QUEEN
+"""
+
+from piece import *
+from constants import *
+from position import Pos, SQUARES
+from bitboard import *
+from zobrist import PIECE_KEYS, BLACK_TO_MOVE_KEY, CASTLE_KEYS, EN_PASSANT_KEYS, castles_key
+
+
+class Tile:
+    __slots__ = ("piece", "held_by_black", "held_by_white", "marked_for_en_passant", "pinned_by_black",
+                 "pinned_by_white", "in_check_path")
+
+    def __init__(self):
+        self.piece = None
+        self.held_by_black = False
+        self.held_by_white = False
+        self.marked_for_en_passant = False
+        self.pinned_by_black = False
+        self.pinned_by_white = False
+        self.in_check_path = False
+
+
+# Tile attributes set from the bitboards in Board.markers, in the same order
+MARKERS = ("held_by_white", "held_by_black", "pinned_by_white", "pinned_by_black", "in_check_path")
+
+# Pos of every square index used by the bitboards, the interned positions share the same indexing
+SQUARE_TO_POS = SQUARES
+
+# Color and role of every piece letter of a FEN, None for an empty square
+FEN_PIECES = {".": None}
+for char, role in CHAR_TO_ROLE.items():
+    FEN_PIECES[char.upper()] = (W, role)
+    FEN_PIECES[char] = (B, role)
+# Replaces the digits of a FEN placement by that many empty squares
+FEN_EXPAND = str.maketrans({str(count): "." * count for count in range(1, 9)})
+
+
+def parse_fen(fen):
+    """Splits a FEN string into the parts of a position, the clocks may be left out
+
+    Castling rights without the king and rook on their starting squares, and an en passant target
+    on the wrong rank or without the pawn that just moved past it, are dropped.
+
+    Args:
+        fen (str): The position in Forsyth-Edwards Notation
+
+    Returns:
+        tuple: The (color, role) or None of every square (a8 first), the side to move,
+               the castling rights as castles[color][side], the en passant target square or None,
+               the halfmove clock and the fullmove clock
+
+    Raises:
+        ValueError: If the FEN is malformed, a side doesn't have exactly one king, a pawn is on rank 1 or 8,
+                    or the side not to move is in check
+    """
+    fields = fen.split()
+    if not 4 <= len(fields) <= 6:
+        raise ValueError(f"Expected 4 to 6 fields in FEN: {fen!r}")
+    placement, turn, castles, en_passant = fields[:4]
+
+    # Single pass over the placement: expand the empty squares, then look up every square
+    placement = placement.translate(FEN_EXPAND)
+    if len(placement) != 71 or placement[8::9] != "///////":
+        raise ValueError(f"Expected 8 rows of 8 squares in FEN: {fen!r}")
+    try:
+        squares = [FEN_PIECES[char] for char in placement.replace("/", "")]
+    except KeyError as error:
+        raise ValueError(f"Unknown piece {error.args[0]!r} in FEN: {fen!r}") from None
+    # The move generators expect a king of each color, and pawns that can still move
+    for color in (W, B):
+        if squares.count((color, KING)) != 1:
+            raise ValueError(f"Expected one {'white' if color is W else 'black'} king in FEN: {fen!r}")
+    edges = squares[:8] + squares[56:]
+    if (W, PAWN) in edges or (B, PAWN) in edges:
+        raise ValueError(f"Pawn on the first or last rank in FEN: {fen!r}")
+
+    if turn not in ("w", "b"):
+        raise ValueError(f"Expected w or b to move in FEN: {fen!r}")
+    turn = W if turn == "w" else B
+    # The side to move may not be able to capture the king, the generators would play it
+    occupied = sum(1 << sq for sq, piece in enumerate(squares) if piece is not None)
+    king = squares.index((turn ^ 1, KING))
+    for sq, piece in enumerate(squares):
+        if piece is not None and piece[0] is turn and piece_attacks(turn, piece[1], sq, occupied) >> king & 1:
+            raise ValueError(f"The side not to move is in check in FEN: {fen!r}")
+
+    if castles == "-":
+        castles = [[False, False], [False, False]]
+    else:
+        if castles.strip("KQkq"):
+            raise ValueError(f"Invalid castling rights in FEN: {fen!r}")
+        # Indexed as castles[color][side], QUEEN_SIDE first
+        castles = [["Q" in castles, "K" in castles], ["q" in castles, "k" in castles]]
+        for color in (W, B):
+            for side in (QUEEN_SIDE, KING_SIDE):
+                king_from, _, rook_from, _, _, _ = CASTLING[color][side]
+                if squares[king_from] != (color, KING) or squares[rook_from] != (color, ROOK):
+                    castles[color][side] = False
+
+    if en_passant == "-":
+        en_passant = None
+    else:
+        if len(en_passant) != 2 or en_passant[0] not in "abcdefgh" or en_passant[1] not in "12345678":
+            raise ValueError(f"Invalid en passant target in FEN: {fen!r}")
+        en_passant = notation_to_square(en_passant)
+        # The target is an empty square behind a pawn of the side that just moved
+        if en_passant // 8 != (2 if turn is W else 5) or squares[en_passant] is not None \
+                or squares[en_passant + 8 if turn is W else en_passant - 8] != (turn ^ 1, PAWN):
+            en_passant = None
+
+    try:
+        halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+        fullmove_clock = int(fields[5]) if len(fields) > 5 else 1
+    except ValueError:
+        raise ValueError(f"Invalid clocks in FEN: {fen!r}") from None
+    return squares, turn, castles, en_passant, halfmove_clock, fullmove_clock
+
+
+class Board:
+    # Square letters by column and columns by letter, shared by every board
+    col_to_char = {0: "a", 1: "b", 2: "c", 3: "d", 4: "e", 5: "f", 6: "g", 7: "h"}
+    char_to_col = {"a": 0, "b": 1, "c": 2, "d": 3, "e": 4, "f": 5, "g": 6, "h": 7}
+
+    def __init__(self, move_generator=MOVE_GENERATOR, fen=START_FEN, calc_moves=True):
+        """Sets up the board
+
+        Args:
+            move_generator (int): TILES or BITBOARD
+            fen (str): The position to start from, see parse_fen
+            calc_moves (bool): False to leave valid_moves and the tile markers empty, when loading many positions
+
+        Raises:
+            ValueError: If the FEN is malformed
+        """
+        squares, turn, castles, en_passant, halfmove_clock, fullmove_clock = parse_fen(fen)
+        self.move_generator = move_generator
+        self.checkmate = False
+        self.turn = turn
+        self.valid_moves = {}
+        # The moves calc_moves found last with the bitboard move generator, valid_moves is built from them
+        self.found_moves = []
+        self.color_in_check = None
+        self.checks = []
+        self.valid_castles = []
+        self.available_castles = castles
+        self.en_passant_target = square_to_notation(en_passant) if en_passant is not None else ""
+        self.halfmove_clock = halfmove_clock
+        self.fullmove_clock = fullmove_clock
+
+        self.tiles = [[Tile() for _ in range(8)] for _ in range(8)]
+        # Undo records of the moves made with make_move, and the hashes of the positions before them,
+        # which the engine reads at every node to find repetitions
+        self.history = []
+        self.hashes = []
+        # Bitboards of the tiles marked held by white, held by black, pinned by white, pinned by black
+        # and in check path, so only the tiles that change are written; None if unknown
+        self.markers = (0, 0, 0, 0, 0)
+
+        # Place the pieces on the tiles and the bitboards, and hash them, in one pass
+        self.bitboard = bitboard = BitBoard()
+        key = 0
+        for sq, piece in enumerate(squares):
+            if piece is not None:
+                color, role = piece
+                pos = SQUARE_TO_POS[sq]
+                self.tiles[pos.y][pos.x].piece = PIECE_CLASSES[color][role](pos)
+                bitboard.put(color, role, sq)
+                key ^= PIECE_KEYS[color][role][sq]
+        if turn is B:
+            key ^= BLACK_TO_MOVE_KEY
+        key ^= castles_key(castles)
+        if en_passant is not None:
+            key ^= EN_PASSANT_KEYS[en_passant % 8]
+            self.mark_for_en_passant(SQUARE_TO_POS[en_passant])
+        self.hash = key
+        if calc_moves:
+            self.calc_moves()
+
+    def __getitem__(self, pos):
+        return self.tiles[pos[1]][pos[0]]
+
+    @classmethod
+    def from_fen(cls, fen, move_generator=MOVE_GENERATOR, calc_moves=True):
+        """Creates a board from a FEN string, the clocks may be left out
+
+        Args:
+            fen (str): The position in Forsyth-Edwards Notation
+            move_generator (int): TILES or BITBOARD
+            calc_moves (bool): False to skip calculating the moves, when loading many positions
+
+        Returns:
+            Board: The board in the given position
+
+        Raises:
+            ValueError: If the FEN is malformed
+        """
+        return cls(move_generator, fen, calc_moves)
+
+    @property
+    def valid_moves(self):
+        """The tiles every piece may move to, as a dict of the Pos of the piece to a list of Pos"""
+        if self.moves_by_tile is None:
+            self.sort_moves_by_tile()
+        return self.moves_by_tile
+
+    @valid_moves.setter
+    def valid_moves(self, valid_moves):
+        self.moves_by_tile = valid_moves
+
+    @property
+    def valid_castles(self):
+        """The tiles the king may castle to, as a list of Pos"""
+        if self.castle_tiles is None:
+            self.sort_moves_by_tile()
+        return self.castle_tiles
+
+    @valid_castles.setter
+    def valid_castles(self, valid_castles):
+        self.castle_tiles = valid_castles
+
+    def sort_moves_by_tile(self):
+        """Fills valid_moves and valid_castles from the moves the bitboard move generator found last"""
+        moves_from = {sq: [] for sq in squares_of(self.bitboard.occupied)}
+        castles = []
+        for move in self.found_moves:
+            flag = move >> 12
+            # The board always promotes to a queen, so underpromotions are not listed
+            if flag & PROMOTION and flag & 3 != 3:
+                continue
+            to = SQUARE_TO_POS[move >> 6 & 63]
+            moves_from[move & 63].append(to)
+            if flag is KING_CASTLE or flag is QUEEN_CASTLE:
+                castles.append(to)
+        self.moves_by_tile = {SQUARE_TO_POS[sq]: moves for sq, moves in moves_from.items()}
+        self.castle_tiles = castles
+
+    def init_moves(self):
+        for row in self.tiles:
+            for tile in row:
+                if tile.piece:
+                    self.valid_moves[tile.piece.pos] = []
+
+    def change_turn(self):
+        if self.turn == W:
+            self.turn = B
+        else:
+            self.turn = W
+        self.hash ^= BLACK_TO_MOVE_KEY
+
+    def castle(self, pos):
+        """Castles the king of the side to move with the rook on pos"""
+        self.move(Pos(4, pos.y), Pos(2 if pos.x == 0 else 6, pos.y))
+
+    def mark_for_en_passant(self, pos):
+        self[pos].marked_for_en_passant = True
+
+    def demark_for_en_passant(self, pos):
+        self[pos].marked_for_en_passant = False
+
+    def en_passant_square(self):
+        """Returns the bitboard square of the en passant target, or None"""
+        if self.en_passant_target:
+            return notation_to_square(self.en_passant_target)
+        return None
+
+    def update_castles(self, old_pos, new_pos):
+        """Revokes the castling rights lost by moving the piece on old_pos to new_pos"""
+        piece = self[old_pos].piece
+        if piece.role is KING:
+            for side in (QUEEN_SIDE, KING_SIDE):
+                if self.available_castles[piece.color][side]:
+                    self.available_castles[piece.color][side] = False
+                    self.hash ^= CASTLE_KEYS[piece.color][side]
+        # Moving a rook away from, or capturing a rook on its starting tile
+        for pos in (old_pos, new_pos):
+            if pos.x in (0, 7) and pos.y in (0, 7):
+                color = W if pos.y == 7 else B
+                side = KING_SIDE if pos.x == 7 else QUEEN_SIDE
+                if self.available_castles[color][side]:
+                    self.available_castles[color][side] = False
+                    self.hash ^= CASTLE_KEYS[color][side]
+
+    def to_fen(self):
+        fen = ""
+        role_dict = {
+            0: "P",
+            1: "N",
+            2: "B",
+            3: "K",
+            4: "R",
+            5: "Q"
+        }
+        empty_count = 0
+        for row in self.tiles:
+            for tile in row:
+                if tile.piece:
+                    if empty_count > 0:
+                        fen += str(empty_count)
+                        empty_count = 0
+                    if tile.piece.color is W:
+                        fen += role_dict[tile.piece.role]
+                    elif tile.piece.color is B:
+                        fen += role_dict[tile.piece.role].lower()
+                else:
+                    empty_count += 1
+            if empty_count > 0:
+                fen += str(empty_count)
+                empty_count = 0
+            fen += "/"
+        fen = fen[:-1]
+        if self.turn is W:
+            fen += " w"
+        else:
+            fen += " b"
+
+        fen += " "
+        castling = False
+        if self.available_castles[W][KING_SIDE]:
+            fen += "K"
+            castling = True
+        if self.available_castles[W][QUEEN_SIDE]:
+            fen += "Q"
+            castling = True
+        if self.available_castles[B][KING_SIDE]:
+            fen += "k"
+            castling = True
+        if self.available_castles[B][QUEEN_SIDE]:
+            fen += "q"
+            castling = True
+        if not castling:
+            fen += "-"
+        fen += " "
+        if self.en_passant_target:
+            fen += self.en_passant_target
+        else:
+            fen += "-"
+        fen += " " + str(self.halfmove_clock)
+        fen += " " + str(self.fullmove_clock)
+        return fen
+
+    def find_move(self, old_pos, new_pos):
+        """Encodes the move of the piece on old_pos to new_pos, pawns reaching the last row become queens
+
+        Args:
+            old_pos (Pos): The position of the piece to move
+            new_pos (Pos): The position to move the piece to
+
+        Returns:
+            int: The move, encoded as in bitboard.encode_move
+        """
+        piece = self[old_pos].piece
+        target = self[new_pos].piece
+        if piece.role is KING and abs(new_pos.x - old_pos.x) == 2:
+            flag = KING_CASTLE if new_pos.x > old_pos.x else QUEEN_CASTLE
+        elif piece.role is PAWN and new_pos.y in (0, 7):
+            flag = (PROMOTION_CAPTURE if target else PROMOTION) | PROMOTION_ROLES.index(QUEEN)
+        elif piece.role is PAWN and new_pos.x != old_pos.x and not target:
+            flag = EN_PASSANT
+        elif piece.role is PAWN and abs(new_pos.y - old_pos.y) == 2:
+            flag = DOUBLE_PUSH
+        elif target:
+            flag = CAPTURE
+        else:
+            flag = QUIET
+        return encode_move(square(old_pos.x, old_pos.y), square(new_pos.x, new_pos.y), flag)
+
+    def move(self, old_pos, new_pos):
+        if not new_pos.valid:
+            return
+        if not self[old_pos].piece:
+            return
+        self.make_move(self.find_move(old_pos, new_pos))
+
+    def move_piece(self, old_pos, new_pos):
+        """Moves a piece between two empty-able tiles, without any of the rules"""
+        piece = self[old_pos].piece
+        piece.pos = new_pos
+        self[new_pos].piece = piece
+        self[old_pos].piece = None
+        old_sq, new_sq = square(old_pos.x, old_pos.y), square(new_pos.x, new_pos.y)
+        self.bitboard.move(old_sq, new_sq)
+        self.hash ^= PIECE_KEYS[piece.color][piece.role][old_sq] ^ PIECE_KEYS[piece.color][piece.role][new_sq]
+
+    def make_move(self, move):
+        """Makes a move and pushes an undo record, so it can be taken back with unmake_move
+
+        Args:
+            move (int): The move, encoded as in bitboard.encode_move
+        """
+        flag = move >> 12
+        old_pos = SQUARE_TO_POS[move & 63]
+        new_pos = SQUARE_TO_POS[move >> 6 & 63]
+        piece = self[old_pos].piece
+        captured_pos = Pos(new_pos.x, old_pos.y) if flag is EN_PASSANT else new_pos
+        captured = self[captured_pos].piece
+
+        # Undo record: move, moving piece, captured piece, castling rights, en passant target, halfmove clock, hash
+        self.history.append((move, piece, captured, (tuple(self.available_castles[W]), tuple(self.available_castles[B])),
+                             self.en_passant_target, self.halfmove_clock, self.hash))
+        self.hashes.append(self.hash)
+
+        if self.en_passant_target:
+            en_passant = self.en_passant_square()
+            self.demark_for_en_passant(SQUARE_TO_POS[en_passant])
+            self.hash ^= EN_PASSANT_KEYS[en_passant & 7]
+        self.en_passant_target = ""
+
+        if captured:
+            self[captured_pos].piece = None
+            captured_sq = square(captured_pos.x, captured_pos.y)
+            self.bitboard.remove(captured_sq)
+            self.hash ^= PIECE_KEYS[captured.color][captured.role][captured_sq]
+        self.update_castles(old_pos, new_pos)
+        self.move_piece(old_pos, new_pos)
+
+        if flag is KING_CASTLE or flag is QUEEN_CASTLE:
+            _, _, rook_from, rook_to, _, _ = CASTLING[piece.color][KING_SIDE if flag is KING_CASTLE else QUEEN_SIDE]
+            self.move_piece(SQUARE_TO_POS[rook_from], SQUARE_TO_POS[rook_to])
+        elif flag & PROMOTION:
+            role = PROMOTION_ROLES[flag & 3]
+            self[new_pos].piece = PIECE_CLASSES[piece.color][role](new_pos)
+            sq = move >> 6 & 63
+            self.bitboard.remove(sq)
+            self.bitboard.put(piece.color, role, sq)
+            self.hash ^= PIECE_KEYS[piece.color][PAWN][sq] ^ PIECE_KEYS[piece.color][role][sq]
+        elif flag is DOUBLE_PUSH:
+            # If pawn moved 2 tiles, mark the tile behind it for en passant
+            behind = Pos(new_pos.x, (old_pos.y + new_pos.y) // 2)
+            self.mark_for_en_passant(behind)
+            self.en_passant_target = behind.to_notation().lower()
+            self.hash ^= EN_PASSANT_KEYS[behind.x]
+
+        if piece.role is PAWN or captured:
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        if self.turn is B:
+            self.fullmove_clock += 1
+        self.change_turn()
+
+    def unmake_move(self):
+        """Takes back the last move made with make_move"""
+        move, piece, captured, castles, en_passant_target, halfmove_clock, position_hash = self.history.pop()
+        self.hashes.pop()
+        flag = move >> 12
+        old_pos = SQUARE_TO_POS[move & 63]
+        new_pos = SQUARE_TO_POS[move >> 6 & 63]
+
+        self.change_turn()
+        if self.turn is B:
+            self.fullmove_clock -= 1
+        self.halfmove_clock = halfmove_clock
+        self.available_castles = [list(castles[W]), list(castles[B])]
+
+        if flag & PROMOTION:
+            # Put the pawn back in place of the promoted piece
+            sq = move >> 6 & 63
+            self[new_pos].piece = piece
+            self.bitboard.remove(sq)
+            self.bitboard.put(piece.color, PAWN, sq)
+        elif flag is KING_CASTLE or flag is QUEEN_CASTLE:
+            _, _, rook_from, rook_to, _, _ = CASTLING[piece.color][KING_SIDE if flag is KING_CASTLE else QUEEN_SIDE]
+            self.move_piece(SQUARE_TO_POS[rook_to], SQUARE_TO_POS[rook_from])
+        self.move_piece(new_pos, old_pos)
+
+        if captured:
+            self[captured.pos].piece = captured
+            self.bitboard.put(captured.color, captured.role, square(captured.pos.x, captured.pos.y))
+
+        if self.en_passant_target:
+            self.demark_for_en_passant(SQUARE_TO_POS[self.en_passant_square()])
+        self.en_passant_target = en_passant_target
+        if en_passant_target:
+            self.mark_for_en_passant(SQUARE_TO_POS[self.en_passant_square()])
+        self.hash = position_hash
+
+    def get_king_position(self, color):
+        for row in self.tiles:
+            for tile in row:
+                if tile.piece and tile.piece.color is color and tile.piece.role is KING:
+                    return tile.piece.pos
+
+    def in_check(self):
+        """Returns True if the king of the side to move is attacked"""
+        bitboard = self.bitboard
+        return bitboard.attackers_to(bitboard.king_square(self.turn), self.turn ^ 1, bitboard.occupied) != 0
+
+    def legal_moves(self):
+        """Returns the legal moves of the side to move, encoded as in bitboard.encode_move"""
+        return self.bitboard.legal_moves(self.turn, self.available_castles, self.en_passant_square())
+
+    def book_moves(self, book):
+        """Looks the position up in an opening book
+
+        Args:
+            book (OpeningBook): The book, see book.py
+
+        Returns:
+            list: The book moves as (move, weight), heaviest first, leaving out moves that are not legal
+                  here, which only a hash collision can give
+        """
+        moves = book.probe(self.hash)
+        if moves:
+            legal = set(self.legal_moves())
+            moves = [(move, weight) for move, weight in moves if move in legal]
+        return moves
+
+    def probe_tablebase(self, tablebases):
+        """Looks the position up in endgame tablebases
+
+        Args:
+            tablebases (Tablebases): The tables, see tablebase.py
+
+        Returns:
+            tuple: WIN, DRAW or LOSS for the side to move and the plies to mate, or None if there is no table
+        """
+        return tablebases.probe(self)
+
+    def calc_moves(self):
+        # The held markers come from the attack map the bitboard keeps if it was asked to track one,
+        # as the board of the game window is, otherwise from one built for the call
+        if self.move_generator is BITBOARD:
+            self.calc_bitboard_moves()
+        else:
+            self.calc_tile_moves()
+
+    def calc_bitboard_moves(self):
+        """Finds the moves with the bitboard move generator and marks the tiles
+
+        Only the move list is kept, valid_moves and valid_castles are sorted out of it when they are read.
+        """
+        self.found_moves = moves = self.legal_moves()
+        self.moves_by_tile = self.castle_tiles = None
+        checkers, _ = self.calc_checks()
+        self.checkmate = bool(checkers) and not moves
+
+    def calc_checks(self):
+        """Finds the checks on the king of the side to move, and marks the tiles held, pinned and in check path
+
+        Returns:
+            tuple: Bitboard of the checking pieces, and of the tiles other pieces than the king may move to
+        """
+        bitboard = self.bitboard
+        self.color_in_check = None
+        self.checks = []
+        king = bitboard.king_square(self.turn)
+        checkers, check_mask = bitboard.check_mask(self.turn)
+        check_path = 0
+        if checkers:
+            self.color_in_check = self.turn
+            check_path = 1 << king
+            for checker in squares_of(checkers):
+                self.checks.append(SQUARE_TO_POS[checker])
+                check_path |= BETWEEN[king][checker]
+
+        held = (bitboard.attack_map or AttackMap(bitboard)).held
+        self.set_markers((held[W], held[B], bitboard.pins(B)[0], bitboard.pins(W)[0], check_path))
+        return checkers, check_mask
+
+    def set_markers(self, markers):
+        """Marks the tiles held, pinned and in check path, only writing the tiles that changed
+
+        Args:
+            markers (tuple): Bitboards of the tiles held by white, held by black, pinned by white,
+                             pinned by black and in the path of a check
+        """
+        old = self.markers
+        tiles = self.tiles
+        for index, name in enumerate(MARKERS):
+            new = markers[index]
+            changed = FULL if old is None else old[index] ^ new
+            for sq in squares_of(changed):
+                setattr(tiles[sq >> 3][sq & 7], name, new >> sq & 1 == 1)
+        self.markers = markers
+
+    def calc_tile_moves(self):
+        """Fills valid_moves and the tile markers by asking the pieces of the side to move for their moves
+
+        The check mask and the lines of the pinned pieces are found first, so every piece only lists
+        its legal moves: the king the tiles it can step to safely, the others the tiles of the check mask,
+        narrowed to their pin line if they are pinned.
+        """
+        bitboard = self.bitboard
+        turn = self.turn
+        self.valid_moves = {}
+        self.init_moves()
+        self.valid_castles = []
+        checkers, check_mask = self.calc_checks()
+        _, pin_lines = bitboard.pins(turn)
+        king_mask = bitboard.king_targets(turn)
+
+        moves = 0
+        for row in self.tiles:
+            for tile in row:
+                piece = tile.piece
+                if not piece or piece.color is not turn:
+                    continue
+                if piece.role is KING:
+                    piece.moves(self, king_mask)
+                elif check_mask:
+                    piece.moves(self, check_mask & pin_lines.get(piece.pos.index, FULL))
+                moves += len(self.valid_moves[piece.pos])
+        if not checkers:
+            for move in bitboard.castling_moves(turn, self.available_castles):
+                to = SQUARE_TO_POS[move >> 6 & 63]
+                self.valid_moves[SQUARE_TO_POS[move & 63]].append(to)
+                self.valid_castles.append(to)
+                moves += 1
+        self.checkmate = bool(checkers) and not moves
+
+    def __repr__(self):
+        result = ""
+        for row in self.tiles:
+            for tile in row:
+                if tile.piece:
+                    result += str(tile.piece) + " "
+                else:
+                    result += "  "
+            result += "\n"
+        return result
@@ -0,0 +1,226 @@
+"""
+    Opening book: the moves played from every position, keyed by Board.hash and stored as fixed size
+    records sorted by key, so a position is found with a binary search over the memory mapped file.
+    Nothing is loaded into Python objects, and every process using the book shares it in the page cache.
+
+    RECORD (12 bytes, little endian):
+        key     64-bit Board.hash
+        move    16 bits, see bitboard.encode_move
+        weight  16 bits, how often the move was played, scaled down to fit
+
+    Records of the same key are sorted by weight, heaviest first.
+
+    Usage:
+        python book.py build games.pgn book.bin --plies 16
+        python book.py build lines.txt book.bin
+        python book.py show book.bin [FEN]
+"""
+
+import argparse
+import mmap
+import os
+import random
+import struct
+import sys
+import time
+from collections import defaultdict
+
+from constants import *
+from bitboard import move_to_uci
+from board import Board
+from pgn import read_games, san_tokens, parse_san
+
+MAGIC = b"CHESSBK1"
+HEADER = struct.Struct("<8sI")
+RECORD = struct.Struct("<QHH")
+KEY = struct.Struct("<Q")
+MAX_WEIGHT = 0xFFFF
+
+## Plies of every game that go into the book
+BOOK_PLIES = 20
+
+
+def parse_uci(board, uci):
+    """Finds the legal move written in long algebraic notation, like e2e4 or e7e8q
+
+    Raises:
+        ValueError: If the move is not legal
+    """
+    for move in board.legal_moves():
+        if move_to_uci(move) == uci:
+            return move
+    raise ValueError(f"Illegal move {uci}")
+
+
+class OpeningBook:
+    """Reads a book file through a memory map"""
+
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            # An empty file can't be mapped, and a shorter one than the header can't be read
+            if os.fstat(file.fileno()).st_size < HEADER.size:
+                raise ValueError(f"{path} is not an opening book")
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.records = HEADER.unpack_from(self.data)
+        if magic != MAGIC or len(self.data) != HEADER.size + self.records * RECORD.size:
+            self.close()
+            raise ValueError(f"{path} is not an opening book")
+
+    def __len__(self):
+        return self.records
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.data.close()
+
+    def find(self, key):
+        """Returns the index of the first record of the key, or of the first larger key"""
+        data = self.data
+        low, high = 0, self.records
+        while low < high:
+            middle = (low + high) // 2
+            if KEY.unpack_from(data, HEADER.size + middle * RECORD.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def probe(self, key):
+        """Returns the moves stored for the key, as a list of (move, weight), heaviest first"""
+        moves = []
+        index = self.find(key)
+        while index < self.records:
+            record_key, move, weight = RECORD.unpack_from(self.data, HEADER.size + index * RECORD.size)
+            if record_key != key:
+                break
+            moves.append((move, weight))
+            index += 1
+        return moves
+
+    def choose(self, board, rng=random):
+        """Picks one of the book moves of the position on the board, by weight
+
+        Returns:
+            int: The move, or None if the position is not in the book
+        """
+        moves = board.book_moves(self)
+        if not moves:
+            return None
+        return rng.choices([move for move, _ in moves], [weight or 1 for _, weight in moves])[0]
+
+
+def pgn_lines(file, plies):
+    """Yields the start position and the moves of the first plies of every game of a PGN file"""
+    for headers, movetext in read_games(file):
+        board = None
+        moves = []
+        try:
+            board = Board.from_fen(headers.get("FEN", START_FEN), calc_moves=False)
+            for san in san_tokens(movetext):
+                if len(moves) >= plies:
+                    break
+                move = parse_san(board, san)
+                board.make_move(move)
+                moves.append(move)
+        except ValueError as error:
+            print(f"{headers.get('White', '?')} - {headers.get('Black', '?')}: {error}", file=sys.stderr)
+            if board is None:
+                continue
+        for _ in moves:
+            board.unmake_move()
+        yield board, moves
+
+
+def fen_lines(file, plies):
+    """Yields the start position and the moves of every line of a file of FENs followed by UCI moves"""
+    for number, line in enumerate(file, 1):
+        fields = line.split()
+        if not fields or line.startswith("#"):
+            continue
+        try:
+            board = Board.from_fen(" ".join(fields[:6]), calc_moves=False)
+            moves = []
+            for uci in fields[6:6 + plies]:
+                move = parse_uci(board, uci)
+                board.make_move(move)
+                moves.append(move)
+        except ValueError as error:
+            print(f"line {number}: {error}", file=sys.stderr)
+            continue
+        for _ in moves:
+            board.unmake_move()
+        yield board, moves
+
+
+def build(lines, path):
+    """Writes the book of the moves played in the lines
+
+    Args:
+        lines: Yields a Board and the moves played from it, as pgn_lines and fen_lines do
+        path (str): The book file to write
+
+    Returns:
+        int: The number of records written
+    """
+    weights = defaultdict(int)
+    for board, moves in lines:
+        for move in moves:
+            weights[board.hash, move] += 1
+            board.make_move(move)
+
+    by_key = defaultdict(list)
+    for (key, move), weight in weights.items():
+        by_key[key].append((move, weight))
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, len(weights)))
+        for key in sorted(by_key):
+            moves = sorted(by_key[key], key=lambda entry: -entry[1])
+            # Scale the weights of a position down together, so they keep their ratios
+            scale = max(moves[0][1] / MAX_WEIGHT, 1)
+            for move, weight in moves:
+                file.write(RECORD.pack(key, move, max(round(weight / scale), 1)))
+    return len(weights)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Builds and reads opening books")
+    commands = parser.add_subparsers(dest="command", required=True)
+    command = commands.add_parser("build", help="build a book from a PGN file or a file of FENs followed by UCI moves")
+    command.add_argument("source", help="a .pgn file, or a text file with a FEN and moves on every line")
+    command.add_argument("book")
+    command.add_argument("--plies", type=int, default=BOOK_PLIES, help="plies of every game or line to use")
+    command = commands.add_parser("show", help="print the book moves of a position and time the lookup")
+    command.add_argument("book")
+    command.add_argument("fen", nargs="*", help="the position, the start position if left out")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        start = time.perf_counter()
+        with open(args.source, encoding="utf-8", errors="replace") as file:
+            lines = pgn_lines(file, args.plies) if args.source.endswith(".pgn") else fen_lines(file, args.plies)
+            records = build(lines, args.book)
+        print(f"Wrote {records} moves in {time.perf_counter() - start:.2f} s")
+        return 0
+
+    board = Board.from_fen(" ".join(args.fen) if args.fen else START_FEN, calc_moves=False)
+    with OpeningBook(args.book) as book:
+        moves = board.book_moves(book)
+        total = sum(weight for _, weight in moves) or 1
+        for move, weight in moves:
+            print(f"{move_to_uci(move)}  {weight:6d}  {100 * weight / total:5.1f}%")
+        lookups = 100000
+        start = time.perf_counter()
+        for _ in range(lookups):
+            book.probe(board.hash)
+        elapsed = time.perf_counter() - start
+        print(f"{len(book)} records, {elapsed / lookups * 1e6:.2f} us per lookup")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
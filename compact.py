@@ -0,0 +1,366 @@
+"""
+    Compact board for hosting many games in one process: the position is only its bitboards,
+    and the moves made are kept in arrays instead of undo records of tuples and pieces.
+    There are no tiles, piece objects or markers, the legal moves and checks are computed when asked for.
+    It has the interface of Board that the engine and the game server use: legal_moves, make_move,
+    unmake_move, in_check, to_fen, hash, hashes, turn, halfmove_clock and history.
+
+    UNDO RECORD (32 bits):
+        bits 0-2    role of the captured piece + 1, 0 if none
+        bits 3-6    castling rights, bit color * 2 + side
+        bits 7-13   en passant target square, 64 if none
+        bits 14-31  halfmove clock
+
+    Usage:
+        python compact.py bench --games 10000 --plies 40
+        python compact.py check --games 1000
+"""
+
+import argparse
+import random
+import sys
+import time
+import tracemalloc
+from array import array
+
+from constants import *
+from bitboard import BitBoard, CASTLING, EN_PASSANT, KING_CASTLE, QUEEN_CASTLE, PROMOTION, PROMOTION_ROLES, \
+    DOUBLE_PUSH, square_to_notation
+from board import Board, parse_fen
+from zobrist import PIECE_KEYS, BLACK_TO_MOVE_KEY, CASTLE_KEYS, EN_PASSANT_KEYS
+
+NO_EN_PASSANT = 64
+
+
+def castle_bit(color, side):
+    return 1 << (color * 2 + side)
+
+
+## Castling rights of every 4-bit mask, as castles[color][side]
+CASTLE_RIGHTS = tuple(((bool(mask & castle_bit(W, QUEEN_SIDE)), bool(mask & castle_bit(W, KING_SIDE))),
+                       (bool(mask & castle_bit(B, QUEEN_SIDE)), bool(mask & castle_bit(B, KING_SIDE))))
+                      for mask in range(16))
+## XOR of the keys of the castling rights of every mask
+CASTLE_MASK_KEYS = [0] * 16
+for _mask in range(16):
+    for _color in (W, B):
+        for _side in (QUEEN_SIDE, KING_SIDE):
+            if _mask & castle_bit(_color, _side):
+                CASTLE_MASK_KEYS[_mask] ^= CASTLE_KEYS[_color][_side]
+## Castling rights kept when a piece leaves or lands on every square
+CASTLE_KEEP = [15] * 64
+for _color in (W, B):
+    for _side in (QUEEN_SIDE, KING_SIDE):
+        _king_from, _, _rook_from, _, _, _ = CASTLING[_color][_side]
+        CASTLE_KEEP[_king_from] &= ~castle_bit(_color, _side)
+        CASTLE_KEEP[_rook_from] &= ~castle_bit(_color, _side)
+del _mask, _color, _side, _king_from, _rook_from
+
+FEN_LETTERS = ("PNBKRQ", "pnbkrq")
+
+
+class CompactBoard:
+    """A position and the moves that led to it, in a few hundred bytes"""
+    __slots__ = ("bitboard", "turn", "castles", "en_passant", "halfmove_clock", "fullmove_clock", "hash",
+                 "moves", "undo", "hashes")
+
+    def __init__(self, fen=START_FEN):
+        """Sets up the board
+
+        Raises:
+            ValueError: If the FEN is malformed
+        """
+        squares, turn, castles, en_passant, halfmove_clock, fullmove_clock = parse_fen(fen)
+        self.bitboard = bitboard = BitBoard()
+        key = 0
+        for sq, piece in enumerate(squares):
+            if piece is not None:
+                color, role = piece
+                bitboard.put(color, role, sq)
+                key ^= PIECE_KEYS[color][role][sq]
+        self.turn = turn
+        self.castles = sum(castle_bit(color, side) for color in (W, B) for side in (QUEEN_SIDE, KING_SIDE)
+                           if castles[color][side])
+        self.en_passant = en_passant
+        self.halfmove_clock = halfmove_clock
+        self.fullmove_clock = fullmove_clock
+        if turn is B:
+            key ^= BLACK_TO_MOVE_KEY
+        key ^= CASTLE_MASK_KEYS[self.castles]
+        if en_passant is not None:
+            key ^= EN_PASSANT_KEYS[en_passant & 7]
+        self.hash = key
+        # The moves made, their undo records and the hash of the position before each of them
+        self.moves = array("H")
+        self.undo = array("I")
+        self.hashes = array("Q")
+
+    @classmethod
+    def from_fen(cls, fen, calc_moves=False):
+        """Creates a board from a FEN string, calc_moves is accepted for the signature of Board.from_fen"""
+        return cls(fen)
+
+    @property
+    def available_castles(self):
+        return CASTLE_RIGHTS[self.castles]
+
+    @property
+    def history(self):
+        """The undo records of the moves made, in the layout of Board.history"""
+        return History(self)
+
+    def en_passant_square(self):
+        return self.en_passant
+
+    def in_check(self):
+        """Returns True if the king of the side to move is attacked"""
+        bitboard = self.bitboard
+        return bitboard.attackers_to(bitboard.king_square(self.turn), self.turn ^ 1, bitboard.occupied) != 0
+
+    def legal_moves(self):
+        """Returns the legal moves of the side to move, encoded as in bitboard.encode_move"""
+        return self.bitboard.legal_moves(self.turn, CASTLE_RIGHTS[self.castles], self.en_passant)
+
+    def make_move(self, move):
+        """Makes a move, so it can be taken back with unmake_move
+
+        Args:
+            move (int): The move, encoded as in bitboard.encode_move
+        """
+        bitboard = self.bitboard
+        roles = bitboard.roles
+        frm = move & 63
+        to = move >> 6 & 63
+        flag = move >> 12
+        color = self.turn
+        role = roles[frm]
+        captured_sq = frm & 56 | to & 7 if flag is EN_PASSANT else to
+        captured = roles[captured_sq]
+        en_passant = self.en_passant
+
+        self.moves.append(move)
+        self.undo.append((0 if captured is None else captured + 1) | self.castles << 3
+                         | (NO_EN_PASSANT if en_passant is None else en_passant) << 7 | self.halfmove_clock << 14)
+        self.hashes.append(self.hash)
+
+        key = self.hash ^ BLACK_TO_MOVE_KEY
+        if en_passant is not None:
+            key ^= EN_PASSANT_KEYS[en_passant & 7]
+            self.en_passant = None
+        if captured is not None:
+            bitboard.remove(captured_sq)
+            key ^= PIECE_KEYS[color ^ 1][captured][captured_sq]
+        castles = self.castles & CASTLE_KEEP[frm] & CASTLE_KEEP[to]
+        key ^= CASTLE_MASK_KEYS[self.castles ^ castles]
+        self.castles = castles
+
+        bitboard.remove(frm)
+        placed = PROMOTION_ROLES[flag & 3] if flag & PROMOTION else role
+        bitboard.put(color, placed, to)
+        key ^= PIECE_KEYS[color][role][frm] ^ PIECE_KEYS[color][placed][to]
+        if flag is KING_CASTLE or flag is QUEEN_CASTLE:
+            _, _, rook_from, rook_to, _, _ = CASTLING[color][KING_SIDE if flag is KING_CASTLE else QUEEN_SIDE]
+            bitboard.remove(rook_from)
+            bitboard.put(color, ROOK, rook_to)
+            key ^= PIECE_KEYS[color][ROOK][rook_from] ^ PIECE_KEYS[color][ROOK][rook_to]
+        elif flag is DOUBLE_PUSH:
+            self.en_passant = (frm + to) // 2
+            key ^= EN_PASSANT_KEYS[to & 7]
+
+        if role is PAWN or captured is not None:
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        if color is B:
+            self.fullmove_clock += 1
+        self.turn = color ^ 1
+        self.hash = key
+
+    def unmake_move(self):
+        """Takes back the last move made with make_move"""
+        bitboard = self.bitboard
+        move = self.moves.pop()
+        undo = self.undo.pop()
+        self.hash = self.hashes.pop()
+        frm = move & 63
+        to = move >> 6 & 63
+        flag = move >> 12
+        self.turn = color = self.turn ^ 1
+        if color is B:
+            self.fullmove_clock -= 1
+
+        _, role = bitboard.remove(to)
+        bitboard.put(color, PAWN if flag & PROMOTION else role, frm)
+        if flag is KING_CASTLE or flag is QUEEN_CASTLE:
+            _, _, rook_from, rook_to, _, _ = CASTLING[color][KING_SIDE if flag is KING_CASTLE else QUEEN_SIDE]
+            bitboard.remove(rook_to)
+            bitboard.put(color, ROOK, rook_from)
+        captured = undo & 7
+        if captured:
+            bitboard.put(color ^ 1, captured - 1, frm & 56 | to & 7 if flag is EN_PASSANT else to)
+        self.castles = undo >> 3 & 15
+        en_passant = undo >> 7 & 127
+        self.en_passant = None if en_passant == NO_EN_PASSANT else en_passant
+        self.halfmove_clock = undo >> 14
+
+    def to_fen(self):
+        colors, roles = self.bitboard.colors, self.bitboard.roles
+        rows = []
+        for y in range(8):
+            row, empty = "", 0
+            for sq in range(y * 8, y * 8 + 8):
+                if colors[sq] is None:
+                    empty += 1
+                    continue
+                if empty:
+                    row += str(empty)
+                    empty = 0
+                row += FEN_LETTERS[colors[sq]][roles[sq]]
+            rows.append(row + str(empty) if empty else row)
+        castles = "".join(letter for letter, color, side in (("K", W, KING_SIDE), ("Q", W, QUEEN_SIDE),
+                                                             ("k", B, KING_SIDE), ("q", B, QUEEN_SIDE))
+                          if self.castles & castle_bit(color, side)) or "-"
+        en_passant = square_to_notation(self.en_passant) if self.en_passant is not None else "-"
+        return (f"{'/'.join(rows)} {'w' if self.turn is W else 'b'} {castles} {en_passant} "
+                f"{self.halfmove_clock} {self.fullmove_clock}")
+
+    def to_board(self, calc_moves=True):
+        """Returns the game as a Board, replayed from the position before its first move"""
+        moves = list(self.moves)
+        for _ in moves:
+            self.unmake_move()
+        board = Board.from_fen(self.to_fen(), calc_moves=False)
+        for move in moves:
+            self.make_move(move)
+            board.make_move(move)
+        if calc_moves:
+            board.calc_moves()
+        return board
+
+
+class History:
+    """The undo records of a CompactBoard as Board.history lays them out, built when read
+
+    The moving piece is left out, and the captured one is given as (color, role), None if there was no capture.
+    Building a record takes a tuple and the en passant notation, read CompactBoard.hashes for the hashes alone.
+    """
+    __slots__ = ("board",)
+
+    def __init__(self, board):
+        self.board = board
+
+    def __len__(self):
+        return len(self.board.moves)
+
+    def __getitem__(self, index):
+        board = self.board
+        moves = board.moves
+        if index < 0:
+            index += len(moves)
+        undo = board.undo[index]
+        captured = None
+        if undo & 7:
+            # The color of the side that moved flips every ply back from the side to move now
+            captured = (board.turn ^ ((len(moves) - index) & 1) ^ 1, (undo & 7) - 1)
+        en_passant = undo >> 7 & 127
+        return (moves[index], None, captured, CASTLE_RIGHTS[undo >> 3 & 15],
+                square_to_notation(en_passant) if en_passant != NO_EN_PASSANT else "", undo >> 14,
+                board.hashes[index])
+
+
+def random_games(games, plies, seed=0):
+    """Yields the moves of random games from the start position, each played until it ends or for plies moves"""
+    rng = random.Random(seed)
+    board = CompactBoard()
+    for _ in range(games):
+        moves = []
+        for _ in range(plies):
+            legal = board.legal_moves()
+            if not legal:
+                break
+            move = rng.choice(legal)
+            board.make_move(move)
+            moves.append(move)
+        for _ in moves:
+            board.unmake_move()
+        yield moves
+
+
+def live_bytes(factory, games):
+    """Returns the bytes allocated per game to keep the games alive at once, and the seconds it took"""
+    tracemalloc.start()
+    start_bytes = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    boards = [factory(moves) for moves in games]
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0] - start_bytes
+    tracemalloc.stop()
+    del boards
+    return size / len(games), elapsed
+
+
+def play(board, moves):
+    for move in moves:
+        board.make_move(move)
+    return board
+
+
+def benchmark(games, plies, seed=0):
+    """Prints the memory of games kept alive as Board and as CompactBoard"""
+    played = list(random_games(games, plies, seed))
+    print(f"{games} games of up to {plies} plies, {sum(map(len, played))} plies in all")
+    for name, factory in (("Board", lambda moves: play(Board.from_fen(START_FEN, calc_moves=False), moves)),
+                          ("CompactBoard", lambda moves: play(CompactBoard(), moves))):
+        size, elapsed = live_bytes(factory, played)
+        print(f"{name:24s} {size:9.0f} bytes/game  {size * games / 2 ** 20:7.1f} MiB  {elapsed:.2f} s")
+
+
+def check(games, plies, seed=0):
+    """Plays random games on a Board and a CompactBoard side by side, returns the number of mismatches"""
+    errors = 0
+    for moves in random_games(games, plies, seed):
+        board = Board.from_fen(START_FEN, calc_moves=False)
+        compact = CompactBoard()
+        states = []
+        for move in moves:
+            states.append(compact.to_fen())
+            board.make_move(move)
+            compact.make_move(move)
+            captured = board.history[-1][2]
+            if (compact.to_fen(), compact.hash) != (board.to_fen(), board.hash) \
+                    or sorted(compact.legal_moves()) != sorted(board.legal_moves()) \
+                    or compact.history[-1][2] != (captured and (captured.color, captured.role)) \
+                    or list(compact.hashes) != board.hashes:
+                errors += 1
+                print(f"FAIL after {' '.join(map(str, compact.moves))}: {compact.to_fen()} {board.to_fen()}")
+                break
+        for state in reversed(states):
+            compact.unmake_move()
+            if compact.to_fen() != state:
+                errors += 1
+                print(f"FAIL unmaking to {state}: {compact.to_fen()}")
+                break
+    return errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measures and checks the compact board")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name, help, games in (("bench", "print the bytes per game of live games", 10000),
+                              ("check", "compare random games with Board", 1000)):
+        command = commands.add_parser(name, help=help)
+        command.add_argument("--games", type=int, default=games)
+        command.add_argument("--plies", type=int, default=40)
+        command.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.command == "bench":
+        benchmark(args.games, args.plies, args.seed)
+        return 0
+    errors = check(args.games, args.plies, args.seed)
+    print(f"{errors} mismatches")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
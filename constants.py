@@ -1,45 +1,3 @@
-import pygame
-import os
-
-
-# Global functions
-
-def load(name: str):
-    """Loads an image from the assets folder"""
-    if name.endswith(".png") or name.endswith(".jpg"):
-        return pygame.transform.scale(pygame.image.load(os.path.join("assets", name)), (SQUARE_SIZE, SQUARE_SIZE))
-
-
-def load_as_image(piece):
-    """Returns the image for the piece
-
-    Args:
-        piece (Piece): The piece to get the image for
-
-    Returns:
-        image: The image representing the piece
-    """
-    switcher = {
-        W: {
-            PAWN: W_PAWN,
-            KNIGHT: W_KNIGHT,
-            BISHOP: W_BISHOP,
-            KING: W_KING,
-            ROOK: W_ROOK,
-            QUEEN: W_QUEEN
-        },
-        B: {
-            PAWN: B_PAWN,
-            KNIGHT: B_KNIGHT,
-            BISHOP: B_BISHOP,
-            KING: B_KING,
-            ROOK: B_ROOK,
-            QUEEN: B_QUEEN
-        }
-    }
-    return switcher[piece.color][piece.role]
-
-
 # Constants
 
 ## Turn/Color
@@ -72,12 +30,38 @@ PIECE_TO_STRING = {
     QUEEN: "Queen"
 }
 
+## Move generation backends
+TILES = 0
+BITBOARD = 1
+MOVE_GENERATOR = BITBOARD
+
+## FEN letter to piece type
+CHAR_TO_ROLE = {"p": PAWN, "n": KNIGHT, "b": BISHOP, "k": KING, "r": ROOK, "q": QUEEN}
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+## Computer opponent, ENGINE_COLOR is the color it plays or None for two players
+ENGINE_COLOR = None
+ENGINE_TIME = 1.0
+## Processes the engine searches with, more than 1 uses the parallel search
+ENGINE_WORKERS = 1
+## Play the moves of book.bin while the game is in the opening book
+USE_BOOK = True
+## Play and search with the endgame tables of the tables directory, once few enough pieces are left
+USE_TABLEBASES = True
+
+## Continue the unfinished last game of games.bin at startup, every move is saved there
+RESUME_GAME = True
+
 ## Debug
 DEBUG = True
+## Time every frame and click, F3 shows the timings over the board, they are written to telemetry.json on exit
+TELEMETRY = False
 
-## FPS
+## FPS, the most frames drawn per second
 FPS = 60
-CLOCK = pygame.time.Clock()
+## Wait for input instead of drawing every frame, and how often to look at a thinking engine in milliseconds
+EVENT_DRIVEN = True
+ENGINE_POLL = 100
 
 ## Window
 SIZE = 8
@@ -97,19 +81,5 @@ GREY = (128, 128, 128)
 YELLOW = (255, 255, 0)
 CYAN = (0, 255, 255)
 
-## Images
-B_BISHOP = load("b_bishop.png")
-B_KING = load("b_king.png")
-B_KNIGHT = load("b_knight.png")
-B_PAWN = load("b_pawn.png")
-B_QUEEN = load("b_queen.png")
-B_ROOK = load("b_rook.png")
-W_BISHOP = load("w_bishop.png")
-W_KING = load("w_king.png")
-W_KNIGHT = load("w_knight.png")
-W_PAWN = load("w_pawn.png")
-W_QUEEN = load("w_queen.png")
-W_ROOK = load("w_rook.png")
-
 ## Valid values for x and y
 VALID_RANGE = range(0, SIZE)
@@ -0,0 +1,302 @@
+"""
+    Negamax search with alpha-beta pruning over Board, using make_move/unmake_move.
+    Scores are in centipawns from the point of view of the side to move.
+"""
+
+import time
+
+from constants import *
+from bitboard import CAPTURE, PROMOTION, squares_of, popcount, move_to_uci
+from tt import TranspositionTable, EXACT, LOWER, UPPER
+from tablebase import WIN, LOSS
+
+## Score of being mated now, mates further away score closer to 0
+MATE = 100000
+INFINITY = MATE + 1
+## Scores beyond this are mates, the transposition table stores them relative to the node
+MATE_THRESHOLD = MATE - 1000
+
+## Material values in centipawns
+PIECE_VALUES = {PAWN: 100, KNIGHT: 320, BISHOP: 330, KING: 0, ROOK: 500, QUEEN: 900}
+
+## Piece-square bonuses for white, indexed by square (a8 first), black uses the square with its row flipped
+PIECE_SQUARE = {
+    PAWN: [
+        0, 0, 0, 0, 0, 0, 0, 0,
+        50, 50, 50, 50, 50, 50, 50, 50,
+        10, 10, 20, 30, 30, 20, 10, 10,
+        5, 5, 10, 25, 25, 10, 5, 5,
+        0, 0, 0, 20, 20, 0, 0, 0,
+        5, -5, -10, 0, 0, -10, -5, 5,
+        5, 10, 10, -20, -20, 10, 10, 5,
+        0, 0, 0, 0, 0, 0, 0, 0,
+    ],
+    KNIGHT: [
+        -50, -40, -30, -30, -30, -30, -40, -50,
+        -40, -20, 0, 0, 0, 0, -20, -40,
+        -30, 0, 10, 15, 15, 10, 0, -30,
+        -30, 5, 15, 20, 20, 15, 5, -30,
+        -30, 0, 15, 20, 20, 15, 0, -30,
+        -30, 5, 10, 15, 15, 10, 5, -30,
+        -40, -20, 0, 5, 5, 0, -20, -40,
+        -50, -40, -30, -30, -30, -30, -40, -50,
+    ],
+    BISHOP: [
+        -20, -10, -10, -10, -10, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 10, 10, 5, 0, -10,
+        -10, 5, 5, 10, 10, 5, 5, -10,
+        -10, 0, 10, 10, 10, 10, 0, -10,
+        -10, 10, 10, 10, 10, 10, 10, -10,
+        -10, 5, 0, 0, 0, 0, 5, -10,
+        -20, -10, -10, -10, -10, -10, -10, -20,
+    ],
+    KING: [
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -20, -30, -30, -40, -40, -30, -30, -20,
+        -10, -20, -20, -20, -20, -20, -20, -10,
+        20, 20, 0, 0, 0, 0, 20, 20,
+        20, 30, 10, 0, 0, 10, 30, 20,
+    ],
+    ROOK: [
+        0, 0, 0, 0, 0, 0, 0, 0,
+        5, 10, 10, 10, 10, 10, 10, 5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        0, 0, 0, 5, 5, 0, 0, 0,
+    ],
+    QUEEN: [
+        -20, -10, -10, -5, -5, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 5, 5, 5, 0, -10,
+        -5, 0, 5, 5, 5, 5, 0, -5,
+        0, 0, 5, 5, 5, 5, 0, -5,
+        -10, 5, 5, 5, 5, 5, 0, -10,
+        -10, 0, 5, 0, 0, 0, 0, -10,
+        -20, -10, -10, -5, -5, -10, -10, -20,
+    ],
+}
+
+## Material and position of every piece on every square, for each color
+SQUARE_VALUES = {
+    W: {role: [PIECE_VALUES[role] + table[sq] for sq in range(64)] for role, table in PIECE_SQUARE.items()},
+    B: {role: [PIECE_VALUES[role] + table[sq ^ 56] for sq in range(64)] for role, table in PIECE_SQUARE.items()},
+}
+
+## Nodes searched between two looks at the clock
+CHECK_EVERY = 1024
+
+
+def evaluate(board):
+    """Returns the static score of the position for the side to move"""
+    score = 0
+    white, black = board.bitboard.pieces
+    for role in (PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING):
+        values = SQUARE_VALUES[W][role]
+        for sq in squares_of(white[role]):
+            score += values[sq]
+        values = SQUARE_VALUES[B][role]
+        for sq in squares_of(black[role]):
+            score -= values[sq]
+    return score if board.turn is W else -score
+
+
+def is_repetition(board):
+    """Returns True if the position occurred before since the last capture or pawn move"""
+    hashes = board.hashes
+    # Only positions with the same side to move can repeat, those are every second one
+    for index in range(len(hashes) - 2, max(len(hashes) - board.halfmove_clock, 0) - 1, -2):
+        if hashes[index] == board.hash:
+            return True
+    return False
+
+
+class Engine:
+    """Iterative deepening alpha-beta search with a time, node and depth budget"""
+
+    def __init__(self, max_time=1.0, max_nodes=None, max_depth=64, hash_mb=16, tablebases=None):
+        """Initializes the engine
+
+        Args:
+            max_time (float): Seconds to search for per move, or None for no limit
+            max_nodes (int): Nodes to search per move, or None for no limit
+            max_depth (int): The deepest iteration to start
+            hash_mb (float): Memory of the transposition table, kept across searches
+            tablebases (Tablebases): Endgame tables giving the exact score of the positions they hold, or None
+        """
+        self.tt = TranspositionTable(hash_mb)
+        self.tablebases = tablebases
+        self.max_time = max_time
+        self.max_nodes = max_nodes
+        self.max_depth = max_depth
+        self.nodes = 0
+        self.deadline = None
+        self.stopped = False
+        self.root_pv = []
+
+    def stop(self):
+        """Stops the running search, it returns the result of its last full iteration"""
+        self.stopped = True
+
+    def out_of_budget(self):
+        if self.max_nodes is not None and self.nodes >= self.max_nodes:
+            return True
+        return self.deadline is not None and time.perf_counter() >= self.deadline
+
+    def search(self, board, on_iteration=None):
+        """Searches the position on the board, deepening one ply at a time until the budget runs out
+
+        Args:
+            board (Board): The position to search, it is restored before returning
+            on_iteration (callable): Called as on_iteration(depth, score, nodes, seconds, pv) after every iteration
+
+        Returns:
+            tuple: The best move, its score, and the principal variation as a list of moves
+        """
+        start = time.perf_counter()
+        self.deadline = start + self.max_time if self.max_time is not None else None
+        self.nodes = 0
+        self.stopped = False
+        self.root_pv = []
+        self.tt.new_search()
+        best_move, best_score = None, -INFINITY
+
+        moves = board.legal_moves()
+        if moves:
+            # Always have a move to play, even if the first iteration can't finish
+            best_move = moves[0]
+        for depth in range(1, self.max_depth + 1):
+            pv = []
+            score = self.negamax(board, depth, 0, -INFINITY, INFINITY, pv)
+            if self.stopped:
+                break
+            best_score = score
+            self.root_pv = pv
+            if pv:
+                best_move = pv[0]
+            if on_iteration:
+                on_iteration(depth, score, self.nodes, time.perf_counter() - start, pv)
+            if abs(score) >= MATE - self.max_depth or self.out_of_budget():
+                break
+        return best_move, best_score, self.root_pv
+
+    def order_moves(self, board, moves, ply, hash_move=None):
+        """Sorts the moves so the hash move and the previous best line come first, then captures by victim and attacker value"""
+        roles = board.bitboard.roles
+        pv_move = self.root_pv[ply] if ply < len(self.root_pv) else None
+
+        def key(move):
+            if move == hash_move:
+                return -INFINITY - 1
+            if move == pv_move:
+                return -INFINITY
+            if move >> 12 & CAPTURE:
+                victim = roles[move >> 6 & 63]
+                victim_value = PIECE_VALUES[victim] if victim is not None else PIECE_VALUES[PAWN]
+                return PIECE_VALUES[roles[move & 63]] // 100 - victim_value
+            return 0
+        moves.sort(key=key)
+        return moves
+
+    def negamax(self, board, depth, ply, alpha, beta, pv):
+        self.nodes += 1
+        if self.nodes % CHECK_EVERY == 0 and self.out_of_budget():
+            self.stopped = True
+        if self.stopped:
+            return 0
+        if ply and (board.halfmove_clock >= 100 or is_repetition(board)):
+            return 0
+        if ply and self.tablebases is not None and popcount(board.bitboard.occupied) <= self.tablebases.max_pieces:
+            probed = self.tablebases.probe(board)
+            if probed is not None:
+                result, distance = probed
+                if result == WIN:
+                    return MATE - ply - distance
+                if result == LOSS:
+                    return -MATE + ply + distance
+                return 0
+
+        moves = board.legal_moves()
+        if not moves:
+            return -MATE + ply if board.in_check() else 0
+        if depth <= 0:
+            return self.quiescence(board, ply, alpha, beta)
+
+        hash_move = None
+        entry = self.tt.probe(board.hash)
+        if entry:
+            score, entry_depth, bound, hash_move = entry
+            # Mate scores are stored relative to the position, not the root
+            if score >= MATE_THRESHOLD:
+                score -= ply
+            elif score <= -MATE_THRESHOLD:
+                score += ply
+            if ply and entry_depth >= depth:
+                if bound is EXACT or (bound is LOWER and score >= beta) or (bound is UPPER and score <= alpha):
+                    return score
+
+        original_alpha = alpha
+        best_move = None
+        for move in self.order_moves(board, moves, ply, hash_move):
+            child_pv = []
+            board.make_move(move)
+            score = -self.negamax(board, depth - 1, ply + 1, -beta, -alpha, child_pv)
+            board.unmake_move()
+            if self.stopped:
+                return 0
+            if score > alpha:
+                alpha = score
+                best_move = move
+                pv[:] = [move] + child_pv
+                if score >= beta:
+                    break
+
+        if alpha >= beta:
+            bound = LOWER
+        elif alpha > original_alpha:
+            bound = EXACT
+        else:
+            bound = UPPER
+        stored = alpha
+        if stored >= MATE_THRESHOLD:
+            stored += ply
+        elif stored <= -MATE_THRESHOLD:
+            stored -= ply
+        self.tt.store(board.hash, stored, depth, bound, best_move)
+        return alpha
+
+    def quiescence(self, board, ply, alpha, beta):
+        """Searches captures and promotions only, until the position is quiet"""
+        self.nodes += 1
+        if self.nodes % CHECK_EVERY == 0 and self.out_of_budget():
+            self.stopped = True
+        if self.stopped:
+            return 0
+
+        stand_pat = evaluate(board)
+        if stand_pat >= beta:
+            return beta
+        alpha = max(alpha, stand_pat)
+
+        moves = [move for move in board.legal_moves() if move >> 12 & (CAPTURE | PROMOTION)]
+        for move in self.order_moves(board, moves, ply):
+            board.make_move(move)
+            score = -self.quiescence(board, ply + 1, -beta, -alpha)
+            board.unmake_move()
+            if self.stopped:
+                return 0
+            if score > alpha:
+                alpha = score
+                if score >= beta:
+                    break
+        return alpha
+
+
+def format_pv(pv):
+    return " ".join(move_to_uci(move) for move in pv)
@@ -0,0 +1,305 @@
+"""
+    Batches of positions as NumPy arrays, for featurizing and evaluating many positions at once.
+    A batch keeps one code per square and position: 0 for an empty square, else 1 + color * 6 + role,
+    so code - 1 is the plane of the piece in the (N, 12, 8, 8) planes. Squares are indexed as in bitboard.py.
+
+    Every feature is computed over the whole batch at once, board_features computes the same row
+    from a single Board, and is what the batch is checked and benchmarked against.
+
+    Usage:
+        python features.py 20000
+        python features.py --check
+"""
+
+import argparse
+import random
+import sys
+import time
+
+import numpy as np
+
+from constants import *
+from bitboard import KNIGHT_OFFSETS, KING_OFFSETS, DIRECTIONS, ORTHOGONAL, DIAGONAL, PAWN_DIRECTION, \
+    AttackMap, squares_of, popcount
+from board import Board, FEN_EXPAND
+from engine import PIECE_VALUES, SQUARE_VALUES, evaluate
+
+PLANES = 12
+## Code of every square of a FEN placement, 255 for characters that are not pieces
+FEN_CODES = np.full(256, 255, np.uint8)
+FEN_CODES[ord(".")] = 0
+for _char, _role in CHAR_TO_ROLE.items():
+    FEN_CODES[ord(_char.upper())] = 1 + W * 6 + _role
+    FEN_CODES[ord(_char)] = 1 + B * 6 + _role
+## Expands the digits of a FEN placement and drops the row separators
+FEN_SQUARES = {**FEN_EXPAND, ord("/"): None}
+
+## Color of every code, -1 for an empty square
+CODE_COLORS = np.array([-1] + [W] * 6 + [B] * 6, np.int8)
+## Material of every code, and material and piece-square value from the point of view of white
+MATERIAL = np.zeros((2, 13), np.int32)
+SQUARE_TABLE = np.zeros((13, 64), np.int32)
+for _color in (W, B):
+    for _role in range(6):
+        _code = 1 + _color * 6 + _role
+        MATERIAL[_color, _code] = PIECE_VALUES[_role]
+        SQUARE_TABLE[_code] = SQUARE_VALUES[_color][_role]
+SQUARE_TABLE[1 + B * 6:] *= -1
+del _char, _color, _role, _code
+## Piece-square bonus alone, without the material
+BONUS_TABLE = SQUARE_TABLE - MATERIAL[W][:, None] + MATERIAL[B][:, None]
+SQUARE_INDEX = np.arange(64)
+
+## Length of a row of PositionBatch.features, see there for its layout
+FEATURES = PLANES * 64 + 2 * 64 + 7
+
+
+def shift(planes, dx, dy):
+    """Moves every square of the (N, 8, 8) planes by dx, dy, dropping what falls off the board"""
+    shifted = np.zeros_like(planes)
+    shifted[:, max(dy, 0):SIZE + min(dy, 0), max(dx, 0):SIZE + min(dx, 0)] = \
+        planes[:, max(-dy, 0):SIZE + min(-dy, 0), max(-dx, 0):SIZE + min(-dx, 0)]
+    return shifted
+
+
+class PositionBatch:
+    """Positions stored as an (N, 64) array of square codes and an (N,) array of the side to move"""
+
+    def __init__(self, squares, turns):
+        """
+        Args:
+            squares (np.ndarray): (N, 64) uint8 codes, 0 empty, else 1 + color * 6 + role
+            turns (np.ndarray): (N,) uint8 side to move
+        """
+        self.squares = squares
+        self.turns = turns
+
+    def __len__(self):
+        return len(self.squares)
+
+    @classmethod
+    def from_boards(cls, boards):
+        """Builds the batch from the bitboards of the boards"""
+        boards = list(boards)
+        codes = bytearray(len(boards) * 64)
+        turns = bytearray(len(boards))
+        for index, board in enumerate(boards):
+            bitboard = board.bitboard
+            colors, roles = bitboard.colors, bitboard.roles
+            base = index * 64
+            for sq in squares_of(bitboard.occupied):
+                codes[base + sq] = 1 + colors[sq] * 6 + roles[sq]
+            turns[index] = board.turn
+        return cls(np.frombuffer(codes, np.uint8).reshape(-1, 64), np.frombuffer(turns, np.uint8))
+
+    @classmethod
+    def from_fens(cls, fens):
+        """Builds the batch from FENs, only their placement and side to move are read
+
+        Raises:
+            ValueError: If the placement of a FEN doesn't have 64 squares of pieces
+        """
+        placements = []
+        turns = bytearray()
+        for fen in fens:
+            fields = fen.split()
+            placement = fields[0].translate(FEN_SQUARES) if fields else ""
+            if len(placement) != 64:
+                raise ValueError(f"Invalid FEN placement: {fen!r}")
+            placements.append(placement)
+            turns.append(B if len(fields) > 1 and fields[1] == "b" else W)
+        codes = FEN_CODES[np.frombuffer("".join(placements).encode("latin-1"), np.uint8)].reshape(-1, 64)
+        if (codes == 255).any():
+            raise ValueError(f"Invalid FEN placement: {fens[int((codes == 255).any(axis=1).argmax())]!r}")
+        return cls(codes, np.frombuffer(turns, np.uint8))
+
+    def planes(self):
+        """Returns the (N, 12, 8, 8) uint8 planes, one per color and role, color * 6 + role"""
+        return (self.squares[:, None, :] == np.arange(1, PLANES + 1, dtype=np.uint8)[None, :, None]) \
+            .astype(np.uint8).reshape(-1, PLANES, SIZE, SIZE)
+
+    def material(self):
+        """Returns the (N, 2) material of white and black"""
+        return np.stack([MATERIAL[W][self.squares].sum(axis=1), MATERIAL[B][self.squares].sum(axis=1)], axis=1)
+
+    def piece_square(self):
+        """Returns the (N,) piece-square bonus of the engine, without the material, from the point of view of white"""
+        return BONUS_TABLE[self.squares, SQUARE_INDEX].sum(axis=1)
+
+    def evaluate(self):
+        """Returns the (N,) score of engine.evaluate, for the side to move"""
+        score = SQUARE_TABLE[self.squares, SQUARE_INDEX].sum(axis=1)
+        return np.where(self.turns == W, score, -score)
+
+    def attack_counts(self):
+        """Returns the (N, 2, 64) number of pieces of each color attacking every square"""
+        return self.pawn_attack_counts() + self.piece_attack_counts()
+
+    def pawn_attack_counts(self):
+        """Returns the (N, 2, 64) number of pawns of each color attacking every square"""
+        squares = self.squares.reshape(-1, SIZE, SIZE)
+        counts = np.zeros((len(self), 2, SIZE, SIZE), np.uint8)
+        for color in (W, B):
+            pawns = (squares == 1 + color * 6 + PAWN).astype(np.uint8)
+            for dx in (-1, 1):
+                counts[:, color] += shift(pawns, dx, PAWN_DIRECTION[color])
+        return counts.reshape(-1, 2, 64)
+
+    def piece_attack_counts(self):
+        """Returns the (N, 2, 64) number of pieces other than pawns of each color attacking every square"""
+        squares = self.squares.reshape(-1, SIZE, SIZE)
+        empty = (squares == 0).astype(np.uint8)
+        counts = np.zeros((len(self), 2, SIZE, SIZE), np.uint8)
+        for color in (W, B):
+            total = counts[:, color]
+            code = 1 + color * 6
+            for offsets, role in ((KNIGHT_OFFSETS, KNIGHT), (KING_OFFSETS, KING)):
+                pieces = (squares == code + role).astype(np.uint8)
+                for dx, dy in offsets:
+                    total += shift(pieces, dx, dy)
+            queens = squares == code + QUEEN
+            for directions, role in ((ORTHOGONAL, ROOK), (DIAGONAL, BISHOP)):
+                sliders = ((squares == code + role) | queens).astype(np.uint8)
+                for direction in directions:
+                    dx, dy = DIRECTIONS[direction]
+                    # The rays go on through empty squares only, the first piece on them is attacked and stops them
+                    ray = shift(sliders, dx, dy)
+                    while ray.any():
+                        total += ray
+                        ray = shift(ray * empty, dx, dy)
+        return counts.reshape(-1, 2, 64)
+
+    def mobility(self, piece_counts=None):
+        """Returns the (N, 2) number of squares attacked by the pieces other than pawns, and not taken by their own pieces
+
+        Args:
+            piece_counts (np.ndarray): The result of piece_attack_counts, computed if left out
+        """
+        if piece_counts is None:
+            piece_counts = self.piece_attack_counts()
+        colors = CODE_COLORS[self.squares]
+        return np.stack([(piece_counts[:, color] * (colors != color)).sum(axis=1, dtype=np.int32)
+                         for color in (W, B)], axis=1)
+
+    def features(self):
+        """Returns the (N, FEATURES) float32 rows of features
+
+        Each row is the 12 planes, the attack counts of white then black, the material of white and black,
+        the piece-square bonus, the mobility of white and black, the score of engine.evaluate and the side to move.
+        """
+        piece_counts = self.piece_attack_counts()
+        return np.concatenate([
+            self.planes().reshape(-1, PLANES * 64),
+            (self.pawn_attack_counts() + piece_counts).reshape(-1, 2 * 64),
+            self.material(),
+            self.piece_square()[:, None],
+            self.mobility(piece_counts),
+            self.evaluate()[:, None],
+            self.turns[:, None],
+        ], axis=1, dtype=np.float32)
+
+
+def board_features(board):
+    """Returns the row of PositionBatch.features for a single Board, square by square"""
+    bitboard = board.bitboard
+    planes = [0.0] * (PLANES * 64)
+    counts = [[0] * 64, [0] * 64]
+    material = [0, 0]
+    bonus = mobility_white = mobility_black = 0
+    for sq in squares_of(bitboard.occupied):
+        color, role = bitboard.colors[sq], bitboard.roles[sq]
+        planes[(color * 6 + role) * 64 + sq] = 1.0
+        material[color] += PIECE_VALUES[role]
+        value = SQUARE_VALUES[color][role][sq] - PIECE_VALUES[role]
+        bonus += value if color is W else -value
+    # The map of a board that tracks its attacks is up to date, otherwise one is built for this pass only,
+    # so the board doesn't start updating a map on every move
+    attack_map = bitboard.attack_map or AttackMap(bitboard)
+    for sq in squares_of(bitboard.occupied):
+        attacks = attack_map.attacks_from[sq]
+        color = bitboard.colors[sq]
+        for to in squares_of(attacks):
+            counts[color][to] += 1
+        if bitboard.roles[sq] is not PAWN:
+            mobile = popcount(attacks & ~bitboard.occupancy[color])
+            if color is W:
+                mobility_white += mobile
+            else:
+                mobility_black += mobile
+    return planes + counts[W] + counts[B] + material + [bonus, mobility_white, mobility_black, evaluate(board), board.turn]
+
+
+def random_fens(count, seed=0, max_plies=120):
+    """Returns FENs of the positions of random games from the start position"""
+    rng = random.Random(seed)
+    fens = []
+    while len(fens) < count:
+        board = Board(calc_moves=False)
+        for _ in range(rng.randrange(max_plies)):
+            moves = board.legal_moves()
+            if not moves:
+                break
+            board.make_move(rng.choice(moves))
+        fens.append(board.to_fen())
+    return fens
+
+
+def check(fens):
+    """Compares the features of the batch with board_features, returns True if every row matches"""
+    batch = PositionBatch.from_fens(fens).features()
+    boards = [Board.from_fen(fen, calc_moves=False) for fen in fens]
+    passed = np.array_equal(batch, PositionBatch.from_boards(boards).features())
+    if not passed:
+        print("FAIL from_boards and from_fens differ")
+    for fen, board, row in zip(fens, boards, batch):
+        if not np.array_equal(row, np.array(board_features(board), np.float32)):
+            print(f"FAIL {fen}")
+            passed = False
+    if passed:
+        print(f"ok   {len(fens)} positions")
+    return passed
+
+
+def benchmark(fens):
+    start = time.perf_counter()
+    rows = [board_features(Board.from_fen(fen, calc_moves=False)) for fen in fens]
+    single = time.perf_counter() - start
+    print(f"Board by Board       {single:7.3f} s  {len(rows) / single:9.0f} positions/s")
+
+    start = time.perf_counter()
+    features = PositionBatch.from_fens(fens).features()
+    elapsed = time.perf_counter() - start
+    print(f"Batch from FENs      {elapsed:7.3f} s  {len(features) / elapsed:9.0f} positions/s  speedup {single / elapsed:.1f}")
+
+    boards = [Board.from_fen(fen, calc_moves=False) for fen in fens]
+    start = time.perf_counter()
+    features = PositionBatch.from_boards(boards).features()
+    elapsed = time.perf_counter() - start
+    print(f"Batch from Boards    {elapsed:7.3f} s  {len(features) / elapsed:9.0f} positions/s")
+
+    start = time.perf_counter()
+    scores = PositionBatch.from_fens(fens).evaluate()
+    elapsed = time.perf_counter() - start
+    print(f"Batch evaluate       {elapsed:7.3f} s  {len(scores) / elapsed:9.0f} positions/s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Featurizes positions in batches and compares with the Board by Board path")
+    parser.add_argument("count", type=int, nargs="?", default=10000, help="positions of random games to use")
+    parser.add_argument("--fens", help="file with one FEN per line to use instead")
+    parser.add_argument("--check", action="store_true", help="verify the batch features against board_features")
+    args = parser.parse_args(argv)
+
+    if args.fens:
+        with open(args.fens) as file:
+            fens = [line.strip() for line in file if line.strip()]
+    else:
+        fens = random_fens(args.count if not args.check else min(args.count, 2000))
+    if args.check:
+        return 0 if check(fens) else 1
+    benchmark(fens)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
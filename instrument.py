@@ -0,0 +1,243 @@
+"""
+    Optional instrumentation of the rules engine: call counts and time spent per phase,
+    and the moves generated per piece type.
+
+    Disabled, it costs nothing: enable() replaces the methods of the phases with wrappers that count
+    and time them, and disable() puts the original methods back. Times include the phases called inside,
+    calc_moves includes checks, which includes check_filter and pin_filter.
+
+    PHASES:
+        calc_moves, tile_moves, bitboard_moves      the move generation of Board, and of each generator
+        reset                                       emptying valid_moves before the pieces list their moves
+        checks                                      finding the checks and pins and marking the tiles
+        holds                                       writing the held, pinned and check path markers to the tiles
+        check_filter, king_filter, pin_filter       the check mask, the safe king steps and the pin lines
+        castling, legal_moves                       castling moves, and the whole bitboard generator
+        move, castle, make_move, unmake_move, to_fen
+        compact_make_move, compact_unmake_move, compact_legal_moves, compact_to_fen
+    Moves are counted per piece type for both generators, calls and time per piece type only for the tiles,
+    where every piece lists its own moves.
+
+    Usage:
+        instrument.enable()
+        ...
+        print(instrument.to_prometheus())
+
+        python instrument.py --positions 2000 --generator tiles --format prometheus
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+
+from constants import *
+from bitboard import BitBoard
+from board import Board
+from compact import CompactBoard
+from piece import PIECE_CLASSES
+
+## Methods timed, by phase
+PHASES = {
+    "calc_moves": (Board, "calc_moves"),
+    "tile_moves": (Board, "calc_tile_moves"),
+    "bitboard_moves": (Board, "calc_bitboard_moves"),
+    "reset": (Board, "init_moves"),
+    "checks": (Board, "calc_checks"),
+    "holds": (Board, "set_markers"),
+    "check_filter": (BitBoard, "check_mask"),
+    "king_filter": (BitBoard, "king_targets"),
+    "pin_filter": (BitBoard, "pins"),
+    "castling": (BitBoard, "castling_moves"),
+    "legal_moves": (BitBoard, "legal_moves"),
+    "move": (Board, "move"),
+    "castle": (Board, "castle"),
+    "make_move": (Board, "make_move"),
+    "unmake_move": (Board, "unmake_move"),
+    "to_fen": (Board, "to_fen"),
+    "compact_make_move": (CompactBoard, "make_move"),
+    "compact_unmake_move": (CompactBoard, "unmake_move"),
+    "compact_legal_moves": (CompactBoard, "legal_moves"),
+    "compact_to_fen": (CompactBoard, "to_fen"),
+}
+
+# Calls and seconds of every phase, and calls, moves and seconds of every piece type,
+# updated in place so the wrappers keep them in their closures
+_phases = {name: [0, 0.0] for name in PHASES}
+_pieces = {role: [0, 0, 0.0] for role in PIECE_TO_STRING}
+# The methods replaced by enable(), as (class, name, method or None if it was inherited)
+_replaced = []
+
+
+def _timed(method, counters):
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            counters[1] += time.perf_counter() - start
+            counters[0] += 1
+    return timed
+
+
+def _timed_legal_moves(method, counters):
+    def legal_moves(self, *args):
+        start = time.perf_counter()
+        moves = method(self, *args)
+        counters[1] += time.perf_counter() - start
+        counters[0] += 1
+        roles = self.roles
+        for move in moves:
+            _pieces[roles[move & 63]][1] += 1
+        return moves
+    return legal_moves
+
+
+def _counted_moves(method, counters):
+    def moves(self, board, mask):
+        found = board.valid_moves[self.pos]
+        before = len(found)
+        start = time.perf_counter()
+        method(self, board, mask)
+        counters[2] += time.perf_counter() - start
+        counters[1] += len(found) - before
+        counters[0] += 1
+    return moves
+
+
+def _replace(cls, name, wrapper):
+    _replaced.append((cls, name, cls.__dict__.get(name)))
+    setattr(cls, name, wrapper)
+
+
+def enabled():
+    return bool(_replaced)
+
+
+def enable():
+    """Starts counting, the counters carry on from where they were"""
+    if _replaced:
+        return
+    for name, (cls, method) in PHASES.items():
+        wrap = _timed_legal_moves if (cls, method) == (BitBoard, "legal_moves") else _timed
+        _replace(cls, method, wrap(getattr(cls, method), _phases[name]))
+    for classes in PIECE_CLASSES.values():
+        for role, cls in classes.items():
+            _replace(cls, "moves", _counted_moves(cls.moves, _pieces[role]))
+
+
+def disable():
+    """Stops counting and puts the original methods back, the counters are kept"""
+    while _replaced:
+        cls, name, method = _replaced.pop()
+        if method is None:
+            delattr(cls, name)
+        else:
+            setattr(cls, name, method)
+
+
+def reset():
+    for counters in _phases.values():
+        counters[:] = [0, 0.0]
+    for counters in _pieces.values():
+        counters[:] = [0, 0, 0.0]
+
+
+def add(stats):
+    """Adds the counters of a snapshot, taken in another process, to the counters of this one"""
+    for name, counters in stats["phases"].items():
+        _phases[name][0] += counters["calls"]
+        _phases[name][1] += counters["seconds"]
+    for role, name in PIECE_TO_STRING.items():
+        counters = stats["pieces"][name.lower()]
+        _pieces[role][0] += counters["calls"]
+        _pieces[role][1] += counters["moves"]
+        _pieces[role][2] += counters["seconds"]
+
+
+def snapshot():
+    """Returns the counters as a dictionary, see to_json and to_prometheus"""
+    return {
+        "enabled": enabled(),
+        "phases": {name: {"calls": calls, "seconds": seconds} for name, (calls, seconds) in _phases.items()},
+        "pieces": {PIECE_TO_STRING[role].lower(): {"calls": calls, "moves": moves, "seconds": seconds}
+                   for role, (calls, moves, seconds) in _pieces.items()},
+    }
+
+
+def to_json(stats=None):
+    return json.dumps(stats or snapshot(), indent=2)
+
+
+def to_prometheus(stats=None, prefix="chess"):
+    """Returns the counters in the Prometheus text exposition format"""
+    stats = stats or snapshot()
+    lines = []
+
+    def metric(name, help, label, values):
+        lines.append(f"# HELP {prefix}_{name} {help}")
+        lines.append(f"# TYPE {prefix}_{name} counter")
+        for key, value in values:
+            lines.append(f'{prefix}_{name}{{{label}="{key}"}} {value}')
+
+    phases, pieces = stats["phases"].items(), stats["pieces"].items()
+    metric("phase_calls_total", "Calls of every phase of the rules engine", "phase",
+           ((name, counters["calls"]) for name, counters in phases))
+    metric("phase_seconds_total", "Seconds spent in every phase of the rules engine, phases called inside included",
+           "phase", ((name, f"{counters['seconds']:.9f}") for name, counters in phases))
+    metric("piece_calls_total", "Calls of the tile move generation of every piece type", "piece",
+           ((name, counters["calls"]) for name, counters in pieces))
+    metric("piece_moves_total", "Moves generated for every piece type", "piece",
+           ((name, counters["moves"]) for name, counters in pieces))
+    metric("piece_seconds_total", "Seconds spent in the tile move generation of every piece type", "piece",
+           ((name, f"{counters['seconds']:.9f}") for name, counters in pieces))
+    return "\n".join(lines) + "\n"
+
+
+def workload(fens, generator):
+    """Calculates the moves of every position, plays them one at a time and writes the FENs"""
+    for fen in fens:
+        board = Board.from_fen(fen, generator)
+        for move in board.legal_moves():
+            board.make_move(move)
+            board.to_fen()
+            board.unmake_move()
+        board.calc_moves()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Counts and times the phases of the rules engine over random positions")
+    parser.add_argument("--positions", type=int, default=1000)
+    parser.add_argument("--generator", choices=("tiles", "bitboard"), default="tiles")
+    parser.add_argument("--format", choices=("json", "prometheus"), default="json")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    board = CompactBoard()
+    fens = []
+    while len(fens) < args.positions:
+        moves = board.legal_moves()
+        if not moves:
+            board = CompactBoard()
+            continue
+        board.make_move(rng.choice(moves))
+        fens.append(board.to_fen())
+    generator = TILES if args.generator == "tiles" else BITBOARD
+
+    start = time.perf_counter()
+    workload(fens, generator)
+    plain = time.perf_counter() - start
+    enable()
+    start = time.perf_counter()
+    workload(fens, generator)
+    instrumented = time.perf_counter() - start
+    disable()
+    print(to_json() if args.format == "json" else to_prometheus(), end="" if args.format == "prometheus" else "\n")
+    print(f"Disabled {plain:.3f} s, enabled {instrumented:.3f} s ({instrumented / plain - 1:+.0%})", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
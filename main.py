@@ -1,201 +1,551 @@
-from piece import *
+import contextlib
+import copy
+import json
+import os
+import threading
+
+import pygame
+
 from constants import *
 from position import Pos
+from board import Board
+from archive import ArchiveReader, ArchiveWriter, index_path, ONGOING, WHITE_WINS, BLACK_WINS
+from book import OpeningBook
+from tablebase import Tablebases, best_move
+from engine import Engine, format_pv
+from parallel import ParallelEngine
+from telemetry import Telemetry
 
 pygame.init()
-"""
-    GRAMMAR:
-        COLOR: 
-            0 - WHITE
-            1 - BLACK
-        PIECE:
-            0 - PAWN
-            1 - KNIGHT
-            2 - BISHOP
-            3 - KING
-            4 - ROOK
-            5 - QUEEN
-"""
+
+# Posted by the engine thread when its search is done
+ENGINE_DONE = pygame.USEREVENT
+
+# Piece images by color and role, loaded on first draw
+IMAGES = {}
+
+# Saved data, last_game holds the FENs of the positions of a game saved before the game archive
+DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data.json")
+# Every game played, the last one is resumed if it is not over
+ARCHIVE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "games.bin")
+# Opening book the computer plays from while the game is in it, built with book.py
+BOOK_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "book.bin")
+# Endgame tables the computer plays and searches with, generated with tbgen.py
+TABLEBASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tables")
+# Frame and click timings, written on exit when TELEMETRY is on
+TELEMETRY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "telemetry.json")
+
+# Stands in for the phase timers of Telemetry when it is off
+NO_TIMER = contextlib.nullcontext()
+# Tiles under the timings of the telemetry overlay, its three lines cover the top rows
+TELEMETRY_TILES = 8 * -(-3 * FONT_SIZE // SQUARE_SIZE)
+
+
+def load(name: str):
+    """Loads an image from the assets folder"""
+    if name.endswith(".png") or name.endswith(".jpg"):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", name)
+        return pygame.transform.scale(pygame.image.load(path), (SQUARE_SIZE, SQUARE_SIZE))
+
+
+def load_as_image(piece):
+    """Returns the image for the piece, loading it the first time it is asked for
+
+    Args:
+        piece (Piece): The piece to get the image for
+
+    Returns:
+        image: The image representing the piece
+    """
+    key = (piece.color, piece.role)
+    image = IMAGES.get(key)
+    if image is None:
+        prefix = "w" if piece.color is W else "b"
+        image = load(f"{prefix}_{PIECE_TO_STRING[piece.role].lower()}.png")
+        IMAGES[key] = image
+    return image
+
+
+def load_data():
+    try:
+        with open(DATA_FILE) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def pop_last_game():
+    """Returns the FENs of the game saved in data.json, and removes it from there as it moves to the archive"""
+    data = load_data()
+    fens = data.pop("last_game", [])
+    if fens:
+        with open(DATA_FILE, "w") as file:
+            json.dump(data, file, indent=4)
+    return fens
+
+
+def open_archive():
+    """Opens the game archive, a damaged one is moved aside to a .bad file and a new one started"""
+    try:
+        return ArchiveWriter(ARCHIVE_FILE)
+    except ValueError as error:
+        print(f"Starting a new archive: {error}")
+    for path in (ARCHIVE_FILE, index_path(ARCHIVE_FILE)):
+        if os.path.exists(path):
+            os.replace(path, path + ".bad")
+    return ArchiveWriter(ARCHIVE_FILE)
+
+
+def open_book():
+    """Opens the opening book, the computer plays without one if there is none or it is damaged"""
+    if not os.path.exists(BOOK_FILE):
+        return None
+    try:
+        return OpeningBook(BOOK_FILE)
+    except ValueError as error:
+        print(f"Playing without a book: {error}")
+        return None
 
 
 class Window:
     """This class handles the window and the display, and all interactions with the user"""
 
-    def __init__(self):
-        """Initializes the window and sets the caption"""
+    def __init__(self, telemetry=None):
+        """Initializes the window and sets the caption
 
+        Args:
+            telemetry (Telemetry): Times the drawing of the frames and shows the timings, or None
+        """
+
+        self.telemetry = telemetry
         self.display = pygame.display.set_mode((WIDTH, HEIGHT))
         pygame.display.set_caption("Chess")
         self.font_size = FONT_SIZE
         self.font = pygame.font.SysFont('arial', self.font_size)
+        self.background = self.render_background()
+        # What each tile showed in the last frame, indexed by y * 8 + x, None forces a redraw
+        self.drawn = [None] * 64
+        # Rendered text by (text, color), and the debug labels of every tile composited on one surface
+        self.glyphs = {}
+        self.debug_overlay = pygame.Surface((WIDTH, HEIGHT), pygame.SRCALPHA)
+        self.debug_drawn = [None] * 64
+        # The part of each tile its labels cover
+        self.debug_rects = [None] * 64
+
+    def render_background(self):
+        """Draws the board squares once, to be copied under the tiles that change"""
+        background = pygame.Surface((WIDTH, HEIGHT))
+        background.fill(BLACK)
+        for row in range(ROWS):
+            for col in range(row % 2, ROWS, 2):
+                pygame.draw.rect(background, WHITE, (row * SQUARE_SIZE, col * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
+        return background
+
+    def invalidate(self):
+        """Makes the next update redraw every tile"""
+        self.drawn = [None] * 64
+
+    def timer(self, phase):
+        return self.telemetry.phase(phase) if self.telemetry is not None else NO_TIMER
 
     def update(self, board, selected_pos):
-        """Updates the display
+        """Updates the tiles that changed since the last frame, and only sends those to the display
 
         Args:
             board (Board): The board to display
             selected_pos (Pos): The position of the selected piece
         """
+        with self.timer("draw"):
+            dirty = self.draw(board, selected_pos)
+        if dirty:
+            with self.timer("flip"):
+                pygame.display.update(dirty)
 
-        # Fill the background        
-        self.display.fill(BLACK)
+    def draw(self, board, selected_pos):
+        """Draws the tiles that changed since the last frame
 
-        # Draw the board squares
-        for row in range(ROWS):
-            for col in range(row % 2, ROWS, 2):
-                pygame.draw.rect(self.display, WHITE, (row * SQUARE_SIZE, col * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
+        Returns:
+            list: The areas of the display that were drawn
+        """
 
-        # Mark tiles in the path of current check
+        # Tiles in the path of the current check
+        red = set()
         for check in board.checks:
-            pygame.draw.rect(self.display, RED,
-                             (check[0] * SQUARE_SIZE, check[1] * SQUARE_SIZE,
-                              SQUARE_SIZE, SQUARE_SIZE))
-        if board.color_in_check:
+            red.add((check[0], check[1]))
+        if board.color_in_check is not None:
             king_x, king_y = board.get_king_position(board.color_in_check)
-            pygame.draw.rect(self.display, RED,
-                             (king_x * SQUARE_SIZE, king_y * SQUARE_SIZE,
-                              SQUARE_SIZE, SQUARE_SIZE))
-
-        for y, row in enumerate(board.tiles):
-            for x, tile in enumerate(row):
-                if tile.in_check_path:
-                    pygame.draw.rect(self.display, RED,
-                                     (x * SQUARE_SIZE, y * SQUARE_SIZE,
-                                      SQUARE_SIZE, SQUARE_SIZE))
+            red.add((king_x, king_y))
 
-        # Draw the pieces
+        # Marker over the selected piece, the tiles it can move to, and if it is a king, the tiles it can castle to
+        markers = {}
+        if selected_pos:
+            markers[(selected_pos[0], selected_pos[1])] = GREEN
+            for pos in board.valid_moves[selected_pos]:
+                markers[(pos.x, pos.y)] = BLUE
+            if board[selected_pos].piece and board[selected_pos].piece.role is KING:
+                for x, y in board.valid_castles:
+                    markers[(x, y)] = YELLOW
+
+        overlay = self.telemetry is not None and self.telemetry.show_overlay
+        if overlay:
+            # The tiles under the timings are drawn again, so the new timings don't go over the old ones
+            for sq in range(TELEMETRY_TILES):
+                self.drawn[sq] = None
+
+        dirty = []
         for y, row in enumerate(board.tiles):
             for x, tile in enumerate(row):
-                if tile.piece:
-                    image = load_as_image(tile.piece)
-                    self.display.blit(image, (tile.piece.pos.x * SQUARE_SIZE, tile.piece.pos.y * SQUARE_SIZE))
+                piece = tile.piece
+                state = ((piece.color, piece.role) if piece else None,
+                         (x, y) in red or tile.in_check_path,
+                         markers.get((x, y)))
+                if DEBUG:
+                    state += (tile.held_by_white, tile.held_by_black, tile.pinned_by_white,
+                              tile.pinned_by_black, tile.marked_for_en_passant)
+                if state == self.drawn[y * 8 + x]:
+                    continue
+                self.drawn[y * 8 + x] = state
+                dirty.append(self.draw_tile(tile, x, y, state[1], state[2]))
+        if overlay:
+            dirty.append(self.draw_telemetry())
+        return dirty
+
+    def draw_telemetry(self):
+        """Draws the frame and click timings over the top row
+
+        Returns:
+            Rect: The area of the display that was drawn
+        """
+        rects = []
+        for index, line in enumerate(self.telemetry.overlay_lines()):
+            text = self.font.render(line, True, GREEN, BLACK)
+            rects.append(self.display.blit(text, (0, index * self.font_size)))
+        return rects[0].unionall(rects[1:])
 
-        # Draw a marker over the selected piece
-        if selected_pos:
-            pygame.draw.circle(self.display, GREEN, ((selected_pos[0] + 1) * SQUARE_SIZE - SQUARE_SIZE // 2,
-                                                     (selected_pos[1] + 1) * SQUARE_SIZE - SQUARE_SIZE // 2), RADIUS)
-            # Draw a marker over the tiles that the selected piece can move to/attack
-            for pos in board.valid_moves[selected_pos]:
-                pygame.draw.circle(self.display, BLUE,
-                                   ((pos.x + 1) * SQUARE_SIZE - SQUARE_SIZE // 2,
-                                    (pos.y + 1) * SQUARE_SIZE - SQUARE_SIZE // 2),
-                                   RADIUS)
-
-        # If a selected piece is a king, draw a marker over the tiles that the king can castle to
-        for x, y in board.valid_castles:
-            pygame.draw.circle(self.display, YELLOW,
-                               ((x + 1) * SQUARE_SIZE - SQUARE_SIZE // 2,
-                                (y + 1) * SQUARE_SIZE - SQUARE_SIZE // 2),
-                               RADIUS)
+    def draw_tile(self, tile, x, y, in_check, marker):
+        """Draws one tile from the background up
 
+        Returns:
+            Rect: The area of the display that was drawn
+        """
+        rect = pygame.Rect(x * SQUARE_SIZE, y * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
+        self.display.blit(self.background, rect, rect)
+        if in_check:
+            pygame.draw.rect(self.display, RED, rect)
+        if tile.piece:
+            self.display.blit(load_as_image(tile.piece), rect)
+        if marker:
+            pygame.draw.circle(self.display, marker, rect.center, RADIUS)
         # Only draw the following if debug is enabled
         if DEBUG:
+            self.draw_debug(tile, x, y)
+        return rect
+
+    def glyph(self, text, color):
+        """Returns the rendered text, rendering it only the first time"""
+        surface = self.glyphs.get((text, color))
+        if surface is None:
+            surface = self.font.render(text, True, color)
+            self.glyphs[(text, color)] = surface
+        return surface
+
+    def draw_debug(self, tile, x, y):
+        """Draws the coordinates and the hold, pin and en passant state of a tile
+
+        The labels are kept on debug_overlay, and only rendered again when the state of the tile changes.
+        """
+        state = (tile.held_by_white, tile.held_by_black, tile.pinned_by_white,
+                 tile.pinned_by_black, tile.marked_for_en_passant)
+        if state != self.debug_drawn[y * 8 + x]:
+            self.debug_drawn[y * 8 + x] = state
+            self.debug_rects[y * 8 + x] = self.render_debug(tile, x, y)
+        rect = self.debug_rects[y * 8 + x]
+        self.display.blit(self.debug_overlay, rect, rect)
+
+    def render_debug(self, tile, x, y):
+        """Draws the labels of a tile on debug_overlay
+
+        Returns:
+            Rect: The area of the overlay the labels cover
+        """
+        overlay = self.debug_overlay
+        overlay.fill((0, 0, 0, 0), (x * SQUARE_SIZE, y * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
+        rects = []
+        left, top = x * SQUARE_SIZE, y * SQUARE_SIZE
+
+        # Draw the coordinates of each tile (according to the board)
+        rects.append(overlay.blit(self.glyph(f"({x},{y})", RED), (left, top)))
 
-            for y, row in enumerate(board.tiles):
-                for x, tile in enumerate(row):
-
-                    # Draw the coordinates of each tile (according to the board)
-                    cords = self.font.render(f"({x},{y})", True, RED)
-                    self.display.blit(cords, (x * SQUARE_SIZE,
-                                              y * SQUARE_SIZE))
-
-                    # Draw the coordinates of each tile (according to chess)
-                    col_dict = {0: "A", 1: "B", 2: "C", 3: "D", 4: "E", 5: "F", 6: "G", 7: "H"}
-                    mark = self.font.render(f"{col_dict[x]}{8 - y}", True, CYAN)
-                    self.display.blit(mark, (x * SQUARE_SIZE,
-                                             y * SQUARE_SIZE + self.font_size))
-
-                    # Draw on all tiles that are under attack by white or black
-                    w_mark = self.font.render("W", True, YELLOW)
-                    b_mark = self.font.render("B", True, BLUE)
-                    if tile.held_by_white:
-                        self.display.blit(w_mark, (x * SQUARE_SIZE,
-                                                   y * SQUARE_SIZE + 2 * self.font_size))
-                    if tile.held_by_black:
-                        self.display.blit(b_mark, (x * SQUARE_SIZE,
-                                                   y * SQUARE_SIZE + 3 * self.font_size))
-
-                    # Draw on all tiles that are pinned by white or black
-                    wpin_mark = self.font.render("P", True, YELLOW)
-                    bpin_mark = self.font.render("P", True, BLUE)
-                    if tile.pinned_by_white:
-                        self.display.blit(wpin_mark,
-                                          (x * SQUARE_SIZE + self.font_size,
-                                           y * SQUARE_SIZE + 2 * self.font_size))
-                    if tile.pinned_by_black:
-                        self.display.blit(bpin_mark,
-                                          (x * SQUARE_SIZE + self.font_size,
-                                           y * SQUARE_SIZE + 3 * self.font_size))
-                    en_passant_mark = self.font.render("EP", True, GREY)
-                    if tile.marked_for_en_passant:
-                        self.display.blit(en_passant_mark,
-                                          (x * SQUARE_SIZE,
-                                          y * SQUARE_SIZE + 3 * self.font_size))
-
-        # Finally, update the display
-        pygame.display.update()
+        # Draw the coordinates of each tile (according to chess)
+        rects.append(overlay.blit(self.glyph(f"{chr(x + 65)}{8 - y}", CYAN), (left, top + self.font_size)))
+
+        # Draw on all tiles that are under attack by white or black
+        if tile.held_by_white:
+            rects.append(overlay.blit(self.glyph("W", YELLOW), (left, top + 2 * self.font_size)))
+        if tile.held_by_black:
+            rects.append(overlay.blit(self.glyph("B", BLUE), (left, top + 3 * self.font_size)))
+
+        # Draw on all tiles that are pinned by white or black
+        if tile.pinned_by_white:
+            rects.append(overlay.blit(self.glyph("P", YELLOW), (left + self.font_size, top + 2 * self.font_size)))
+        if tile.pinned_by_black:
+            rects.append(overlay.blit(self.glyph("P", BLUE), (left + self.font_size, top + 3 * self.font_size)))
+        if tile.marked_for_en_passant:
+            rects.append(overlay.blit(self.glyph("EP", GREY), (left, top + 3 * self.font_size)))
+        return rects[0].unionall(rects[1:])
 
 
 class Game:
     """This object is responsible for handling main game events"""
 
-    def __init__(self):
-        """Initializes the game"""
+    def __init__(self, engine_color=ENGINE_COLOR, workers=ENGINE_WORKERS):
+        """Initializes the game
 
-        self.board = Board()
-        self.window = Window()
-        self.event_handler = EventHandler()
+        Args:
+            engine_color (int): The color played by the computer, or None if both players are human
+            workers (int): Processes the computer searches with
+        """
+
+        self.archive = open_archive()
+        self.board = self.resume() if RESUME_GAME else None
+        if self.board is None:
+            self.board = Board()
+            self.archive.append()
+        # The tiles are marked after every move, keeping the attack map up to date is cheaper than rebuilding it
+        self.board.bitboard.track_attacks()
+        # Moves made on the board that are saved in the last game of the archive
+        self.recorded = len(self.board.history)
+        self.telemetry = Telemetry() if TELEMETRY else None
+        self.window = Window(self.telemetry)
+        self.event_handler = EventHandler(self.telemetry)
         self.valid_moves = {}
         self.valid_castles = {}
+        self.engine_color = engine_color
+        self.engine = None
+        self.tablebases = None
+        if engine_color is not None and USE_TABLEBASES and os.path.isdir(TABLEBASE_DIR):
+            self.tablebases = Tablebases(TABLEBASE_DIR)
+        if engine_color is not None and workers > 1:
+            self.engine = ParallelEngine(workers, max_time=ENGINE_TIME, tablebases=self.tablebases)
+        elif engine_color is not None:
+            self.engine = Engine(max_time=ENGINE_TIME, tablebases=self.tablebases)
+        self.engine_thread = None
+        self.engine_result = None
+        self.book = open_book() if engine_color is not None and USE_BOOK else None
 
     def update(self):
-        self.window.update(self.board, self.event_handler.selected)
-        self.event_handler.events(self.board)
-
+        """Handles the pending events and draws a frame, called FPS times a second when not EVENT_DRIVEN
 
-class Tile:
-    def __init__(self):
-        self.piece = None
-        self.held_by_black = False
-        self.held_by_white = False
-        self.marked_for_en_passant = False
-        self.pinned_by_black = False
-        self.pinned_by_white = False
-        self.in_check_path = False
+        The events are handled first, so a click shows in the frame drawn right after it.
 
-    def reset(self, reset_en_passant=False, reset_piece=False):
-        self.held_by_white = False
-        self.held_by_black = False
-        self.pinned_by_black = False
-        self.pinned_by_white = False
-        self.in_check_path = False
-        if reset_en_passant:
-            self.marked_for_en_passant = False
-        if reset_piece:
-            self.piece = False
-
-    def reset_en_passant(self):
-        self.marked_for_en_passant = False
+        Returns:
+            bool: False once the game is over, see over
+        """
+        if self.telemetry is not None:
+            self.telemetry.start_frame()
+        engine_turn = self.board.turn is self.engine_color
+        with self.window.timer("events"):
+            self.event_handler.events(self.board, can_move=not engine_turn)
+        if engine_turn and not self.over():
+            with self.window.timer("moves"):
+                self.play_engine()
+        self.record()
+        self.render()
+        return not self.over()
+
+    def over(self):
+        """Returns True once the side to move is checkmated or the window was closed"""
+        return self.board.checkmate or self.event_handler.quit
+
+    def resume(self):
+        """Replays the last game of the archive if it is not over
+
+        Returns:
+            Board: The board of the game, or None to start a new game
+        """
+        game = len(self.archive) - 1
+        try:
+            with ArchiveReader(ARCHIVE_FILE) as reader:
+                if game >= 0 and reader.result(game) is ONGOING:
+                    board = reader.board(game)
+                    if not board.checkmate:
+                        return board
+                    self.archive.set_result(game, BLACK_WINS if board.color_in_check is W else WHITE_WINS)
+                    return None
+            # A game saved in data.json before there was an archive
+            fens = pop_last_game()
+            if not fens:
+                return None
+            board = Board.from_fen(fens[-1])
+        except ValueError as error:
+            print(f"Not resuming the last game: {error}")
+            return None
+        if board.checkmate:
+            return None
+        self.archive.append(fen=board.to_fen())
+        return board
+
+    def record(self):
+        """Appends the moves made since the last call to the game in the archive, so it can be resumed"""
+        history = self.board.history
+        if len(history) != self.recorded:
+            self.archive.extend([record[0] for record in history[self.recorded:]])
+            self.recorded = len(history)
+            if self.board.checkmate:
+                self.archive.set_result(len(self.archive) - 1, BLACK_WINS if self.board.color_in_check is W else WHITE_WINS)
+
+    def close(self):
+        """Saves the moves not recorded yet, the game may have ended between two frames"""
+        self.record()
+        self.archive.close()
+        if isinstance(self.engine, ParallelEngine):
+            self.engine.close()
+        if self.tablebases is not None:
+            self.tablebases.close()
+        if self.book is not None:
+            self.book.close()
+        if self.telemetry is not None:
+            self.telemetry.dump(TELEMETRY_FILE)
+            print(self.telemetry.report())
+
+    def render(self):
+        if self.event_handler.exposed:
+            self.event_handler.exposed = False
+            self.window.invalidate()
+        self.window.update(self.board, self.event_handler.selected)
+        if self.telemetry is not None:
+            self.telemetry.end_frame()
 
+    def run(self):
+        """Runs the game, sleeping until there is input or the engine is done
 
+        A frame is only drawn after something changed, and bursts of input are drawn at most FPS times a second.
+        Returns once the game is over, after drawing its last position; close saves it.
+        """
+        clock = pygame.time.Clock()
+        changed = True
+        while True:
+            engine_turn = self.board.turn is self.engine_color
+            if engine_turn and not self.over():
+                with self.window.timer("moves"):
+                    changed |= self.play_engine()
+            if changed:
+                self.record()
+                self.render()
+                clock.tick(FPS)
+            if self.over():
+                return
+            # An event that ends the wait on an empty queue was queued when the wait returns
+            idle = self.telemetry is not None and not pygame.event.peek()
+            # Wake up now and then while the engine thinks, in case its event was dropped from a full queue
+            event = pygame.event.wait(ENGINE_POLL if self.engine_thread is not None else 0)
+            if idle and event.type != pygame.NOEVENT:
+                self.telemetry.woke()
+            events = pygame.event.get()
+            if self.telemetry is not None:
+                self.telemetry.events_read()
+            if event.type != pygame.NOEVENT:
+                events.insert(0, event)
+            if self.telemetry is not None:
+                self.telemetry.start_frame()
+            with self.window.timer("events"):
+                changed = self.event_handler.events(self.board, not engine_turn, events)
+
+    def play_engine(self):
+        """Starts the engine on a copy of the board, and plays its move once it is done
+
+        The search runs in a thread, so the window keeps updating while the engine thinks.
+
+        Returns:
+            bool: True if the engine played a move
+        """
+        if self.engine_thread is None:
+            move = self.book.choose(self.board) if self.book is not None else None
+            if move is None and self.tablebases is not None and self.board.probe_tablebase(self.tablebases):
+                move = best_move(self.board, self.tablebases)
+            if move is not None:
+                self.board.make_move(move)
+                self.board.calc_moves()
+                check_for_checkmate(self.board)
+                return True
+            self.engine_result = None
+            board = copy.deepcopy(self.board)
+            # The search never reads the tile markers, so it doesn't keep the attack map up to date
+            board.bitboard.attack_map = None
+            self.engine_thread = threading.Thread(target=self.think, args=(board,), daemon=True)
+            self.engine_thread.start()
+        elif self.engine_result is not None:
+            self.engine_thread = None
+            move = self.engine_result[0]
+            if move is not None:
+                self.board.make_move(move)
+                self.board.calc_moves()
+                check_for_checkmate(self.board)
+                return True
+        return False
+
+    def think(self, board):
+        def report(depth, score, nodes, seconds, pv):
+            print(f"depth {depth} score {score} nodes {nodes} time {seconds:.2f} pv {format_pv(pv)}")
+        self.engine_result = self.engine.search(board, on_iteration=report)
+        pygame.event.post(pygame.event.Event(ENGINE_DONE))
+
+
+def check_for_checkmate(board):
+    """Announces the winner if the side to move is checkmated, the game loop then ends, see Game.over"""
+    if board.checkmate:
+        print("Checkmate")
+        if board.color_in_check is W:
+            print("Black wins")
+        else:
+            print("White wins")
 
 
 class EventHandler:
-    def __init__(self):
+    def __init__(self, telemetry=None):
+        self.telemetry = telemetry
         self.selected = None
+        # Set when the window was uncovered and has to be redrawn in full
+        self.exposed = False
+        # Set when the window was closed, the game loop then ends
+        self.quit = False
 
-    def events(self, board):
+    def events(self, board, can_move=True, events=None):
+        """Handles the events, the pending ones if events is None
+
+        Returns:
+            bool: True if the board or the selection may have changed and the window should be drawn
+        """
+        changed = False
         # Get all events
-        for event in pygame.event.get():
-            # If the event is a quit event, quit the game
+        if events is None:
+            events = pygame.event.get()
+            if self.telemetry is not None:
+                self.telemetry.events_read()
+        for event in events:
+            # If the event is a quit event, end the game
             if event.type == pygame.QUIT:
-                pygame.quit()
-                quit()
+                self.quit = True
+                changed = True
+            if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                self.exposed = True
+                changed = True
             # If the event is a mouse click
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_ESCAPE:
                     self.selected = None
-            if event.type == pygame.MOUSEBUTTONDOWN:
+                    changed = True
+                # Show or hide the timings, the whole board is drawn again to clear them
+                if event.key == pygame.K_F3 and self.telemetry is not None:
+                    self.telemetry.show_overlay = not self.telemetry.show_overlay
+                    self.exposed = True
+                    changed = True
+            if event.type == pygame.MOUSEBUTTONDOWN and can_move:
+                changed = True
+                if self.telemetry is not None:
+                    # SDL stamps the events it queues in milliseconds of get_ticks, pygame builds that expose it
+                    timestamp = getattr(event, "timestamp", None)
+                    self.telemetry.click(None if timestamp is None else (pygame.time.get_ticks() - timestamp) / 1000)
                 # Get the selected tile
                 pos = pygame.mouse.get_pos()
                 x, y = pos
@@ -205,8 +555,10 @@ class EventHandler:
                 if self.selected:
                     if board.valid_moves[self.selected]:
                         if pos in board.valid_moves[self.selected]:
-                            board.move(self.selected, pos)
-                            board.calc_moves()
+                            with self.telemetry.phase("moves") if self.telemetry is not None else NO_TIMER:
+                                board.move(self.selected, pos)
+                                board.calc_moves()
+                            check_for_checkmate(board)
                 # If the selected tile is not a piece, deselect it
                 self.selected = None
                 # If the selected tile is a piece, select it
@@ -214,337 +566,20 @@ class EventHandler:
                     piece = board[pos].piece
                     if piece and piece.color == board.turn:
                         self.selected = piece.pos
-
-
-class Board:
-    def __init__(self):
-        self.turn = W
-        self.valid_moves = {}
-        self.color_in_check = None
-        self.checks = []
-        self.selected_piece = None
-        self.valid_castles = []
-        self.available_castles = [[True, True], [True, True]]
-        self.en_passant_target = None
-        self.halfmove_clock = 0
-        self.fullmove_clock = 1
-        self.col_to_char = {0: "a", 1: "b", 2: "c", 3: "d", 4: "e", 5: "f", 6: "g", 7: "h"}
-        self.char_to_col = {"a": 0, "b": 1, "c": 2, "d": 3, "e": 4, "f": 5, "g": 6, "h": 7}
-
-        self.tiles = [[Tile() for _ in range(8)] for _ in range(8)]
-        self.sim_tiles = [[Tile() for _ in range(8)] for _ in range(8)]
-
-        self[Pos(0, 0)].piece = BlackRook(Pos(0, 0))
-        self[Pos(7, 0)].piece = BlackRook(Pos(7, 0))
-        self[Pos(1, 0)].piece = BlackKnight(Pos(1, 0))
-        self[Pos(6, 0)].piece = BlackKnight(Pos(6, 0))
-        self[Pos(2, 0)].piece = BlackBishop(Pos(2, 0))
-        self[Pos(5, 0)].piece = BlackBishop(Pos(5, 0))
-        self[Pos(4, 0)].piece = BlackKing(Pos(4, 0))
-        self[Pos(3, 0)].piece = BlackQueen(Pos(3, 0))
-
-        for index, tile in enumerate(self.tiles[1]):
-            tile.piece = BlackPawn(Pos(index, 1))
-
-        self[Pos(0, 7)].piece = WhiteRook(Pos(0, 7))
-        self[Pos(7, 7)].piece = WhiteRook(Pos(7, 7))
-        self[Pos(1, 7)].piece = WhiteKnight(Pos(1, 7))
-        self[Pos(6, 7)].piece = WhiteKnight(Pos(6, 7))
-        self[Pos(2, 7)].piece = WhiteBishop(Pos(2, 7))
-        self[Pos(5, 7)].piece = WhiteBishop(Pos(5, 7))
-        self[Pos(4, 7)].piece = WhiteKing(Pos(4, 7))
-        self[Pos(3, 7)].piece = WhiteQueen(Pos(3, 7))
-
-        for index, tile in enumerate(self.tiles[6]):
-            tile.piece = WhitePawn(Pos(index, 6))
-        self.calc_moves()
-
-    def __getitem__(self, pos):
-        return self.tiles[pos[1]][pos[0]]
-
-    def init_moves(self):
-        for row in self.tiles:
-            for tile in row:
-                if tile.piece:
-                    self.valid_moves[tile.piece.pos] = []
-
-    def reset_tiles(self):
-        for row in self.tiles:
-            for tile in row:
-                tile.reset()
-
-    def reset_en_passants(self):
-        for row in self.tiles:
-            for tile in row:
-                tile.reset_en_passant()
-
-    def change_turn(self):
-        if self.turn == W:
-            self.turn = B
-        else:
-            self.turn = W
-
-    def castle(self, pos):
-        old_king_pos = self.selected_piece.pos
-        old_rook_pos = pos
-        king = self.selected_piece
-        rook = self[old_rook_pos].piece
-
-        if old_rook_pos == Pos(0, 7):
-            self[Pos(2, 7)].piece = king
-            self[Pos(3, 7)].piece = rook
-        elif old_rook_pos == Pos(7, 7):
-            self[Pos(6, 7)].piece = king
-            self[Pos(5, 7)].piece = rook
-        elif old_rook_pos == Pos(0, 0):
-            self[Pos(2, 0)].piece = king
-            self[Pos(3, 0)].piece = rook
-        elif old_rook_pos == Pos(7, 0):
-            self[Pos(6, 0)].piece = king
-            self[Pos(5, 0)].piece = rook
-
-        self[old_king_pos].piece = None
-        self[old_rook_pos].piece = None
-        self.turn = abs(self.turn - 1)
-
-        self.reset_tiles()
-        self.calc_holds()
-
-    def calc_holds(self):
-        for row in self.tiles:
-            for tile in row:
-                if tile.piece:
-                    tile.piece.holds(self)
-
-    def mark_for_en_passant(self, pos):
-        self[pos].marked_for_en_passant = True
-
-    def demark_for_en_passant(self, pos):
-        self[pos].marked_for_en_passant = False
-
-    def to_fen(self):
-        fen = ""
-        role_dict = {
-            0: "P",
-            1: "N",
-            2: "B",
-            3: "K",
-            4: "R",
-            5: "Q"
-        }
-        empty_count = 0
-        for row in self.tiles:
-            for tile in row:
-                if tile.piece:
-                    if empty_count > 0:
-                        fen += str(empty_count)
-                        empty_count = 0
-                    if tile.piece.color is W:
-                        fen += role_dict[tile.piece.role]
-                    elif tile.piece.color is B:
-                        fen += role_dict[tile.piece.role].lower()
-                else:
-                    empty_count += 1
-            if empty_count > 0:
-                fen += str(empty_count)
-                empty_count = 0
-            fen += "/"
-        fen = fen[:-1]
-        if self.turn is W:
-            fen += " w"
-        else:
-            fen += " b"
-
-        fen += " "
-        castling = False
-        if self.available_castles[0][0]:
-            fen += "K"
-            castling = True
-        if self.available_castles[0][1]:
-            fen += "Q"
-            castling = True
-        if self.available_castles[1][0]:
-            fen += "k"
-            castling = True
-        if self.available_castles[1][1]:
-            fen += "q"
-            castling = True
-        if not castling:
-            fen += "-"
-        fen += " "
-        if self.en_passant_target:
-            fen += self.en_passant_target
-        else:
-            fen += "-"
-        fen += " " + str(self.halfmove_clock)
-        fen += " " + str(self.fullmove_clock)
-        return fen
-
-    def can_castle(self, color=W, side=QUEEN_SIDE):
-        rook = False
-        empty = True
-        king = False
-        if color is W:
-            if side is QUEEN_SIDE:
-                tile = self.tiles[7][0]
-                rook = tile.piece and tile.piece.role is ROOK and tile.piece.color is W
-                for i in range(1, 4):
-                    tile = self.tiles[7][i]
-                    empty = empty and not tile.piece
-                tile = self.tiles[7][4]
-                king = tile.piece and tile.piece.role is KING and tile.piece.color is W
-            elif side is KING_SIDE:
-                tile = self.tiles[7][7]
-                rook = tile.piece and tile.piece.role is ROOK and tile.piece.color is W
-                for i in range(4, 6):
-                    tile = self.tiles[7][i]
-                    empty = empty and not tile.piece
-                tile = self.tiles[7][4]
-                king = tile.piece and tile.piece.role is KING and tile.piece.color is W
-        elif color is B:
-            if side is QUEEN_SIDE:
-                tile = self.tiles[0][0]
-                rook = tile.piece and tile.piece.role is ROOK and tile.piece.color is B
-                for i in range(1, 4):
-                    tile = self.tiles[0][i]
-                    empty = empty and not tile.piece
-                tile = self.tiles[0][4]
-                king = tile.piece and tile.piece.role is KING and tile.piece.color is B
-            elif side is KING_SIDE:
-                tile = self.tiles[0][7]
-                rook = tile.piece and tile.piece.role is ROOK and tile.piece.color is B
-                for i in range(4, 6):
-                    tile = self.tiles[0][i]
-                    empty = empty and not tile.piece
-                tile = self.tiles[0][4]
-                king = tile.piece and tile.piece.role is KING and tile.piece.color is B
-        return rook and empty and king
-
-    def check_pawn_to_queen(self):
-        for row in self.tiles:
-            for tile in row:
-                if tile.piece:
-                    piece = tile.piece
-                    if piece.role is PAWN:
-                        if tile.piece.color is W and piece.pos.y == 0:
-                            tile.piece = WhiteQueen(piece.pos)
-                        elif piece.color is B and piece.pos.y == 7:
-                            tile.piece = BlackQueen(piece.pos)
-
-    def move(self, old_pos, new_pos):
-        if self.en_passant_target:
-            tx = self.char_to_col[self.en_passant_target[0]]
-            ty = int(self.en_passant_target[1])
-            self.demark_for_en_passant(Pos(tx, ty))
-        self.en_passant_target = ""
-
-        if not new_pos.valid:
-            return
-        s_piece = self[old_pos].piece
-        if not s_piece:
-            return
-
-        s_piece.pos = new_pos
-
-        self[new_pos].piece = s_piece
-        self[old_pos].piece = None
-
-        # If pawn moved 2 tiles, mark the tile behind it for en passant
-        if s_piece.role is PAWN and abs(new_pos.y - old_pos.y) > 1:
-            if s_piece.color is W:
-                self.mark_for_en_passant(new_pos + Pos(0, 1))
-                self.en_passant_target = self.col_to_char[new_pos.x] + str((8 - new_pos.y) - 1)
-            elif s_piece.color is B:
-                self.mark_for_en_passant(new_pos + Pos(0, -1))
-                self.en_passant_target = self.col_to_char[new_pos.x] + str((8 - new_pos.y) + 1)
-
-        self.change_turn()
-        self.check_pawn_to_queen()
-
-    def get_king_position(self, color):
-        for row in self.tiles:
-            for tile in row:
-                if tile.piece and tile.piece.color is color and tile.piece.role is KING:
-                    return tile.piece.pos
-
-    def calc_moves(self):
-        self.reset_tiles()
-        self.valid_moves = {}
-        self.init_moves()
-        self.color_in_check = None
-        self.checks = []
-        for row in self.tiles:
-            for tile in row:
-                if tile.piece:
-                    tile.piece.holds(self)
-        for row in self.tiles:
-            for tile in row:
-                if tile.piece:
-                    tile.piece.moves(self)
-        self.reset_en_passants()
-
-        for row in self.tiles:
-            for tile in row:
-                if tile.piece:
-                    if tile.piece.color is W and tile.pinned_by_black:
-                        self.valid_moves[tile.piece.pos] = []
-                    elif tile.piece.color is B and tile.pinned_by_white:
-                        self.valid_moves[tile.piece.pos] = []
-        if self.color_in_check:
-            if self.color_in_check is W:
-                king_pos = self.get_king_position(W)
-            else:
-                king_pos = self.get_king_position(B)
-
-            checker_pos = self.checks[0]
-            for pos, moves in self.valid_moves.items():
-                new_moves = []
-                for move in moves:
-                    if self[move].in_check_path:
-                        new_moves.append(move)
-                    elif move == checker_pos:
-                        new_moves.append(move)
-                    elif king_pos == pos:
-                        new_moves.append(move)
-                self.valid_moves[pos] = new_moves
-            checkmate = True
-            for pos, moves in self.valid_moves.items():
-                if len(moves) > 0:
-                    checkmate = False
-
-            if checkmate:
-                print("Checkmate")
-                if self.color_in_check is W:
-                    print("Black wins")
-                else:
-                    print("White wins")
-                quit()
-
-        """
-        TODO:
-        A deepcopy használata helyett hozzáadhatnánk a Board osztához egy sim_tiles nevű változót.
-        Simulációk során a sim_tiles változóban tárolnánk a jelenlegi táblát.
-        Majd adunk az osztályhoz egy sim_move metódust, ami a sim_tiles változóban lévő táblát módosítja.
-        És egy sim_pseudo_valid_moves metódust, ami a sim_tiles változóban lévő táblát vizsgálja.
-        Ekkor nem kell a teljes osztályt lemásolni, csak a változókat.
-        2022.11.21. 02:36
-        """
-
-    def __repr__(self):
-        result = ""
-        for row in self.tiles:
-            for tile in row:
-                if tile.piece:
-                    result += str(tile.piece) + " "
-                else:
-                    result += "  "
-            result += "\n"
-        return result
+        return changed
 
 
 if __name__ == "__main__":
-    run = True
     game = Game()
-    while run:
-        CLOCK.tick(FPS)
-        game.update()
+    try:
+        if EVENT_DRIVEN:
+            game.run()
+        else:
+            clock = pygame.time.Clock()
+            while True:
+                clock.tick(FPS)
+                if not game.update():
+                    break
+    finally:
+        game.close()
+        pygame.quit()
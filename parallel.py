@@ -0,0 +1,172 @@
+"""
+    Parallel search: the root moves of every iteration are split across a pool of processes.
+    The best move of the previous iteration is searched first with a full window, then
+    the other moves are searched in parallel against its score, as in young brothers wait.
+    Every worker keeps its own Engine, so its transposition table carries over between iterations.
+
+    Workers get the position as a FEN, so they don't see repetitions of earlier positions.
+    Every task carries the deadline of the whole search on the monotonic clock, which all processes share,
+    so a root move that waited in the queue gets only the time that is left.
+
+    Usage:
+        python parallel.py 5 4    (depth 5, compare 1 to 4 workers)
+"""
+
+import multiprocessing
+import sys
+import time
+
+from constants import *
+from engine import Engine, INFINITY, MATE, format_pv
+from board import Board
+from tablebase import Tablebases
+
+# The engine of a worker process
+_engine = None
+
+
+def _init_worker(hash_mb, tablebase_dir):
+    global _engine
+    tablebases = Tablebases(tablebase_dir) if tablebase_dir is not None else None
+    _engine = Engine(max_time=None, hash_mb=hash_mb, tablebases=tablebases)
+
+
+def _search_root_move(task):
+    """Searches one root move in a worker
+
+    Args:
+        task (tuple): FEN, move, depth, lower bound of the score, deadline on time.monotonic or None
+
+    Returns:
+        tuple: The move, its score, its principal variation, nodes searched, and True if the budget ran out
+    """
+    fen, move, depth, alpha, deadline = task
+    _engine.nodes = 0
+    _engine.stopped = False
+    _engine.deadline = None
+    if deadline is not None:
+        left = deadline - time.monotonic()
+        if left <= 0:
+            # Taken from the queue after the search ran out of time
+            return move, -INFINITY, [move], 0, True
+        # The engine times itself on perf_counter, which is not shared between processes
+        _engine.deadline = time.perf_counter() + left
+    board = Board.from_fen(fen, calc_moves=False)
+    board.make_move(move)
+    pv = []
+    score = -_engine.negamax(board, depth - 1, 1, -INFINITY, -alpha, pv)
+    return move, score, [move] + pv, _engine.nodes, _engine.stopped
+
+
+class ParallelEngine:
+    """Engine with the same search interface, spreading the root moves over worker processes"""
+
+    def __init__(self, workers=2, max_time=1.0, max_depth=64, hash_mb=16, tablebases=None):
+        """Initializes the engine, the worker processes are started on the first search
+
+        Args:
+            workers (int): The number of processes
+            max_time (float): Seconds to search for per move, or None for no limit
+            max_depth (int): The deepest iteration to start
+            hash_mb (float): Memory of the transposition table of every worker
+            tablebases (Tablebases): Endgame tables, every worker opens the tables of its directory, or None
+        """
+        self.workers = workers
+        self.tablebase_dir = tablebases.directory if tablebases is not None else None
+        self.max_time = max_time
+        self.max_depth = max_depth
+        self.hash_mb = hash_mb
+        self.nodes = 0
+        self.pool = None
+
+    def start(self):
+        if self.pool is None:
+            # Spawn, as forking a process with pygame and threads running is not safe
+            context = multiprocessing.get_context("spawn")
+            self.pool = context.Pool(self.workers, initializer=_init_worker, initargs=(self.hash_mb, self.tablebase_dir))
+
+    def close(self):
+        if self.pool is not None:
+            # Let the workers exit on their own, when the game spawns them they initialize SDL, which catches SIGTERM
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def search(self, board, on_iteration=None):
+        """Searches the position on the board, deepening one ply at a time until the budget runs out
+
+        Args:
+            board (Board): The position to search, it is not changed
+            on_iteration (callable): Called as on_iteration(depth, score, nodes, seconds, pv) after every iteration
+
+        Returns:
+            tuple: The best move, its score, and the principal variation as a list of moves
+        """
+        self.start()
+        start = time.perf_counter()
+        deadline = time.monotonic() + self.max_time if self.max_time is not None else None
+        fen = board.to_fen()
+        moves = board.legal_moves()
+        self.nodes = 0
+        if not moves:
+            return None, -MATE if board.in_check() else 0, []
+
+        best_move, best_score, best_pv = moves[0], -INFINITY, []
+        for depth in range(1, self.max_depth + 1):
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            # The previous best move first, its score is the bound for the others
+            first = [best_move] + [move for move in moves if move != best_move]
+            move, alpha, pv, nodes, stopped = self.pool.apply(_search_root_move,
+                                                              ((fen, first[0], depth, -INFINITY, deadline),))
+            self.nodes += nodes
+            if stopped:
+                break
+            iteration_move, iteration_pv = move, pv
+            tasks = [(fen, move, depth, alpha, deadline) for move in first[1:]]
+            # Every result is collected, once the deadline has passed the tasks still queued return at once,
+            # so none are left to hold up the workers in the next search
+            stopped = False
+            for move, score, pv, nodes, move_stopped in self.pool.imap_unordered(_search_root_move, tasks):
+                self.nodes += nodes
+                if move_stopped:
+                    stopped = True
+                elif score > alpha:
+                    alpha, iteration_move, iteration_pv = score, move, pv
+            # The moves searched of an unfinished iteration are still better than the previous best move
+            best_move, best_score, best_pv = iteration_move, alpha, iteration_pv
+            if stopped:
+                break
+            # Search the best moves first next time
+            moves = first
+            if on_iteration:
+                on_iteration(depth, best_score, self.nodes, time.perf_counter() - start, best_pv)
+            if abs(best_score) >= MATE - self.max_depth:
+                break
+        return best_move, best_score, best_pv
+
+
+def benchmark(depth, max_workers, fen=START_FEN):
+    """Searches the position to a fixed depth with 1 to max_workers processes and prints the speedup"""
+    board = Board.from_fen(fen, calc_moves=False)
+    engine = Engine(max_time=None, max_depth=depth)
+    start = time.perf_counter()
+    move, score, pv = engine.search(board)
+    single = time.perf_counter() - start
+    print(f"Engine            {single:7.2f} s  {engine.nodes:9d} nodes  score {score}  pv {format_pv(pv)}")
+    for workers in range(1, max_workers + 1):
+        engine = ParallelEngine(workers, max_time=None, max_depth=1)
+        # Start the workers and load their modules before timing
+        engine.search(board)
+        engine.max_depth = depth
+        start = time.perf_counter()
+        move, score, pv = engine.search(board)
+        elapsed = time.perf_counter() - start
+        engine.close()
+        print(f"{workers:2d} workers        {elapsed:7.2f} s  {engine.nodes:9d} nodes  score {score}  "
+              f"speedup {single / elapsed:.2f}  pv {format_pv(pv)}")
+
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 4,
+              int(sys.argv[2]) if len(sys.argv) > 2 else multiprocessing.cpu_count())
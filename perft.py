@@ -0,0 +1,172 @@
+"""
+    Perft walks the move tree of a position to a fixed depth and counts the leaves.
+    The counts are compared against known values to check the move generator,
+    and the nodes per second are our throughput benchmark for it.
+
+    Usage:
+        python perft.py 5
+        python perft.py 4 r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1 --divide
+        python perft.py 4 --calc-moves --generator tiles
+        python perft.py --check
+"""
+
+import argparse
+import sys
+import time
+
+from constants import *
+from bitboard import move_to_uci
+from board import Board
+
+## Known positions and their node counts for depth 1, 2, 3...
+PERFT_SUITE = [
+    (START_FEN, [20, 400, 8902, 197281]),
+    ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", [48, 2039, 97862]),
+    ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", [14, 191, 2812, 43238]),
+    ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1", [6, 264, 9467]),
+    ("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", [44, 1486, 62379]),
+    ("r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10", [46, 2079, 89890]),
+]
+
+## Subtree counts kept by the hashed mode before it stops storing new ones
+HASH_ENTRIES = 1 << 20
+
+
+def perft(board, depth, cache=None):
+    """Counts the leaf nodes of the legal move tree below the position on the board
+
+    Args:
+        board (Board): The position to search, it is restored before returning
+        depth (int): The number of plies to search
+        cache (dict): Subtree counts keyed by Board.hash and depth, or None to search without one
+
+    Returns:
+        int: The number of leaf nodes
+    """
+    if depth == 0:
+        return 1
+    moves = board.legal_moves()
+    if depth == 1:
+        return len(moves)
+    if cache is not None:
+        key = (board.hash, depth)
+        nodes = cache.get(key)
+        if nodes is not None:
+            return nodes
+    nodes = 0
+    for move in moves:
+        board.make_move(move)
+        nodes += perft(board, depth - 1, cache)
+        board.unmake_move()
+    if cache is not None and len(cache) < HASH_ENTRIES:
+        cache[key] = nodes
+    return nodes
+
+
+def calc_moves_list(board):
+    """Runs Board.calc_moves and returns the encoded moves of the side to move"""
+    board.calc_moves()
+    moves = []
+    for pos, targets in board.valid_moves.items():
+        if board[pos].piece.color is board.turn:
+            for target in targets:
+                moves.append(board.find_move(pos, target))
+    return moves
+
+
+def perft_calc_moves(board, depth):
+    """Same as perft, but every node goes through Board.calc_moves and the valid_moves it fills
+
+    The board only promotes to queens there, so the counts differ from perft in positions with promotions.
+    """
+    if depth == 0:
+        return 1
+    moves = calc_moves_list(board)
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        board.make_move(move)
+        nodes += perft_calc_moves(board, depth - 1)
+        board.unmake_move()
+    return nodes
+
+
+def divide(board, depth, search):
+    """Returns the node count below every root move, as a list of (move, nodes)"""
+    moves = calc_moves_list(board) if search is perft_calc_moves else board.legal_moves()
+    result = []
+    for move in moves:
+        board.make_move(move)
+        result.append((move, search(board, depth - 1)))
+        board.unmake_move()
+    return result
+
+
+def check_suite():
+    """Runs PERFT_SUITE and prints every mismatch
+
+    Returns:
+        bool: True if every count matched
+    """
+    passed = True
+    for fen, counts in PERFT_SUITE:
+        board = Board.from_fen(fen, calc_moves=False)
+        for depth, expected in enumerate(counts, 1):
+            nodes = perft(board, depth)
+            if nodes != expected:
+                print(f"FAIL {fen} depth {depth}: {nodes}, expected {expected}")
+                passed = False
+                break
+        else:
+            print(f"ok   {fen}")
+    return passed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Counts the leaf nodes of the move tree of a position")
+    parser.add_argument("depth", type=int, nargs="?", default=4)
+    parser.add_argument("fen", nargs="*", help="The position, the start position if left out")
+    parser.add_argument("--divide", action="store_true", help="print the node count below every root move")
+    parser.add_argument("--hash", action="store_true", help="cache subtree counts by position")
+    parser.add_argument("--calc-moves", action="store_true", help="generate every node through Board.calc_moves")
+    parser.add_argument("--generator", choices=["tiles", "bitboard"], default="bitboard",
+                        help="move generator used by Board.calc_moves")
+    parser.add_argument("--check", action="store_true", help="verify the counts of the built-in positions")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        return 0 if check_suite() else 1
+
+    move_generator = TILES if args.generator == "tiles" else BITBOARD
+
+    board = Board.from_fen(" ".join(args.fen) if args.fen else START_FEN, move_generator, calc_moves=False)
+    if args.calc_moves:
+        # Every node marks the tiles, as the board of the game window does
+        board.bitboard.track_attacks()
+        search = perft_calc_moves
+    elif args.hash:
+        cache = {}
+        search = lambda position, depth: perft(position, depth, cache)
+    else:
+        search = perft
+
+    start = time.perf_counter()
+    if args.divide:
+        nodes = 0
+        for move, count in divide(board, args.depth, search):
+            print(f"{move_to_uci(move)}: {count}")
+            nodes += count
+        print()
+    else:
+        nodes = search(board, args.depth)
+    elapsed = time.perf_counter() - start
+
+    print(f"Nodes: {nodes}")
+    print(f"Time: {elapsed:.3f} s")
+    print(f"Nodes per second: {nodes / elapsed if elapsed else 0:.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,304 @@
+"""
+    Streaming PGN reader: games are read from the file one at a time and replayed on a Board,
+    so memory stays bounded by the longest game, not the size of the file.
+    SAN moves are matched against the legal moves of the Board, the moves valid_moves is built from,
+    generated only for the piece type and destination the move names.
+
+    Usage:
+        python pgn.py games.pgn
+        python pgn.py games.pgn --fens > positions.txt
+        python pgn.py games.pgn --limit 10000
+"""
+
+import argparse
+import re
+import sys
+import time
+
+from constants import *
+from bitboard import *
+from board import Board
+
+## SAN of a piece move or pawn move: piece, from file, from rank, destination, promotion
+SAN = re.compile(r"([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?")
+## Tokens of the movetext, comments and variations are skipped by san_tokens
+TOKEN = re.compile(r"""
+    \{[^}]*\}?              # comment
+    | ;[^\n]*               # comment to the end of the line
+    | [()]                  # start or end of a variation
+    | \$\d+                 # numeric annotation glyph
+    | 1-0 | 0-1 | 1/2-1/2 | \*    # result
+    | \d+\.+                # move number
+    | [^\s{};()$]+          # move
+""", re.VERBOSE)
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+## Letter of every piece type in SAN
+ROLE_TO_SAN = {role: char.upper() for char, role in CHAR_TO_ROLE.items()}
+HEADER = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+
+## Games between two progress reports of the command line
+PROGRESS_EVERY = 10000
+
+
+def read_games(file):
+    """Reads the games of a PGN file one at a time
+
+    A game ends at its result, or at the headers of the next game if it has none.
+    Comments in braces can span lines, a line in one that starts with [ is not a header.
+
+    Args:
+        file: The open PGN file, read line by line
+
+    Yields:
+        tuple: The headers of the game as a dict, and its movetext with the lines kept, they end ; comments
+    """
+    headers = {}
+    movetext = []
+    # Whether a comment in braces is open at the end of the last line, and the depth of variations
+    in_comment = False
+    depth = 0
+    for line in file:
+        line = line.strip()
+        if line.startswith("\ufeff"):
+            line = line[1:]
+        start = 0
+        if in_comment:
+            start = line.find("}") + 1
+            if not start:
+                movetext.append(line)
+                continue
+            in_comment = False
+        elif not line or line.startswith("%"):
+            continue
+        elif line.startswith("["):
+            # A header after movetext starts the next game, the last one had no result
+            if movetext:
+                yield headers, "\n".join(movetext)
+                headers, movetext, depth = {}, [], 0
+            match = HEADER.match(line)
+            if match:
+                headers[match.group(1)] = match.group(2).replace('\\"', '"').replace("\\\\", "\\")
+            continue
+        # Start of the text of the current game on the line, after the result of the last one
+        begin = 0
+        for match in TOKEN.finditer(line, start):
+            token = match.group()
+            first = token[0]
+            if first == "{":
+                in_comment = token[-1] != "}"
+            elif first == ";":
+                break
+            elif first == "(":
+                depth += 1
+            elif first == ")":
+                depth = max(depth - 1, 0)
+            elif not depth and token in RESULTS:
+                movetext.append(line[begin:match.end()])
+                yield headers, "\n".join(movetext)
+                headers, movetext = {}, []
+                begin = match.end()
+        rest = line[begin:].strip()
+        if rest:
+            movetext.append(rest)
+    if headers or movetext:
+        yield headers, "\n".join(movetext)
+
+
+def san_tokens(movetext):
+    """Yields the moves of the main line of the movetext, skipping comments, variations and annotations"""
+    depth = 0
+    for match in TOKEN.finditer(movetext):
+        token = match.group()
+        first = token[0]
+        if first == "(":
+            depth += 1
+        elif first == ")":
+            depth = max(depth - 1, 0)
+        elif depth or first in "{;$" or token in RESULTS or token[-1] == ".":
+            continue
+        else:
+            yield token
+
+
+def parse_san(board, san, moves=None):
+    """Finds the move written in Standard Algebraic Notation
+
+    Args:
+        board (Board): The position the move is played in
+        san (str): The move, like "Nbd7", "exd5", "e8=Q+" or "O-O"
+        moves (list): The legal moves of the position, or None to only generate those to the destination
+
+    Returns:
+        int: The move, encoded as in bitboard.encode_move
+
+    Raises:
+        ValueError: If the move is malformed, illegal or ambiguous
+    """
+    text = san.rstrip("+#!?")
+    if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        flag = KING_CASTLE if len(text) == 3 else QUEEN_CASTLE
+        for move in moves if moves is not None else board.legal_moves():
+            if move >> 12 == flag:
+                return move
+        raise ValueError(f"Illegal move {san}")
+
+    match = SAN.fullmatch(text)
+    if not match:
+        raise ValueError(f"Invalid move {san!r}")
+    piece, file, rank, to, promotion = match.groups()
+    role = CHAR_TO_ROLE[piece.lower()] if piece else PAWN
+    to = notation_to_square(to)
+    file = ord(file) - 97 if file else None
+    rank = 8 - int(rank) if rank else None
+    promotion = CHAR_TO_ROLE[promotion.lower()] if promotion else None
+
+    roles = board.bitboard.roles
+    if moves is None:
+        moves = board.bitboard.legal_moves_to(board.turn, role, to, board.en_passant_square())
+    found = 0
+    for move in moves:
+        if move >> 6 & 63 != to:
+            continue
+        frm = move & 63
+        if roles[frm] != role or (file is not None and frm % 8 != file) or (rank is not None and frm // 8 != rank):
+            continue
+        flag = move >> 12
+        if (PROMOTION_ROLES[flag & 3] if flag & PROMOTION else None) != promotion:
+            continue
+        if found:
+            raise ValueError(f"Ambiguous move {san}")
+        found = move
+    if not found:
+        raise ValueError(f"Illegal move {san}")
+    return found
+
+
+def move_to_san(board, move, moves=None):
+    """Writes a move in Standard Algebraic Notation, without check marks
+
+    Args:
+        board (Board): The position the move is played in
+        move (int): The move, encoded as in bitboard.encode_move
+        moves (list): The legal moves of the position, generated if left out
+
+    Returns:
+        str: The move, like "Nbd7", "exd5" or "O-O"
+    """
+    flag = move >> 12
+    if flag == KING_CASTLE:
+        return "O-O"
+    if flag == QUEEN_CASTLE:
+        return "O-O-O"
+    frm, to = move & 63, move >> 6 & 63
+    roles = board.bitboard.roles
+    role = roles[frm]
+    capture = "x" if flag & CAPTURE else ""
+    if role is PAWN:
+        san = (square_to_notation(frm)[0] if capture else "") + capture + square_to_notation(to)
+        if flag & PROMOTION:
+            san += "=" + ROLE_TO_SAN[PROMOTION_ROLES[flag & 3]]
+        return san
+
+    if moves is None:
+        moves = board.legal_moves()
+    # Name the file, the rank or both of the piece if another one of its kind can move there too
+    others = [other & 63 for other in moves if other >> 6 & 63 == to and other & 63 != frm and roles[other & 63] == role]
+    origin = ""
+    if others:
+        if all(other % 8 != frm % 8 for other in others):
+            origin = square_to_notation(frm)[0]
+        elif all(other // 8 != frm // 8 for other in others):
+            origin = square_to_notation(frm)[1]
+        else:
+            origin = square_to_notation(frm)
+    return ROLE_TO_SAN[role] + origin + capture + square_to_notation(to)
+
+
+def play_san(board, movetext):
+    """Plays the moves of the main line of the movetext on the board
+
+    Args:
+        board (Board): The position the game starts from, it is left at the last move played
+        movetext (str): The movetext of the game
+
+    Yields:
+        int: Every move, after it is made on the board
+
+    Raises:
+        ValueError: At the first move that is malformed, illegal or ambiguous
+    """
+    for san in san_tokens(movetext):
+        move = parse_san(board, san)
+        board.make_move(move)
+        yield move
+
+
+def replay(file):
+    """Replays every game of a PGN file
+
+    Args:
+        file: The open PGN file, read line by line
+
+    Yields:
+        tuple: The headers, the moves played, the board at the last move played (None if the FEN
+               header is invalid), and None or the error that stopped the game
+    """
+    for headers, movetext in read_games(file):
+        moves = []
+        board = None
+        try:
+            board = Board.from_fen(headers.get("FEN", START_FEN), calc_moves=False)
+            for move in play_san(board, movetext):
+                moves.append(move)
+        except ValueError as error:
+            yield headers, moves, board, error
+            continue
+        yield headers, moves, board, None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replays the games of a PGN file and reports errors and throughput")
+    parser.add_argument("file", help="The PGN file, - for standard input")
+    parser.add_argument("--fens", action="store_true", help="print the FEN of every position")
+    parser.add_argument("--limit", type=int, help="stop after this many games")
+    args = parser.parse_args(argv)
+
+    file = sys.stdin if args.file == "-" else open(args.file, encoding="utf-8", errors="replace")
+    games = errors = plies = 0
+    start = time.perf_counter()
+    try:
+        for headers, moves, board, error in replay(file):
+            games += 1
+            plies += len(moves)
+            if error is not None:
+                errors += 1
+                print(f"game {games} ({headers.get('White', '?')} - {headers.get('Black', '?')}), "
+                      f"after {len(moves)} plies: {error}", file=sys.stderr)
+            if args.fens and board is not None:
+                # Walk the game back, so every position is printed from the one board
+                fens = [board.to_fen()]
+                for _ in moves:
+                    board.unmake_move()
+                    fens.append(board.to_fen())
+                print("\n".join(reversed(fens)))
+            if games % PROGRESS_EVERY == 0:
+                elapsed = time.perf_counter() - start
+                print(f"{games} games, {games / elapsed:.0f} games/s", file=sys.stderr)
+            if args.limit is not None and games >= args.limit:
+                break
+    finally:
+        if file is not sys.stdin:
+            file.close()
+    elapsed = time.perf_counter() - start
+
+    print(f"Games: {games}", file=sys.stderr)
+    print(f"Errors: {errors}", file=sys.stderr)
+    print(f"Plies: {plies}", file=sys.stderr)
+    print(f"Time: {elapsed:.3f} s", file=sys.stderr)
+    print(f"Games per second: {games / elapsed if elapsed else 0:.1f}", file=sys.stderr)
+    print(f"Plies per second: {plies / elapsed if elapsed else 0:.0f}", file=sys.stderr)
+    return 0 if not errors else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
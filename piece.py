@@ -1,5 +1,44 @@
 from constants import *
-from position import Pos
+from position import Offset, SQUARES
+
+## Steps of every piece, shared by all pieces of a kind
+ORTHOGONAL_OFFSETS = (Offset(1, 0), Offset(-1, 0), Offset(0, 1), Offset(0, -1))
+DIAGONAL_OFFSETS = (Offset(1, 1), Offset(1, -1), Offset(-1, 1), Offset(-1, -1))
+KNIGHT_OFFSETS = (Offset(1, 2), Offset(2, 1), Offset(-1, 2), Offset(-2, 1),
+                  Offset(1, -2), Offset(2, -1), Offset(-1, -2), Offset(-2, -1))
+KING_OFFSETS = ORTHOGONAL_OFFSETS + DIAGONAL_OFFSETS
+WHITE_PAWN_CAPTURES = (Offset(1, -1), Offset(-1, -1))
+BLACK_PAWN_CAPTURES = (Offset(1, 1), Offset(-1, 1))
+
+
+def targets_table(offsets):
+    """Returns the positions on the board one step of offsets away from every square, indexed by Position.index"""
+    return [tuple(target for target in (pos + offset for offset in offsets) if target) for pos in SQUARES]
+
+
+def rays_table(offsets):
+    """Returns the positions along every offset from every square, nearest first, indexed by Position.index"""
+    table = []
+    for pos in SQUARES:
+        rays = []
+        for offset in offsets:
+            ray = []
+            target = pos + offset
+            while target:
+                ray.append(target)
+                target += offset
+            rays.append(tuple(ray))
+        table.append(tuple(rays))
+    return table
+
+
+## Squares attacked from every square, and the rays of the sliding pieces, built once at import
+KNIGHT_TARGETS = targets_table(KNIGHT_OFFSETS)
+KING_TARGETS = targets_table(KING_OFFSETS)
+PAWN_CAPTURE_TARGETS = {W: targets_table(WHITE_PAWN_CAPTURES), B: targets_table(BLACK_PAWN_CAPTURES)}
+ROOK_RAYS = rays_table(ORTHOGONAL_OFFSETS)
+BISHOP_RAYS = rays_table(DIAGONAL_OFFSETS)
+QUEEN_RAYS = rays_table(KING_OFFSETS)
 
 
 def can_step(board, pos):
@@ -13,17 +52,14 @@ def can_en_passant(board, pos):
 
 
 class Piece:
+    # Behaviour and move tables live on the classes, so an instance is only its role, color and position
+    __slots__ = ("role", "color", "pos")
+
     def __init__(self, role, color, pos):
         self.role = role
         self.color = color
         self.pos = pos
 
-    def seek_step(self, board, pos):
-        if can_step(board, pos):
-            board.valid_moves[self.pos].append(pos)
-            return True
-        return False
-
     def can_attack(self, board, pos):
         if pos.valid:
             piece = board[pos].piece
@@ -31,275 +67,221 @@ class Piece:
                 return True
         return False
 
-    def seek_attack(self, board, pos):
-        if self.can_attack(board, pos):
-            board.valid_moves[self.pos].append(pos)
-            return True
-        return False
-
-    def check(self, board):
-        if self.color is W:
-            board.color_in_check = B
-        else:
-            board.color_in_check = W
-        board.checks.append(self.pos)
-
-    def can_check(self, board, pos):
-        if pos.valid:
-            piece = board[pos].piece
-            return piece and piece.color != self.color and piece.role is KING
-        return False
-
-    def seek_check(self, board, pos):
-        if self.can_check(board, pos):
-            self.check(board)
-            return True
-        return False
-
-    def can_move(self, board, pos):
-        return can_step(board, pos) or self.can_attack(board, pos)
-
-    def seek_move(self, board, pos):
-        if self.can_move(board, pos):
-            board.valid_moves[self.pos].append(pos)
-            return True
-        return False
-
-    def hold(self, board, pos):
-        if pos.valid:
-            tile = board[pos]
-            if self.color is W:
-                tile.held_by_white = True
-            elif self.color is B:
-                tile.held_by_black = True
-
-    def hold_tiles(self, board, list_of_pos):
-        for pos in list_of_pos:
-            self.hold(board, pos)
-
     def __repr__(self):
         return f"{COLOR_TO_STRING[self.color]} {PIECE_TO_STRING[self.role]} at {self.pos.to_notation()}"
 
 
 class SlidingPiece(Piece):
-    def __init__(self, color, role, pos, offsets):
-        self.offsets = offsets
-        super().__init__(role, color, pos)
-
-    def pin(self, board, pos):
-        if pos.valid:
-            tile = board[pos]
-            if self.color is W:
-                tile.pinned_by_white = True
-            elif self.color is B:
-                tile.pinned_by_black = True
-
-    def holds(self, board):
-        # Iterating through offsets
-        for offset in self.offsets:
-            pos = self.pos + offset
-            # If the tile is valid and empty, hold it
-            while can_step(board, pos):
-                self.hold(board, pos)
-                pos += offset
-            # If the tile is valid and occupied by an enemy piece, hold it
-            if self.can_attack(board, pos):
-                self.hold(board, pos)
-
-            # If the tile is valid and occupied by the enemy king, give check
-            if self.can_check(board, pos):
-                self.check(board)
-                # Mark tiles in the path of the king as in check path
-                cast_pos = self.pos + offset
-                board[pos].in_check_path = True
-                while can_step(board, cast_pos):
-                    board[cast_pos].in_check_path = True
-                    cast_pos += offset
-
-            # Pinning an enemy piece if their king is behind them
-            pin_pos = pos + offset
-            while can_step(board, pos):
-                pos += offset
-            if self.can_check(board, pos):
-                self.pin(board, pin_pos)
-
-    def moves(self, board):
-        for offset in self.offsets:
-            pos = self.pos + offset
-            while self.seek_step(board, pos):
-                pos += offset
-            self.seek_attack(board, pos)
+    __slots__ = ()
+    # The positions along every offset from every square
+    rays = ()
+
+    def moves(self, board, mask):
+        tiles = board.tiles
+        moves = board.valid_moves[self.pos]
+        for ray in self.rays[self.pos.index]:
+            for pos in ray:
+                piece = tiles[pos.y][pos.x].piece
+                if piece and piece.color is self.color:
+                    break
+                if mask >> pos.index & 1:
+                    moves.append(pos)
+                if piece:
+                    break
 
 
 class Rook(SlidingPiece):
+    __slots__ = ()
+    rays = ROOK_RAYS
+
     def __init__(self, color, pos):
-        offsets = [Pos(1, 0), Pos(-1, 0), Pos(0, 1), Pos(0, -1)]
-        super().__init__(color, ROOK, pos, offsets)
+        super().__init__(ROOK, color, pos)
 
 
 class Bishop(SlidingPiece):
+    __slots__ = ()
+    rays = BISHOP_RAYS
+
     def __init__(self, color, pos):
-        offsets = [Pos(1, 1), Pos(1, -1), Pos(-1, 1), Pos(-1, -1)]
-        super().__init__(color, BISHOP, pos, offsets)
+        super().__init__(BISHOP, color, pos)
 
 
 class Queen(SlidingPiece):
+    __slots__ = ()
+    rays = QUEEN_RAYS
+
     def __init__(self, color, pos):
-        offsets = [Pos(1, 0), Pos(-1, 0), Pos(0, 1), Pos(0, -1), Pos(1, 1), Pos(1, -1), Pos(-1, 1), Pos(-1, -1)]
-        super().__init__(color, QUEEN, pos, offsets)
+        super().__init__(QUEEN, color, pos)
 
 
 class Knight(Piece):
+    __slots__ = ()
+
     def __init__(self, color, pos):
-        self.offsets = [Pos(1, 2), Pos(2, 1), Pos(-1, 2), Pos(-2, 1), Pos(1, -2), Pos(2, -1), Pos(-1, -2), Pos(-2, -1)]
         super().__init__(KNIGHT, color, pos)
 
-    def moves(self, board):
-        for offset in self.offsets:
-            self.seek_move(board, self.pos + offset)
-            self.seek_check(board, self.pos + offset)
-
-    def holds(self, board):
-        held_tiles = []
-        for offset in self.offsets:
-            held_tiles.append(self.pos + offset)
-        self.hold_tiles(board, held_tiles)
+    def moves(self, board, mask):
+        tiles = board.tiles
+        moves = board.valid_moves[self.pos]
+        for pos in KNIGHT_TARGETS[self.pos.index]:
+            if mask >> pos.index & 1:
+                piece = tiles[pos.y][pos.x].piece
+                if not piece or piece.color is not self.color:
+                    moves.append(pos)
 
 
 class King(Piece):
+    __slots__ = ()
+
     def __init__(self, color, pos):
-        self.offsets = [Pos(1, 0), Pos(-1, 0), Pos(0, 1), Pos(0, -1), Pos(1, 1), Pos(1, -1), Pos(-1, 1), Pos(-1, -1)]
         super().__init__(KING, color, pos)
 
-    def can_move(self, board, pos):
-        if pos.valid:
-            tile = board[pos]
-            not_attacked = not tile.held_by_white if self.color is B else not tile.held_by_black
-            can_move = super().can_move(board, pos)
-            return can_move and not_attacked
-        return False
-
-    def seek_move(self, board, pos):
-        if self.can_move(board, pos):
-            board.valid_moves[self.pos].append(pos)
-
-    def moves(self, board):
-        for offset in self.offsets:
-            self.seek_move(board, self.pos + offset)
-
-    def holds(self, board):
-        for offset in self.offsets:
-            self.hold(board, self.pos + offset)
+    def moves(self, board, mask):
+        tiles = board.tiles
+        moves = board.valid_moves[self.pos]
+        # The mask of the king only has the tiles it can step to without being attacked
+        for pos in KING_TARGETS[self.pos.index]:
+            if mask >> pos.index & 1:
+                piece = tiles[pos.y][pos.x].piece
+                if not piece or piece.color is not self.color:
+                    moves.append(pos)
 
 
 class Pawn(Piece):
+    __slots__ = ()
+
     def __init__(self, color, pos):
         super().__init__(PAWN, color, pos)
 
     def seek_en_passant(self, board, pos):
-        if can_en_passant(board, pos):
+        # Two pawns leave the row at once, so the check mask and pin lines can't tell if it exposes the king
+        if can_en_passant(board, pos) and board.bitboard.en_passant_is_legal(self.color, self.pos.index, pos.index):
             board.valid_moves[self.pos].append(pos)
 
+    def moves(self, board, mask):
+        moves = board.valid_moves[self.pos]
+        one = self.pos + self.push
+        if can_step(board, one):
+            if self.pos.y == self.start_row:
+                two = self.pos + self.double_push
+                if can_step(board, two) and mask >> two.index & 1:
+                    moves.append(two)
+            if mask >> one.index & 1:
+                moves.append(one)
+        for pos in PAWN_CAPTURE_TARGETS[self.color][self.pos.index]:
+            if self.can_attack(board, pos):
+                if mask >> pos.index & 1:
+                    moves.append(pos)
+            else:
+                self.seek_en_passant(board, pos)
+
 
 class WhitePawn(Pawn):
+    __slots__ = ()
+    push = Offset(0, -1)
+    double_push = Offset(0, -2)
+    start_row = 6
+
     def __init__(self, position):
         super().__init__(W, position)
 
-    def moves(self, board):
-        if can_step(board, self.pos + Pos(0, -1)) and self.pos.y == 6:
-            self.seek_step(board, self.pos + Pos(0, -2))
-
-        self.seek_step(board, self.pos + Pos(0, -1))
-        self.seek_attack(board, self.pos + Pos(1, -1))
-        self.seek_check(board, self.pos + Pos(1, -1))
-        self.seek_en_passant(board, self.pos + Pos(1, -1))
-        self.seek_attack(board, self.pos + Pos(-1, -1))
-        self.seek_check(board, self.pos + Pos(-1, -1))
-        self.seek_en_passant(board, self.pos + Pos(-1, -1))
-
-    def holds(self, board):
-        self.hold(board, self.pos + Pos(1, -1))
-        self.hold(board, self.pos + Pos(-1, -1))
-
 
 class BlackPawn(Pawn):
+    __slots__ = ()
+    push = Offset(0, 1)
+    double_push = Offset(0, 2)
+    start_row = 1
+
     def __init__(self, pos):
         super().__init__(B, pos)
 
-    def moves(self, board):
-        if can_step(board, self.pos + Pos(0, 1)) and self.pos.y == 1:
-            self.seek_step(board, self.pos + Pos(0, 2))
-
-        self.seek_step(board, self.pos + Pos(0, 1))
-        self.seek_attack(board, self.pos + Pos(1, 1))
-        self.seek_check(board, self.pos + Pos(1, 1))
-        self.seek_en_passant(board, self.pos + Pos(1, 1))
-        self.seek_attack(board, self.pos + Pos(-1, 1))
-        self.seek_check(board, self.pos + Pos(-1, 1))
-        self.seek_en_passant(board, self.pos + Pos(-1, 1))
-
-    def holds(self, board):
-        self.hold(board, self.pos + Pos(1, 1))
-        self.hold(board, self.pos + Pos(-1, 1))
-
 
 class WhiteRook(Rook):
+    __slots__ = ()
+
     def __init__(self, pos):
         super().__init__(W, pos)
 
 
 class BlackRook(Rook):
+    __slots__ = ()
+
     def __init__(self, pos):
         super().__init__(B, pos)
 
 
 class WhiteKnight(Knight):
+    __slots__ = ()
+
     def __init__(self, pos):
         super().__init__(W, pos)
 
 
 class BlackKnight(Knight):
+    __slots__ = ()
+
     def __init__(self, pos):
         super().__init__(B, pos)
 
 
 class WhiteBishop(Bishop):
+    __slots__ = ()
+
     def __init__(self, pos):
         super().__init__(W, pos)
 
 
 class BlackBishop(Bishop):
+    __slots__ = ()
+
     def __init__(self, pos):
         super().__init__(B, pos)
 
 
 class WhiteQueen(Queen):
+    __slots__ = ()
+
     def __init__(self, pos):
         super().__init__(W, pos)
 
 
 class BlackQueen(Queen):
+    __slots__ = ()
+
     def __init__(self, pos):
         super().__init__(B, pos)
 
 
 class WhiteKing(King):
+    __slots__ = ()
+
     def __init__(self, pos):
         super().__init__(W, pos)
 
-    def can_move(self, board, pos):
-        if pos.valid:
-            tile = board[pos]
-            return super().can_move(board, pos) and not tile.held_by_black
-        return False
-
 
 class BlackKing(King):
+    __slots__ = ()
+
     def __init__(self, pos):
         super().__init__(B, pos)
 
-    def can_move(self, board, pos):
-        if pos.valid:
-            tile = board[pos]
-            return super().can_move(board, pos) and not tile.held_by_white
-        return False
+
+# Piece class for every color and role
+PIECE_CLASSES = {
+    W: {
+        PAWN: WhitePawn,
+        KNIGHT: WhiteKnight,
+        BISHOP: WhiteBishop,
+        KING: WhiteKing,
+        ROOK: WhiteRook,
+        QUEEN: WhiteQueen
+    },
+    B: {
+        PAWN: BlackPawn,
+        KNIGHT: BlackKnight,
+        BISHOP: BlackBishop,
+        KING: BlackKing,
+        ROOK: BlackRook,
+        QUEEN: BlackQueen
+    }
+}
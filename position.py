@@ -1,27 +1,81 @@
+"""
+    Positions are interned: there is one Position per square, kept in SQUARES, and one OFF_BOARD
+    sentinel for every position outside the board. Pos(x, y) looks them up instead of allocating.
+    Adding an Offset to a position is a lookup in the table of its neighbours, so walking along
+    a ray allocates nothing. Positions are shared, so they can't be changed.
+"""
+
 from constants import *
 
+## Offsets reach at most this far along x and y, which covers the moves of every piece but sliders,
+## and sliders step one square at a time
+MAX_STEP = 2
+STEP_SPAN = 2 * MAX_STEP + 1
 
-class Position:
+
+class Offset:
+    """A step between two positions, added to a position to get the position it leads to"""
+    __slots__ = ("x", "y", "delta")
 
     def __init__(self, x, y):
         self.x = x
         self.y = y
-        self.valid = self._valid()
+        # Index into Position.steps, None if the step is too long to be in it
+        if -MAX_STEP <= x <= MAX_STEP and -MAX_STEP <= y <= MAX_STEP:
+            self.delta = (y + MAX_STEP) * STEP_SPAN + x + MAX_STEP
+        else:
+            self.delta = None
+
+    def __repr__(self):
+        return f'Offset({self.x}, {self.y})'
+
+    def __eq__(self, other):
+        return self.x == other.x and self.y == other.y
+
+    def __hash__(self):
+        return hash((self.x, self.y))
+
+
+class Position:
+    __slots__ = ("x", "y", "valid", "index", "steps")
+
+    def __new__(cls, x, y):
+        if x in VALID_RANGE and y in VALID_RANGE:
+            return SQUARES[y * SIZE + x]
+        return OFF_BOARD
+
+    @classmethod
+    def _intern(cls, x, y, valid):
+        pos = object.__new__(cls)
+        pos.x = x
+        pos.y = y
+        pos.valid = valid
+        # Index into SQUARES and the tables built on it, -1 off the board
+        pos.index = y * SIZE + x if valid else -1
+        pos.steps = None
+        return pos
 
     def __add__(self, other):
+        delta = other.delta
+        if delta is not None:
+            return self.steps[delta]
+        if not self.valid:
+            return self
         return Position(self.x + other.x, self.y + other.y)
 
     def __sub__(self, other):
-        return Position(self.x - other.x, self.y - other.y)
+        return Offset(self.x - other.x, self.y - other.y)
 
     def __repr__(self):
+        if not self.valid:
+            return 'Pos(off board)'
         return f'Pos({self.x}, {self.y})'
 
     def __eq__(self, other):
-        return self.x == other.x and self.y == other.y
+        return self is other or (self.x == other.x and self.y == other.y)
 
     def __hash__(self):
-        return hash((self.x, self.y))
+        return self.index
 
     def __getitem__(self, key):
         if key == 0:
@@ -32,28 +86,36 @@ class Position:
             raise IndexError('Position only has two values')
 
     def __setitem__(self, key, value):
-        if key == 0:
-            self.x = value
-        elif key == 1:
-            self.y = value
-        else:
-            raise IndexError('Position only has two values')
+        raise TypeError('Positions are shared and can not be changed, use Pos(x, y) for another one')
 
     def __bool__(self):
         return self.valid
 
     def __copy__(self):
-        return Position(self.x, self.y)
+        return self
 
     def __deepcopy__(self, memo):
-        return Position(self.x, self.y)
+        return self
+
+    def __reduce__(self):
+        return Position, (self.x, self.y)
 
     def to_notation(self):
         return f'{chr(self.x + 65)}{8 - self.y}'
 
-    def _valid(self):
-        return self.x in VALID_RANGE and self.y in VALID_RANGE
 
+## The position of every square, indexed by y * 8 + x, and the one of every position off the board
+SQUARES = [Position._intern(index % SIZE, index // SIZE, True) for index in range(SIZE * SIZE)]
+OFF_BOARD = Position._intern(-1, -1, False)
+OFF_BOARD.steps = (OFF_BOARD,) * STEP_SPAN ** 2
+for _pos in SQUARES:
+    _steps = []
+    for _dy in range(-MAX_STEP, MAX_STEP + 1):
+        for _dx in range(-MAX_STEP, MAX_STEP + 1):
+            _x, _y = _pos.x + _dx, _pos.y + _dy
+            _steps.append(SQUARES[_y * SIZE + _x] if _x in VALID_RANGE and _y in VALID_RANGE else OFF_BOARD)
+    _pos.steps = tuple(_steps)
+del _pos, _steps, _dy, _dx, _x, _y
 
 Pos = Position
 
@@ -0,0 +1,465 @@
+"""
+    Game server: hosts many games at once in one process, each a CompactBoard of its own, over TCP.
+    The protocol is one JSON object per line both ways. A request names a command with "cmd",
+    and may carry an "id" that is sent back with its response. Responses come in the order of the requests.
+
+    COMMANDS:
+        {"cmd": "new", "fen": FEN}                    start a game, from the start position without a FEN
+        {"cmd": "move", "game": N, "move": "e2e4"}    play a move, in long algebraic notation
+        {"cmd": "undo", "game": N}                    take back the last move
+        {"cmd": "state", "game": N}                   the position, without changing it
+        {"cmd": "go", "game": N, "time": S, "play": true}
+                                                      search the position, and play the best move if asked to
+        {"cmd": "close", "game": N}                   end a game
+        {"cmd": "stats"}                              counters of the server
+        {"cmd": "metrics", "format": "prometheus"}    counters of the rules engine, see instrument.py,
+                                                      as "metrics", or as Prometheus text in "text"
+
+    Positions are sent as {"ok": true, "game": N, "fen": FEN, "status": STATUS, "legal": [moves]},
+    STATUS being ongoing, check, checkmate, stalemate or fifty-move. Errors are sent as {"ok": false, "error": text}.
+    A game belongs to the connection that started it, and ends with it.
+
+    The legal moves of a position are generated once, sent with it, and a move is checked against them
+    with a dictionary lookup, so moves are handled on the event loop. Searches are the heavy part,
+    they run in a pool of worker processes and the loop keeps serving the other connections meanwhile.
+    With --instrument the workers count their searches too, and send the counters back with every result,
+    so metrics covers the moves of the event loop and the searches of every worker.
+
+    Usage:
+        python server.py serve --port 8765
+        python server.py load --port 8765 --connections 16 --games 1000 --plies 40
+        python server.py load --spawn    (start a server for the run)
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import random
+import subprocess
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from constants import *
+from bitboard import move_to_uci
+from compact import CompactBoard
+from engine import Engine
+import instrument
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+## Longest request or response line, in bytes
+MAX_LINE = 1 << 16
+## Games a connection may have open at once
+MAX_GAMES = 10000
+## Longest search a client may ask for, in seconds
+MAX_ENGINE_TIME = 10.0
+
+# The engine of a worker process
+_engine = None
+
+
+def _init_worker(hash_mb, instrumented):
+    global _engine
+    _engine = Engine(hash_mb=hash_mb)
+    if instrumented:
+        instrument.enable()
+
+
+def _search(task):
+    """Searches a game in a worker
+
+    Args:
+        task (tuple): The FEN the game starts from, its moves, seconds to search for
+
+    Returns:
+        tuple: The best move, its score, and the principal variation, and the counters of the rules engine
+               during the search if the worker is instrumented, otherwise None
+    """
+    fen, moves, seconds = task
+    board = CompactBoard(fen)
+    # Replay the game rather than sending the last FEN, so the search sees repetitions
+    for move in moves:
+        board.make_move(move)
+    _engine.max_time = seconds
+    result = _engine.search(board)
+    if not instrument.enabled():
+        return result, None
+    # Only the counts of this search, the server adds them up
+    stats = instrument.snapshot()
+    instrument.reset()
+    return result, stats
+
+
+class Session:
+    """A game of the server"""
+
+    def __init__(self, fen=START_FEN):
+        """Sets up the game
+
+        Raises:
+            ValueError: If the FEN is malformed
+        """
+        self.fen = fen
+        self.board = CompactBoard(fen)
+        self.moves = []
+        # Legal moves of the position by their notation, None until asked for
+        self.legal = None
+
+    def legal_moves(self):
+        if self.legal is None:
+            self.legal = {move_to_uci(move): move for move in self.board.legal_moves()}
+        return self.legal
+
+    def play(self, uci):
+        """Plays a move given in long algebraic notation, and returns the state of the new position
+
+        The move is taken back if the state can't be built, so the game is left as it was.
+
+        Raises:
+            ValueError: If the move is not legal, or the position after it can't be played on
+        """
+        move = self.legal_moves().get(uci)
+        if move is None:
+            raise ValueError(f"Illegal move {uci}")
+        self.board.make_move(move)
+        self.moves.append(move)
+        self.legal = None
+        try:
+            return self.state()
+        except Exception as error:
+            self.undo()
+            raise ValueError(f"Can't play {uci}: {error}") from error
+
+    def undo(self):
+        if not self.moves:
+            raise ValueError("No move to take back")
+        self.board.unmake_move()
+        self.moves.pop()
+        self.legal = None
+
+    def status(self):
+        in_check = self.board.in_check()
+        if not self.legal_moves():
+            return "checkmate" if in_check else "stalemate"
+        if self.board.halfmove_clock >= 100:
+            return "fifty-move"
+        return "check" if in_check else "ongoing"
+
+    def state(self):
+        return {"fen": self.board.to_fen(), "status": self.status(), "legal": list(self.legal_moves())}
+
+
+class GameServer:
+    """Serves the games of every connection from one event loop"""
+
+    def __init__(self, workers=1, engine_time=ENGINE_TIME, hash_mb=16, instrumented=False):
+        """Initializes the server, the search processes are started on the first search
+
+        Args:
+            workers (int): Processes to search with
+            engine_time (float): Seconds to search for when a request doesn't say
+            hash_mb (float): Memory of the transposition table of every search process
+            instrumented (bool): Count and time the rules engine in the search processes, see instrument.py
+        """
+        self.workers = workers
+        self.engine_time = engine_time
+        self.hash_mb = hash_mb
+        self.instrumented = instrumented
+        self.pool = None
+        self.sessions = {}
+        self.next_game = 0
+        self.connections = 0
+        self.requests = 0
+        self.moves = 0
+        self.searches = 0
+        self.started = time.perf_counter()
+        self.commands = {"new": self.new, "move": self.move, "undo": self.undo, "state": self.state,
+                         "go": self.go, "close": self.close_game, "stats": self.stats, "metrics": self.metrics}
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        server = await asyncio.start_server(self.handle, host, port, limit=MAX_LINE)
+        print(f"Serving on {', '.join(str(socket.getsockname()) for socket in server.sockets)}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+    async def handle(self, reader, writer):
+        """Answers the requests of a connection until it closes"""
+        self.connections += 1
+        owned = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = await self.respond(line, owned)
+                writer.write(json.dumps(response, separators=(",", ":")).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            # ValueError: a line longer than MAX_LINE, the stream can't be read past it
+            pass
+        finally:
+            self.connections -= 1
+            for game in owned:
+                del self.sessions[game]
+            writer.close()
+
+    async def respond(self, line, owned):
+        """Returns the response to a request line"""
+        self.requests += 1
+        request = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("A request must be a JSON object")
+            command = self.commands.get(request.get("cmd"))
+            if command is None:
+                raise ValueError(f"Unknown command {request.get('cmd')!r}")
+            response = command(request, owned)
+            if asyncio.iscoroutine(response):
+                response = await response
+        except (ValueError, TypeError) as error:
+            response = {"ok": False, "error": str(error)}
+        except Exception as error:
+            # A bug in a command or an error of a search process, the connection can go on
+            response = {"ok": False, "error": f"{type(error).__name__}: {error}"}
+        if isinstance(request, dict) and "id" in request:
+            response["id"] = request["id"]
+        return response
+
+    def session(self, request, owned):
+        game = request.get("game")
+        if game not in owned:
+            raise ValueError(f"No game {game}")
+        return self.sessions[game]
+
+    def new(self, request, owned):
+        if len(owned) >= MAX_GAMES:
+            raise ValueError(f"A connection can't have more than {MAX_GAMES} games")
+        session = Session(request.get("fen", START_FEN))
+        game = self.next_game
+        self.next_game += 1
+        self.sessions[game] = session
+        owned.add(game)
+        return {"ok": True, "game": game, **session.state()}
+
+    def move(self, request, owned):
+        state = self.session(request, owned).play(request.get("move"))
+        self.moves += 1
+        return {"ok": True, "game": request["game"], **state}
+
+    def undo(self, request, owned):
+        session = self.session(request, owned)
+        session.undo()
+        return {"ok": True, "game": request["game"], **session.state()}
+
+    def state(self, request, owned):
+        return {"ok": True, "game": request.get("game"), **self.session(request, owned).state()}
+
+    async def go(self, request, owned):
+        session = self.session(request, owned)
+        if not session.legal_moves():
+            raise ValueError("The game is over")
+        seconds = float(request.get("time", self.engine_time))
+        # json.loads reads NaN and Infinity, a search without a deadline would hold a worker for good
+        if not math.isfinite(seconds) or seconds <= 0:
+            raise ValueError(f"The time must be a positive number of seconds, not {request.get('time')!r}")
+        seconds = min(seconds, MAX_ENGINE_TIME)
+        if self.pool is None:
+            # Spawn, so the workers don't inherit the event loop and its sockets
+            self.pool = ProcessPoolExecutor(self.workers, multiprocessing.get_context("spawn"),
+                                            initializer=_init_worker, initargs=(self.hash_mb, self.instrumented))
+        (move, score, pv), stats = await asyncio.get_running_loop().run_in_executor(
+            self.pool, _search, (session.fen, list(session.moves), seconds))
+        self.searches += 1
+        if stats is not None:
+            instrument.add(stats)
+        response = {"ok": True, "game": request["game"], "move": move_to_uci(move), "score": score,
+                    "pv": [move_to_uci(move) for move in pv]}
+        if request.get("play"):
+            response.update(session.play(response["move"]))
+            self.moves += 1
+        return response
+
+    def close_game(self, request, owned):
+        self.session(request, owned)
+        owned.remove(request["game"])
+        del self.sessions[request["game"]]
+        return {"ok": True, "game": request["game"]}
+
+    def stats(self, request, owned):
+        return {"ok": True, "games": len(self.sessions), "connections": self.connections,
+                "requests": self.requests, "moves": self.moves, "searches": self.searches,
+                "uptime": round(time.perf_counter() - self.started, 3)}
+
+    def metrics(self, request, owned):
+        if request.get("format") == "prometheus":
+            return {"ok": True, "text": instrument.to_prometheus()}
+        return {"ok": True, "metrics": instrument.snapshot()}
+
+
+class Client:
+    """A connection to the server, requests can be sent without waiting for the answers of earlier ones"""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        # Futures of the requests sent and not answered yet, and when they were sent, in order
+        self.pending = deque()
+        self.latencies = []
+        self.receiver = asyncio.create_task(self.receive())
+
+    @classmethod
+    async def connect(cls, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        reader, writer = await asyncio.open_connection(host, port, limit=MAX_LINE)
+        return cls(reader, writer)
+
+    async def receive(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            future, sent = self.pending.popleft()
+            self.latencies.append(time.perf_counter() - sent)
+            future.set_result(json.loads(line))
+        for future, _ in self.pending:
+            future.set_exception(ConnectionError("The server closed the connection"))
+
+    async def request(self, **request):
+        """Sends a request and returns its response
+
+        Raises:
+            ValueError: If the server answers with an error
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((future, time.perf_counter()))
+        self.writer.write(json.dumps(request, separators=(",", ":")).encode() + b"\n")
+        response = await future
+        if not response["ok"]:
+            raise ValueError(response["error"])
+        return response
+
+    async def close(self):
+        self.writer.close()
+        await self.receiver
+
+
+async def play_random_games(client, plies, rng):
+    """Plays random moves in a game of the server, starting a new game whenever one ends
+
+    Returns:
+        int: The number of moves played
+    """
+    state = await client.request(cmd="new")
+    for _ in range(plies):
+        if not state["legal"]:
+            await client.request(cmd="close", game=state["game"])
+            state = await client.request(cmd="new")
+        state = await client.request(cmd="move", game=state["game"], move=rng.choice(state["legal"]))
+    await client.request(cmd="close", game=state["game"])
+    return plies
+
+
+def percentile(values, fraction):
+    """Returns the nearest-rank percentile of the sorted values, the smallest with the fraction at or below it"""
+    return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+
+async def load(host, port, connections, games, plies, seed=0):
+    """Plays random games on the server and prints the moves per second and the latency of the requests
+
+    Args:
+        connections (int): Connections to open
+        games (int): Games to play at once on every connection
+        plies (int): Moves to play in every game
+    """
+    clients = [await Client.connect(host, port) for _ in range(connections)]
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    played = await asyncio.gather(*(play_random_games(client, plies, random.Random(rng.random()))
+                                    for client in clients for _ in range(games)))
+    elapsed = time.perf_counter() - start
+    stats = await clients[0].request(cmd="stats")
+    for client in clients:
+        await client.close()
+
+    latencies = sorted(latency for client in clients for latency in client.latencies)
+    moves = sum(played)
+    print(f"{connections} connections x {games} games, {moves} moves in {elapsed:.2f} s: {moves / elapsed:.0f} moves/s")
+    print(f"{len(latencies)} requests, latency ms  p50 {percentile(latencies, 0.5) * 1000:.2f}"
+          f"  p90 {percentile(latencies, 0.9) * 1000:.2f}  p99 {percentile(latencies, 0.99) * 1000:.2f}"
+          f"  max {latencies[-1] * 1000:.2f}")
+    print(f"Server: {stats['requests']} requests, {stats['moves']} moves")
+
+
+async def wait_for_server(host, port, timeout=10.0):
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            client = await Client.connect(host, port)
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+            continue
+        await client.close()
+        return
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serves games over TCP, and plays random games against it")
+    commands = parser.add_subparsers(dest="command", required=True)
+    command = commands.add_parser("serve", help="serve games")
+    command.add_argument("--host", default=DEFAULT_HOST)
+    command.add_argument("--port", type=int, default=DEFAULT_PORT)
+    command.add_argument("--workers", type=int, default=1, help="processes to search with")
+    command.add_argument("--engine-time", type=float, default=ENGINE_TIME, help="seconds to search for by default")
+    command.add_argument("--instrument", action="store_true", help="count and time the rules engine, see metrics")
+    command = commands.add_parser("load", help="play random games on a server and measure it")
+    command.add_argument("--host", default=DEFAULT_HOST)
+    command.add_argument("--port", type=int, default=DEFAULT_PORT)
+    command.add_argument("--connections", type=int, default=16)
+    command.add_argument("--games", type=int, default=64, help="games at once on every connection")
+    command.add_argument("--plies", type=int, default=40, help="moves to play in every game")
+    command.add_argument("--seed", type=int, default=0)
+    command.add_argument("--spawn", action="store_true", help="start a server on the port for the run")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        if args.instrument:
+            instrument.enable()
+        try:
+            game_server = GameServer(args.workers, args.engine_time, instrumented=args.instrument)
+            asyncio.run(game_server.serve(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    server = None
+    if args.spawn:
+        server = subprocess.Popen([sys.executable, __file__, "serve", "--host", args.host, "--port", str(args.port)],
+                                  stdout=subprocess.DEVNULL)
+    try:
+        if server is not None:
+            asyncio.run(wait_for_server(args.host, args.port))
+        asyncio.run(load(args.host, args.port, args.connections, args.games, args.plies, args.seed))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,219 @@
+"""
+    Endgame tablebases for a king and a few pieces against a lone king, generated by tbgen.py.
+
+    A table holds, for every position of its material, the result for the side to move and the distance
+    to mate in plies, with perfect play: the winner mates as fast as it can, the loser holds out as long as it can.
+    Tables are named by the pieces of the strong side, then the lone king: KQK, KRK, KPK, KBNK...
+    The strong side is white in the table, positions where black has the pieces are probed with the colors
+    and rows flipped. A probe reads two bytes of the memory mapped file.
+
+    FILE (little endian):
+        header      magic, material, number of positions
+        results     2 bits per position: DRAW, WIN, LOSS or ILLEGAL for the side to move
+        distances   1 byte per position, plies to mate, 0 for a draw
+    Positions are indexed by side to move, white king, black king, then the white pieces, 6 bits per square.
+    Every table is symmetric left to right, so only the white king on files a to d is stored.
+
+    Usage:
+        python tablebase.py tables 8/8/8/8/8/2k5/8/1QK5 b - - 0 1
+"""
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+
+from constants import *
+from bitboard import squares_of, popcount, move_to_uci
+from board import Board
+
+MAGIC = b"CHESSTB1"
+HEADER = struct.Struct("<8s8sQ")
+
+## Result of a position for the side to move, as stored in the file
+DRAW = 0
+WIN = 1
+LOSS = 2
+ILLEGAL = 3
+
+## Order of the pieces in the name of a table, and the letter of every role
+TABLE_ORDER = (QUEEN, ROOK, BISHOP, KNIGHT, PAWN)
+ROLE_LETTERS = {QUEEN: "Q", ROOK: "R", BISHOP: "B", KNIGHT: "N", PAWN: "P"}
+LETTER_ROLES = {letter: role for role, letter in ROLE_LETTERS.items()}
+
+def table_name(roles):
+    """Returns the name of the table of a lone king against a king and the pieces, like KBNK"""
+    return "K" + "".join(ROLE_LETTERS[role] for role in roles) + "K"
+
+
+def name_roles(name):
+    """Returns the roles of the pieces of a table name, in table order
+
+    Raises:
+        ValueError: If the name is not a king and pieces against a lone king
+    """
+    name = name.upper()
+    if len(name) < 2 or name[0] != "K" or name[-1] != "K" or any(letter not in LETTER_ROLES for letter in name[1:-1]):
+        raise ValueError(f"Invalid table {name!r}, expected a king and pieces against a lone king, like KBNK")
+    return tuple(sorted((LETTER_ROLES[letter] for letter in name[1:-1]), key=TABLE_ORDER.index))
+
+
+class TableFile:
+    """A table written by write, read through a memory map"""
+
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            # An empty file can't be mapped, and a shorter one than the header can't be read
+            if os.fstat(file.fileno()).st_size < HEADER.size:
+                raise ValueError(f"{path} is not a tablebase")
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, name, self.positions = HEADER.unpack_from(self.data)
+        self.distances = HEADER.size + (self.positions + 3) // 4
+        try:
+            if magic != MAGIC or len(self.data) != self.distances + self.positions:
+                raise ValueError(f"{path} is not a tablebase")
+            self.roles = name_roles(name.rstrip(b"\0").decode("ascii"))
+        except ValueError:
+            self.close()
+            raise
+
+    def close(self):
+        self.data.close()
+
+    def probe(self, turn, squares):
+        """Returns the result and distance of a position
+
+        Args:
+            turn (int): The side to move, white has the pieces
+            squares (list): The squares of the white king, the black king and the pieces, in the order of roles
+        """
+        if squares[0] & 7 >= 4:
+            squares = [sq ^ 7 for sq in squares]
+        index = turn * 32 + (squares[0] >> 3) * 4 + (squares[0] & 7)
+        for sq in squares[1:]:
+            index = index * 64 + sq
+        result = self.data[HEADER.size + (index >> 2)] >> (index & 3) * 2 & 3
+        return result, self.data[self.distances + index]
+
+
+def material(board):
+    """Finds how a table indexes the position on the board
+
+    Returns:
+        tuple: The roles of the pieces of the strong side in table order, the side to move and the squares
+               of the kings and the pieces as white has the pieces, or None if both sides have pieces
+    """
+    bitboard = board.bitboard
+    white, black = bitboard.occupancy
+    strong = W if popcount(white) >= popcount(black) else B
+    if popcount(bitboard.occupancy[strong ^ 1]) != 1:
+        return None
+    pieces = bitboard.pieces[strong]
+    roles = tuple(role for role in TABLE_ORDER for _ in squares_of(pieces[role]))
+    squares = [bitboard.king_square(strong), bitboard.king_square(strong ^ 1)]
+    squares += [sq for role in TABLE_ORDER for sq in squares_of(pieces[role])]
+    turn = board.turn
+    if strong is B:
+        # Flip the rows, so the pieces are white and pawns move up the board
+        squares = [sq ^ 56 for sq in squares]
+        turn ^= 1
+    return roles, turn, squares
+
+
+class Tablebases:
+    """The tables of a directory, probed by the material on the board"""
+
+    def __init__(self, directory):
+        """Opens the tables of the directory, a damaged table is left out and reported
+
+        Args:
+            directory (str): The directory of the .tb files
+        """
+        self.directory = directory
+        self.tables = {}
+        # Names of the tables left out and why
+        self.skipped = {}
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".tb"):
+                try:
+                    table = TableFile(os.path.join(directory, name))
+                except ValueError as error:
+                    print(f"Skipping {name}: {error}", file=sys.stderr)
+                    self.skipped[name] = str(error)
+                    continue
+                self.tables[table.roles] = table
+        # Most pieces on the board, kings included, a table is found for
+        self.max_pieces = max((len(roles) + 2 for roles in self.tables), default=2)
+
+    def close(self):
+        for table in self.tables.values():
+            table.close()
+
+    def probe(self, board):
+        """Looks the position up in the tables
+
+        Returns:
+            tuple: WIN, DRAW or LOSS for the side to move and the plies to mate, or None if there is no table
+                   for the material, or castling rights are left
+        """
+        if popcount(board.bitboard.occupied) > self.max_pieces or any(any(sides) for sides in board.available_castles):
+            return None
+        found = material(board)
+        if found is None:
+            return None
+        roles, turn, squares = found
+        if not roles:
+            return DRAW, 0
+        table = self.tables.get(roles)
+        if table is None:
+            return None
+        result, distance = table.probe(turn, squares)
+        return (result, distance) if result != ILLEGAL else None
+
+
+def best_move(board, tablebases):
+    """Returns the move that mates fastest, holds out longest, or keeps the draw, or None if a table is missing"""
+    best, best_key = None, None
+    for move in board.legal_moves():
+        board.make_move(move)
+        probed = tablebases.probe(board)
+        board.unmake_move()
+        if probed is None:
+            return None
+        result, distance = probed
+        # The result is the one of the opponent
+        key = (0, distance) if result == LOSS else (1, 0) if result == DRAW else (2, -distance)
+        if best_key is None or key < best_key:
+            best, best_key = move, key
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Probes endgame tablebases, see tbgen.py to generate them")
+    parser.add_argument("dir", help="directory of the tables")
+    parser.add_argument("fen", nargs="+")
+    args = parser.parse_args(argv)
+
+    board = Board.from_fen(" ".join(args.fen), calc_moves=False)
+    tablebases = Tablebases(args.dir)
+    probed = board.probe_tablebase(tablebases)
+    if probed is None:
+        print("No table for this position")
+        return 1
+    result, distance = probed
+    print({WIN: f"Win, mate in {distance} plies", LOSS: f"Loss, mated in {distance} plies", DRAW: "Draw"}[result])
+    move = best_move(board, tablebases)
+    if move is not None:
+        print(f"Best move: {move_to_uci(move)}")
+    probes = 100000
+    start = time.perf_counter()
+    for _ in range(probes):
+        tablebases.probe(board)
+    print(f"{(time.perf_counter() - start) / probes * 1e6:.2f} us per probe")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
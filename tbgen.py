@@ -0,0 +1,373 @@
+"""
+    Generates the endgame tables read by tablebase.py, by retrograde analysis.
+
+    Positions are numpy arrays indexed by the squares of the white king, the black king and every white piece,
+    one per side to move. The moves of a piece from one square to another are applied to every position
+    at once, as a slice of the arrays. Mates are found first, then every ply adds the positions that can
+    move into a position lost one ply earlier (won), and those whose moves all lead into won positions (lost).
+    Captures and promotions leave the material, their results are read from the smaller tables they lead to,
+    which are generated first.
+
+    Usage:
+        python tbgen.py KQK KRK KPK KBNK --dir tables
+        python tbgen.py KQK --dir tables --check 10000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from constants import *
+from bitboard import KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, ROOK_RAYS, BISHOP_RAYS, BETWEEN, squares_of
+from board import Board
+from tablebase import MAGIC, HEADER, DRAW, WIN, LOSS, ILLEGAL, ROLE_LETTERS, table_name, name_roles, material
+
+## Distance of a position without a winning exit
+NO_EXIT = 255
+
+## Position of every square, and the squares of a bitboard as a boolean vector
+SQUARE_INDEX = np.arange(64)
+
+
+def vector(bb):
+    """Returns the squares of a bitboard as a boolean vector of 64"""
+    squares = np.zeros(64, bool)
+    squares[list(squares_of(bb))] = True
+    return squares
+
+
+def piece_moves(role, sq):
+    """Returns the moves of a white piece on sq on an empty board, as (to, squares that must be empty)"""
+    if role is KNIGHT:
+        return [(to, 0) for to in squares_of(KNIGHT_ATTACKS[sq])]
+    if role is KING:
+        return [(to, 0) for to in squares_of(KING_ATTACKS[sq])]
+    if role is PAWN:
+        if not 1 <= sq // 8 <= 6:
+            return []
+        moves = [(sq - 8, 0)]
+        if sq // 8 == 6:
+            moves.append((sq - 16, 1 << sq - 8))
+        return moves
+    rays = (ROOK_RAYS[sq] if role in (ROOK, QUEEN) else 0) | (BISHOP_RAYS[sq] if role in (BISHOP, QUEEN) else 0)
+    return [(to, BETWEEN[sq][to]) for to in squares_of(rays)]
+
+
+def piece_attacks(role, sq):
+    """Returns the squares attacked by a white piece on sq on an empty board, as (to, squares that must be empty)"""
+    if role is PAWN:
+        return [(to, 0) for to in squares_of(PAWN_ATTACKS[W][sq])]
+    return piece_moves(role, sq)
+
+
+class Table:
+    """The results of every position of a material, while it is generated"""
+
+    def __init__(self, roles):
+        # Axis 0 is the white king, 1 the black king, then one per white piece
+        self.roles = (KING, KING) + tuple(roles)
+        self.axes = len(self.roles)
+        self.shape = (64,) * self.axes
+        # Results and distances, indexed by side to move
+        self.results = [np.zeros(self.shape, np.uint8), np.zeros(self.shape, np.uint8)]
+        self.distances = [np.zeros(self.shape, np.uint8), np.zeros(self.shape, np.uint8)]
+
+    def index(self, fixed):
+        """Returns the index of the positions with the squares of some axes fixed, as a dict of axis to square"""
+        return tuple(fixed.get(axis, slice(None)) for axis in range(self.axes))
+
+    def along(self, squares, axis, fixed):
+        """Reshapes a vector of 64 so it broadcasts along axis, in the positions indexed by fixed"""
+        free = [other for other in range(self.axes) if other not in fixed]
+        shape = [1] * len(free)
+        shape[free.index(axis)] = 64
+        return squares.reshape(shape)
+
+    def blocked(self, bb, fixed):
+        """Returns where a piece is on the squares of bb, in the positions indexed by fixed, or False if bb is empty"""
+        if not bb:
+            return False
+        squares = vector(bb)
+        mask = False
+        for axis in range(self.axes):
+            if axis not in fixed:
+                mask = mask | self.along(squares, axis, fixed)
+        return mask
+
+    def squares(self, axis):
+        """Returns the square of the piece of axis in every position, broadcast over all of them"""
+        shape = [1] * self.axes
+        shape[axis] = 64
+        return SQUARE_INDEX.reshape(shape)
+
+    def moves(self, color):
+        """Yields the moves of color that stay in the material, as (axis, from, to, squares that must be empty)"""
+        if color is B:
+            for frm in range(64):
+                for to, _ in piece_moves(KING, frm):
+                    yield 1, frm, to, 0
+            return
+        for axis, role in enumerate(self.roles):
+            if axis == 1:
+                continue
+            for frm in range(64):
+                for to, between in piece_moves(role, frm):
+                    if role is PAWN and to // 8 == 0:
+                        continue
+                    yield axis, frm, to, between
+
+
+def solve(roles, tables=None, log=None):
+    """Generates the table of a lone black king against the white king and pieces
+
+    Args:
+        roles (tuple): The roles of the white pieces, besides the king
+        tables (dict): Tables already generated, by roles, the smaller tables needed are added to it
+        log (callable): Called with a line of progress
+
+    Returns:
+        Table: The results and distances of every position
+    """
+    tables = {} if tables is None else tables
+    roles = tuple(roles)
+    if roles in tables:
+        return tables[roles]
+    log = log or (lambda line: None)
+    # The tables captures and promotions lead to
+    for axis in range(len(roles)):
+        solve(roles[:axis] + roles[axis + 1:], tables, log)
+        if roles[axis] is PAWN:
+            for promotion in (QUEEN, ROOK, BISHOP, KNIGHT):
+                solve(roles[:axis] + (promotion,) + roles[axis + 1:], tables, log)
+
+    start = time.perf_counter()
+    table = Table(roles)
+    shape, axes = table.shape, table.axes
+
+    # Legal positions: no two pieces on a square, no pawn on the first or last row, and the side that just moved
+    # not in check. White is only ever checked by the black king, next to it
+    legal = np.ones(shape, bool)
+    for axis in range(axes):
+        for other in range(axis + 1, axes):
+            legal &= table.squares(axis) != table.squares(other)
+        if table.roles[axis] is PAWN:
+            rows = table.squares(axis) // 8
+            legal &= (rows != 0) & (rows != 7)
+    kings_apart = np.ones(shape, bool)
+    for frm in range(64):
+        for to in squares_of(KING_ATTACKS[frm]):
+            kings_apart[table.index({0: frm, 1: to})] = False
+    black_in_check = np.zeros(shape, bool)
+    for axis, role in enumerate(table.roles):
+        if axis == 1:
+            continue
+        for frm in range(64):
+            for to, between in piece_attacks(role, frm):
+                fixed = {axis: frm, 1: to}
+                index = table.index(fixed)
+                black_in_check[index] |= ~np.asarray(table.blocked(between, fixed))
+    legal &= kings_apart
+    valid = [legal & ~black_in_check, legal]
+
+    # Exits: captures of a white piece by the black king, and promotions of a white pawn
+    # For every position: legal exits, those that lose, the fastest win they give and the slowest loss
+    exits = [np.zeros(shape, np.int16), np.zeros(shape, np.int16)]
+    losing_exits = [np.zeros(shape, np.int16), np.zeros(shape, np.int16)]
+    exit_win = [np.full(shape, NO_EXIT, np.int16), np.full(shape, NO_EXIT, np.int16)]
+    exit_loss = [np.zeros(shape, np.int16), np.zeros(shape, np.int16)]
+
+    def add_exit(color, source, sub_results, sub_distances):
+        exits[color][source] += sub_results != ILLEGAL
+        distance = sub_distances.astype(np.int16) + 1
+        won = sub_results == LOSS
+        exit_win[color][source] = np.where(won, np.minimum(exit_win[color][source], distance), exit_win[color][source])
+        lost = sub_results == WIN
+        losing_exits[color][source] += lost
+        exit_loss[color][source] = np.where(lost, np.maximum(exit_loss[color][source], distance), exit_loss[color][source])
+
+    for axis in range(2, axes):
+        sub = tables[roles[:axis - 2] + roles[axis - 1:]]
+        for frm in range(64):
+            for to in squares_of(KING_ATTACKS[frm]):
+                # The black king takes the piece of axis on to, white moves next in the smaller table
+                source = table.index({1: frm, axis: to})
+                target = sub.index({1: to})
+                add_exit(B, source, sub.results[W][target], sub.distances[W][target])
+        if roles[axis - 2] is PAWN:
+            for promotion in (QUEEN, ROOK, BISHOP, KNIGHT):
+                sub = tables[roles[:axis - 2] + (promotion,) + roles[axis - 1:]]
+                for frm in range(8, 16):
+                    source = table.index({axis: frm})
+                    target = sub.index({axis: frm - 8})
+                    add_exit(W, source, sub.results[B][target], sub.distances[B][target])
+    for color in (W, B):
+        exits[color][~valid[color]] = 0
+
+    moves = [list(table.moves(W)), list(table.moves(B))]
+    # Moves inside the material not known to lose yet, a position is lost when none are left
+    remaining = [np.zeros(shape, np.int16), np.zeros(shape, np.int16)]
+    for color in (W, B):
+        for axis, frm, to, between in moves[color]:
+            source = table.index({axis: frm})
+            target = valid[color ^ 1][table.index({axis: to})]
+            remaining[color][source] += target & ~np.asarray(table.blocked(between, {axis: frm}))
+        remaining[color][~valid[color]] = 0
+
+    results, distances = table.results, table.distances
+    for color in (W, B):
+        results[color][~valid[color]] = ILLEGAL
+    # Mates and stalemates
+    in_check = [np.zeros(shape, bool), black_in_check]
+    stuck = [valid[color] & (remaining[color] == 0) & (exits[color] == 0) for color in (W, B)]
+    new = [stuck[color] & in_check[color] for color in (W, B)]
+    for color in (W, B):
+        results[color][new[color]] = LOSS
+        results[color][stuck[color] & ~in_check[color]] = DRAW
+    undecided = [valid[color] & ~stuck[color] for color in (W, B)]
+    # Exits can decide positions after a quiet ply, keep going until the slowest of them
+    last_exit = max(max(int(exit_win[color][exit_win[color] != NO_EXIT].max(initial=0)),
+                        int(exit_loss[color].max())) for color in (W, B))
+
+    ply = 0
+    quiet = 0
+    while quiet < 2 or ply <= last_exit:
+        ply += 1
+        found = 0
+        decided_now = [None, None]
+        for color in (W, B):
+            enemy = color ^ 1
+            if ply % 2:
+                # Won: a move into a position lost the ply before
+                won = exit_win[color] == ply
+                for axis, frm, to, between in moves[color]:
+                    target = new[enemy][table.index({axis: to})]
+                    if not target.any():
+                        continue
+                    fixed = {axis: frm}
+                    won[table.index(fixed)] |= target & ~np.asarray(table.blocked(between, fixed))
+                won &= undecided[color]
+                decided = won
+                results[color][won] = WIN
+            else:
+                # Lost: every move leads into a won position, the last of them found the ply before
+                for axis, frm, to, between in moves[color]:
+                    target = new[enemy][table.index({axis: to})]
+                    if not target.any():
+                        continue
+                    fixed = {axis: frm}
+                    remaining[color][table.index(fixed)] -= target & ~np.asarray(table.blocked(between, fixed))
+                lost = undecided[color] & (remaining[color] == 0) & (losing_exits[color] == exits[color]) \
+                    & (exit_loss[color] <= ply)
+                decided = lost
+                results[color][lost] = LOSS
+            distances[color][decided] = ply
+            undecided[color] &= ~decided
+            found += int(decided.sum())
+            decided_now[color] = decided
+        new = decided_now
+        quiet = quiet + 1 if not found else 0
+    log(f"{table_name(roles)}: {ply} plies, {sum(int((results[color] == WIN).sum()) for color in (W, B))} wins, "
+        f"{time.perf_counter() - start:.1f} s")
+    tables[roles] = table
+    return table
+
+
+def write(table, path):
+    """Writes a table, with the white king on files a to d only"""
+    roles = table.roles[2:]
+    halves = []
+    for values in (table.results, table.distances):
+        stacked = np.stack(values).reshape((2, 8, 8) + table.shape[1:])
+        halves.append(np.ascontiguousarray(stacked[:, :, :4]).reshape(-1))
+    results, distances = halves
+    packed = np.zeros((len(results) + 3) // 4 * 4, np.uint8)
+    packed[:len(results)] = results
+    packed = packed[0::4] | packed[1::4] << 2 | packed[2::4] << 4 | packed[3::4] << 6
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, table_name(roles).encode("ascii"), len(results)))
+        file.write(packed.tobytes())
+        file.write(distances.tobytes())
+
+
+def check(table, samples, seed=0):
+    """Compares the results of random legal positions with the results of their moves
+
+    Returns:
+        int: The number of positions that don't match
+    """
+    rng = np.random.default_rng(seed)
+    errors = checked = 0
+    while checked < samples:
+        turn = int(rng.integers(2))
+        squares = [int(sq) for sq in rng.integers(64, size=table.axes)]
+        if table.results[turn][tuple(squares)] == ILLEGAL:
+            continue
+        checked += 1
+        placement = [["."] * 8 for _ in range(8)]
+        for role, sq, color in zip(table.roles, squares, [W, B] + [W] * (table.axes - 2)):
+            letter = {KING: "K"}.get(role, ROLE_LETTERS.get(role))
+            placement[sq >> 3][sq & 7] = letter if color is W else letter.lower()
+        fen = "/".join("".join(row) for row in placement) + (" w" if turn is W else " b") + " - - 0 1"
+        board = Board.from_fen(fen, calc_moves=False)
+        expected = table.results[turn][tuple(squares)], table.distances[turn][tuple(squares)]
+        children = []
+        for move in board.legal_moves():
+            board.make_move(move)
+            children.append(probe_solved(board))
+            board.unmake_move()
+        if not children:
+            actual = (LOSS, 0) if board.in_check() else (DRAW, 0)
+        elif any(result == LOSS for result, _ in children):
+            actual = WIN, min(distance for result, distance in children if result == LOSS) + 1
+        elif all(result == WIN for result, _ in children):
+            actual = LOSS, max(distance for _, distance in children) + 1
+        else:
+            actual = DRAW, 0
+        if (int(expected[0]), int(expected[1])) != actual:
+            errors += 1
+            print(f"FAIL {fen}: table {expected}, moves {actual}")
+    return errors
+
+
+def probe_solved(board):
+    """Probes the tables generated in this process, as Tablebases.probe does the files"""
+    roles, turn, squares = material(board)
+    table = SOLVED[roles]
+    return int(table.results[turn][tuple(squares)]), int(table.distances[turn][tuple(squares)])
+
+
+## Tables generated in this process, by roles
+SOLVED = {}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generates endgame tablebases and the smaller tables they lead to")
+    parser.add_argument("tables", nargs="+", help="tables like KQK KRK KPK KBNK")
+    parser.add_argument("--dir", default="tables", help="directory to write the tables to")
+    parser.add_argument("--check", type=int, default=0, metavar="N",
+                        help="compare N random positions of every table with the results of their moves")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.dir, exist_ok=True)
+    errors = 0
+    for name in args.tables:
+        solve(name_roles(name), SOLVED, print)
+    for roles, table in SOLVED.items():
+        if not roles:
+            continue
+        path = os.path.join(args.dir, table_name(roles) + ".tb")
+        write(table, path)
+        longest = max(int(table.distances[color].max()) for color in (W, B))
+        print(f"Wrote {path}, {os.path.getsize(path)} bytes, longest mate {longest} plies")
+        if args.check:
+            errors += check(table, args.check)
+    if args.check:
+        print(f"{errors} mismatches")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
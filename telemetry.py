@@ -0,0 +1,192 @@
+"""
+    Frame timing and click latency of the game window.
+
+    Every frame is split in phases: handling the events, making the moves of a click or of the computer,
+    drawing the tiles, and sending them to the display. A phase entered inside another one pauses it,
+    so no time is counted twice.
+    A click is timed from when its event was queued until the frame showing it has been sent to the display.
+    Events that don't carry the time they were queued are timed from when the queue was last found empty
+    before them, the earliest they can have been queued.
+    The last WINDOW samples of each are kept, for percentiles and a histogram, so the numbers follow
+    what the game does now rather than since it started.
+
+    Usage:
+        telemetry = Telemetry()
+        telemetry.start_frame()
+        with telemetry.phase("draw"):
+            ...
+        telemetry.end_frame()
+        print(telemetry.report())
+"""
+
+import json
+import math
+import time
+from collections import deque
+
+## Phases of a frame, in order
+PHASES = ("events", "moves", "draw", "flip")
+## Samples kept of every phase, of the frames and of the clicks
+WINDOW = 1000
+## Upper bounds of the histogram buckets, in milliseconds
+BUCKETS = (1, 2, 4, 8, 16, 33, 50, 100, 250, 500, float("inf"))
+
+
+class Samples:
+    """The last WINDOW values of a timing, in seconds"""
+
+    def __init__(self, window=WINDOW):
+        self.values = deque(maxlen=window)
+        self.count = 0
+
+    def add(self, seconds):
+        self.values.append(seconds)
+        self.count += 1
+
+    def percentile(self, fraction):
+        if not self.values:
+            return 0.0
+        # Nearest rank: the smallest value with at least that fraction of the values at or below it
+        values = sorted(self.values)
+        return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+    def histogram(self):
+        """Returns how many of the values fall under every bound of BUCKETS and above the previous one"""
+        counts = [0] * len(BUCKETS)
+        for seconds in self.values:
+            milliseconds = seconds * 1000
+            for index, bound in enumerate(BUCKETS):
+                if milliseconds <= bound:
+                    counts[index] += 1
+                    break
+        return counts
+
+    def summary(self):
+        values = self.values
+        return {
+            "count": self.count,
+            "mean_ms": sum(values) / len(values) * 1000 if values else 0.0,
+            "p50_ms": self.percentile(0.5) * 1000,
+            "p90_ms": self.percentile(0.9) * 1000,
+            "p99_ms": self.percentile(0.99) * 1000,
+            "max_ms": max(values) * 1000 if values else 0.0,
+            "histogram": dict(zip((f"<={bound}" for bound in BUCKETS), self.histogram())),
+        }
+
+
+class Phase:
+    """Adds the time spent in a with block to a phase of the current frame, less the time of the phases inside it"""
+
+    def __init__(self, telemetry, name):
+        self.telemetry = telemetry
+        self.name = name
+        self.start = 0.0
+        # The phase this one was entered in, paused until this one ends
+        self.outer = None
+
+    def __enter__(self):
+        telemetry = self.telemetry
+        now = time.perf_counter()
+        self.outer = telemetry.running
+        if self.outer is not None:
+            telemetry.current[self.outer.name] += now - self.outer.start
+        telemetry.running = self
+        self.start = now
+
+    def __exit__(self, *exc):
+        telemetry = self.telemetry
+        now = time.perf_counter()
+        telemetry.current[self.name] += now - self.start
+        telemetry.running = self.outer
+        if self.outer is not None:
+            self.outer.start = now
+        self.outer = None
+
+
+class Telemetry:
+    """Collects the timings of the frames and clicks of the game window"""
+
+    def __init__(self, window=WINDOW):
+        self.phases = {name: Samples(window) for name in PHASES}
+        self.frames = Samples(window)
+        self.clicks = Samples(window)
+        # Time spent in every phase of the frame being made, when it started, and clicks it has to show
+        self.current = dict.fromkeys(PHASES, 0.0)
+        self.frame_start = None
+        self.pending_clicks = []
+        self.timers = {name: Phase(self, name) for name in PHASES}
+        self.running = None
+        # When the event queue was last found empty, and when it was found empty before the events being handled
+        self.queue_emptied = time.perf_counter()
+        self.queued_after = self.queue_emptied
+        self.show_overlay = False
+
+    def start_frame(self):
+        self.current = dict.fromkeys(PHASES, 0.0)
+        self.frame_start = time.perf_counter()
+
+    def phase(self, name):
+        return self.timers[name]
+
+    def events_read(self):
+        """Notes that the event queue was emptied, the events taken from it were queued since it was empty before"""
+        self.queued_after = self.queue_emptied
+        self.queue_emptied = time.perf_counter()
+
+    def woke(self):
+        """Notes that waiting on an empty event queue returned, the event that ended the wait was queued just now"""
+        self.queue_emptied = time.perf_counter()
+
+    def click(self, age=None):
+        """Notes a click, it is timed until the next frame is sent to the display
+
+        Args:
+            age (float): Seconds since the click was queued, from the timestamp of its event, or None if the event
+                         has none, then the click is timed from when the queue was found empty before it
+        """
+        self.pending_clicks.append(time.perf_counter() - age if age is not None else self.queued_after)
+
+    def end_frame(self):
+        """Records the frame, once it has been sent to the display"""
+        now = time.perf_counter()
+        if self.frame_start is not None:
+            self.frames.add(now - self.frame_start)
+            for name, seconds in self.current.items():
+                self.phases[name].add(seconds)
+        for clicked in self.pending_clicks:
+            self.clicks.add(now - clicked)
+        self.pending_clicks = []
+        self.frame_start = None
+
+    def summary(self):
+        return {
+            "frames": self.frames.summary(),
+            "clicks": self.clicks.summary(),
+            "phases": {name: samples.summary() for name, samples in self.phases.items()},
+        }
+
+    def overlay_lines(self):
+        """Returns the lines of text of the on-screen overlay"""
+        return [
+            f"frame {self.frames.percentile(0.5) * 1000:.1f} ms  p99 {self.frames.percentile(0.99) * 1000:.1f}",
+            f"click {self.clicks.percentile(0.5) * 1000:.1f} ms  p99 {self.clicks.percentile(0.99) * 1000:.1f}",
+            "  ".join(f"{name} {self.phases[name].percentile(0.99) * 1000:.1f}" for name in PHASES),
+        ]
+
+    def report(self):
+        """Returns the summary as lines of text, a line per timing"""
+        lines = []
+        summary = self.summary()
+        for name, stats in (("frame", summary["frames"]), ("click", summary["clicks"]),
+                            *summary["phases"].items()):
+            lines.append(f"{name:7s} n {stats['count']:6d}  mean {stats['mean_ms']:7.2f}  p50 {stats['p50_ms']:7.2f}"
+                         f"  p99 {stats['p99_ms']:7.2f}  max {stats['max_ms']:7.2f} ms")
+        return "\n".join(lines)
+
+    def dump(self, path):
+        """Writes the summary and the samples kept to a JSON file"""
+        with open(path, "w") as file:
+            json.dump({"summary": self.summary(),
+                       "samples_ms": {"frames": [seconds * 1000 for seconds in self.frames.values],
+                                      "clicks": [seconds * 1000 for seconds in self.clicks.values]}},
+                      file, indent=1)
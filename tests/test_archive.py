@@ -0,0 +1,99 @@
+import os
+
+import pytest
+
+from archive import ArchiveReader, ArchiveWriter, index_path, HEADER, MAGIC, OFFSET, VERSION, WHITE_WINS
+from board import Board
+from constants import START_FEN
+from pgn import parse_san
+
+
+def moves_of(*sans):
+    board = Board.from_fen(START_FEN, calc_moves=False)
+    moves = []
+    for san in sans:
+        moves.append(parse_san(board, san))
+        board.make_move(moves[-1])
+    return moves
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "games.bin")
+
+
+def test_round_trip(path):
+    fen = "4k3/8/8/8/8/8/4P3/4K3 w - - 0 1"
+    with ArchiveWriter(path) as archive:
+        archive.append(moves_of("e4", "e5"))
+        archive.append(fen=fen)
+        archive.extend(moves_of("e3")[:1])
+        archive.set_result(0, WHITE_WINS)
+    with ArchiveWriter(path) as archive:
+        assert len(archive) == 2
+    with ArchiveReader(path) as reader:
+        assert len(reader) == 2
+        assert list(reader.moves(0)) == moves_of("e4", "e5")
+        assert reader.result(0) == WHITE_WINS and reader.fen(1) == fen
+        assert reader.board(1).to_fen() == "4k3/8/8/8/8/4P3/8/4K3 b - - 0 1"
+
+
+def test_move_bounds(path):
+    with ArchiveWriter(path) as archive:
+        archive.append(moves_of("e4", "e5"))
+    with ArchiveReader(path) as reader:
+        assert reader.move(0, 1) == moves_of("e4", "e5")[1]
+        for ply in (-1, 2):
+            with pytest.raises(IndexError):
+                reader.move(0, ply)
+
+
+def test_crash_leftovers_are_dropped(path):
+    with ArchiveWriter(path) as archive:
+        archive.append(moves_of("e4"))
+    # A game written but not indexed, and half an index entry
+    with open(path, "ab") as file:
+        file.write(b"\0\0\1\2")
+    with open(index_path(path), "ab") as file:
+        file.write(b"\1\2\3")
+    with ArchiveWriter(path) as archive:
+        assert len(archive) == 1
+    assert os.path.getsize(index_path(path)) == 2 * OFFSET.size
+
+
+@pytest.mark.parametrize("data, index", [
+    (b"", OFFSET.pack(HEADER.size)),
+    (b"CHESS", OFFSET.pack(HEADER.size)),
+    (b"NOTCHESS\1\0", OFFSET.pack(HEADER.size)),
+    (HEADER.pack(MAGIC, VERSION), b""),
+    (HEADER.pack(MAGIC, VERSION), OFFSET.pack(HEADER.size + 10)),
+])
+def test_damaged_archives_are_rejected(path, data, index):
+    with open(path, "wb") as file:
+        file.write(data)
+    with open(index_path(path), "wb") as file:
+        file.write(index)
+    with pytest.raises(ValueError):
+        ArchiveReader(path)
+    with pytest.raises(ValueError):
+        ArchiveWriter(path)
+    # Nothing is truncated
+    assert os.path.getsize(path) == len(data) and os.path.getsize(index_path(path)) == len(index)
+
+
+def test_missing_index_is_rejected(path):
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION))
+    with pytest.raises(ValueError):
+        ArchiveWriter(path)
+
+
+def test_game_moves_a_damaged_archive_aside(path, monkeypatch):
+    main = pytest.importorskip("main")
+    with open(path, "wb") as file:
+        file.write(b"CHESS")
+    monkeypatch.setattr(main, "ARCHIVE_FILE", path)
+    with main.open_archive() as archive:
+        assert len(archive) == 0
+    with open(path + ".bad", "rb") as file:
+        assert file.read() == b"CHESS"
@@ -0,0 +1,81 @@
+import random
+
+import pytest
+
+from board import Board
+from compact import CompactBoard
+from bitboard import EN_PASSANT
+from constants import START_FEN
+from zobrist import hash_position
+
+
+@pytest.mark.parametrize("fen", [
+    "8/8/8/8/8/8/8/8 w - - 0 1",
+    "4k3/8/8/8/8/8/8/8 w - - 0 1",
+    "4k3/8/8/8/8/8/8/3KK3 w - - 0 1",
+    "3kk3/8/8/8/8/8/8/4K3 b - - 0 1",
+    "4k3/8/8/8/8/8/8/P3K3 w - - 0 1",
+    "p3k3/8/8/8/8/8/8/4K3 w - - 0 1",
+    "4k3/8/8/8/8/8/8/4R1K1 w - - 0 1",
+    "8/8/8/8/8/8/8/3kK3 b - - 0 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR x KQkq - 0 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBN w KQkq - 0 1",
+])
+def test_invalid_fens_are_rejected(fen):
+    with pytest.raises(ValueError):
+        Board.from_fen(fen)
+    with pytest.raises(ValueError):
+        CompactBoard(fen)
+
+
+def test_fen_round_trip():
+    fen = "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1"
+    assert Board.from_fen(fen).to_fen() == fen
+    assert CompactBoard(fen).to_fen() == fen
+    assert Board.from_fen(START_FEN).to_fen() == START_FEN
+
+
+@pytest.mark.parametrize("fen, kept", [
+    ("4k3/8/8/3P4/8/8/8/4K3 w - e6 0 1", "-"),
+    ("4k3/8/8/3Pp3/8/8/8/4K3 w - e6 0 1", "e6"),
+    ("4k3/8/8/8/3pP3/8/8/4K3 b - e3 0 1", "e3"),
+    ("4k3/8/8/8/3p4/8/8/4K3 b - e3 0 1", "-"),
+])
+def test_en_passant_needs_the_pawn_that_moved(fen, kept):
+    for board in (Board.from_fen(fen), CompactBoard(fen)):
+        assert board.to_fen().split()[3] == kept
+        assert all(move >> 12 != EN_PASSANT for move in board.legal_moves()) == (kept == "-")
+
+
+def scratch_hash(board):
+    return hash_position(board.bitboard, board.turn, board.available_castles, board.en_passant_square())
+
+
+@pytest.mark.parametrize("fen", [
+    START_FEN,
+    "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+    # Promotions, with and without captures, and en passant
+    "r3k3/1P3pp1/8/3pP3/8/8/1p4PP/R3K2R w KQq d6 0 1",
+])
+def test_incremental_hash_matches_scratch_hash(fen):
+    rng = random.Random(fen)
+    for _ in range(20):
+        board = Board.from_fen(fen, calc_moves=False)
+        compact = CompactBoard(fen)
+        hashes = [scratch_hash(board)]
+        assert board.hash == hashes[0] == compact.hash
+        for _ in range(60):
+            moves = board.legal_moves()
+            if not moves:
+                break
+            move = rng.choice(moves)
+            board.make_move(move)
+            compact.make_move(move)
+            hashes.append(scratch_hash(board))
+            assert board.hash == hashes[-1] == compact.hash
+        while board.history:
+            board.unmake_move()
+            compact.unmake_move()
+            hashes.pop()
+            assert board.hash == hashes[-1] == compact.hash
+        assert board.to_fen() == fen
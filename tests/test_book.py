@@ -0,0 +1,53 @@
+import io
+import random
+
+import pytest
+
+from book import OpeningBook, build, fen_lines, parse_uci, HEADER, MAGIC, RECORD
+from board import Board
+from constants import START_FEN
+
+LINES = f"""# start position
+{START_FEN} e2e4 e7e5 g1f3
+{START_FEN} e2e4 c7c5
+{START_FEN} d2d4
+"""
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "book.bin")
+
+
+def test_round_trip(path):
+    assert build(fen_lines(io.StringIO(LINES), plies=2), path) == 4
+    board = Board.from_fen(START_FEN, calc_moves=False)
+    with OpeningBook(path) as book:
+        assert len(book) == 4
+        assert board.book_moves(book) == [(parse_uci(board, "e2e4"), 2), (parse_uci(board, "d2d4"), 1)]
+        board.make_move(parse_uci(board, "e2e4"))
+        assert sorted(weight for _, weight in board.book_moves(book)) == [1, 1]
+        board.make_move(parse_uci(board, "e7e5"))
+        # Past the plies that went into the book
+        assert book.probe(board.hash) == [] and book.choose(board, random.Random(1)) is None
+
+
+def test_unknown_key(path):
+    build(fen_lines(io.StringIO(LINES), plies=1), path)
+    with OpeningBook(path) as book:
+        for key in (0, 2**64 - 1):
+            assert book.probe(key) == []
+
+
+@pytest.mark.parametrize("data", [
+    b"",
+    MAGIC[:2],
+    b"NOTABOOK" + bytes(4),
+    # One record too few for the count in the header
+    HEADER.pack(MAGIC, 2) + RECORD.pack(1, 2, 3),
+])
+def test_damaged_file_is_rejected(path, data):
+    with open(path, "wb") as file:
+        file.write(data)
+    with pytest.raises(ValueError):
+        OpeningBook(path)
@@ -0,0 +1,37 @@
+import pytest
+
+from bitboard import move_to_uci
+from board import Board
+from compact import CompactBoard, check
+from constants import W, B, PAWN
+from engine import is_repetition
+
+
+def play(board, *ucis):
+    for uci in ucis:
+        board.make_move({move_to_uci(move): move for move in board.legal_moves()}[uci])
+
+
+def test_matches_board():
+    assert check(100, 60, seed=3) == 0
+
+
+def test_captured_pawn_is_not_falsy():
+    board = CompactBoard("4k3/8/8/3p4/4P3/8/8/4K3 w - - 0 1")
+    play(board, "e4d5", "e8d7")
+    assert board.history[0][2] == (B, PAWN)
+    assert board.history[-1][2] is None
+    play(board, "e1d2", "d7d6", "d2e3", "d6d5")
+    assert board.history[-1][2] == (W, PAWN)
+
+
+@pytest.mark.parametrize("factory", [CompactBoard, lambda: Board(calc_moves=False)])
+def test_repetition(factory):
+    board = factory()
+    play(board, "g1f3", "g8f6", "f3g1")
+    assert not is_repetition(board)
+    play(board, "f6g8")
+    assert is_repetition(board)
+    assert list(board.hashes) == [record[6] for record in board.history]
+    board.unmake_move()
+    assert not is_repetition(board) and len(board.hashes) == 3
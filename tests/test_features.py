@@ -0,0 +1,16 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from board import Board
+from features import board_features, check, random_fens
+
+
+def test_batch_matches_board_features():
+    assert check(random_fens(300, seed=1))
+
+
+def test_board_is_left_as_it_was():
+    board = Board.from_fen(random_fens(1, seed=2)[0], calc_moves=False)
+    board_features(board)
+    assert board.bitboard.attack_map is None
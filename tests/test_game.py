@@ -0,0 +1,47 @@
+import json
+import os
+
+import pytest
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+main = pytest.importorskip("main")
+
+from archive import ArchiveReader, BLACK_WINS
+from position import Pos
+
+
+@pytest.fixture
+def game(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "ARCHIVE_FILE", str(tmp_path / "games.bin"))
+    monkeypatch.setattr(main, "TELEMETRY_FILE", str(tmp_path / "telemetry.json"))
+    monkeypatch.setattr(main, "RESUME_GAME", False)
+    monkeypatch.setattr(main, "TELEMETRY", True)
+    return main.Game(engine_color=None)
+
+
+def test_checkmate_ends_the_loop_and_saves_the_game(game, tmp_path):
+    for old, new in (((5, 6), (5, 5)), ((4, 1), (4, 3)), ((6, 6), (6, 4)), ((3, 0), (7, 4))):
+        game.board.move(Pos(*old), Pos(*new))
+    game.board.calc_moves()
+    # Returns at once instead of waiting for input, the game is over
+    game.run()
+    game.close()
+    with ArchiveReader(main.ARCHIVE_FILE) as reader:
+        assert len(reader) == 1 and len(reader.moves(0)) == 4
+        assert reader.result(0) == BLACK_WINS
+    with open(main.TELEMETRY_FILE) as file:
+        assert "clicks" in json.load(file)["summary"]
+
+
+def test_closing_the_window_ends_the_loop(game):
+    main.pygame.event.post(main.pygame.event.Event(main.pygame.QUIT))
+    game.run()
+    game.close()
+    assert game.event_handler.quit
+
+
+def test_damaged_book_is_not_used(tmp_path, monkeypatch):
+    path = tmp_path / "book.bin"
+    path.write_bytes(b"CH")
+    monkeypatch.setattr(main, "BOOK_FILE", str(path))
+    assert main.open_book() is None
@@ -0,0 +1,34 @@
+import time
+
+import pytest
+
+from board import Board
+from parallel import ParallelEngine
+
+KIWIPETE = "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1"
+
+
+@pytest.fixture(scope="module")
+def engine():
+    engine = ParallelEngine(2, max_time=0.5)
+    engine.start()
+    yield engine
+    engine.close()
+
+
+def test_search_keeps_to_the_budget(engine):
+    # The second search would start late if tasks of the first were left in the queue
+    for _ in range(2):
+        board = Board.from_fen(KIWIPETE)
+        start = time.perf_counter()
+        move, _, _ = engine.search(board)
+        assert time.perf_counter() - start < 1.5
+        assert move in board.legal_moves()
+        assert board.to_fen() == KIWIPETE
+
+
+def test_search_finds_mate(engine):
+    board = Board.from_fen("6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1")
+    move, _, _ = engine.search(board)
+    board.make_move(move)
+    assert not board.legal_moves() and board.in_check()
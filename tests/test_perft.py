@@ -0,0 +1,43 @@
+import pytest
+
+from board import Board
+from constants import TILES, BITBOARD
+from perft import PERFT_SUITE, perft, calc_moves_list
+
+## Largest count checked, the deeper ones are left to perft.py --check
+MAX_NODES = 100000
+
+
+@pytest.mark.parametrize("fen, counts", PERFT_SUITE)
+def test_perft(fen, counts):
+    board = Board.from_fen(fen, calc_moves=False)
+    for depth, expected in enumerate(counts, 1):
+        if expected > MAX_NODES:
+            break
+        assert perft(board, depth) == expected
+    assert board.to_fen() == fen
+
+
+@pytest.mark.parametrize("fen, counts", PERFT_SUITE[:2])
+def test_perft_cache(fen, counts):
+    assert perft(Board.from_fen(fen, calc_moves=False), 3, {}) == counts[2]
+
+
+def walk(tiles, bitboard, depth):
+    """Checks both generators fill the same valid_moves in every position below the boards"""
+    moves = calc_moves_list(tiles)
+    assert sorted(moves) == sorted(calc_moves_list(bitboard))
+    assert tiles.checkmate == bitboard.checkmate
+    assert tiles.markers == bitboard.markers
+    if depth:
+        for move in moves:
+            tiles.make_move(move)
+            bitboard.make_move(move)
+            walk(tiles, bitboard, depth - 1)
+            tiles.unmake_move()
+            bitboard.unmake_move()
+
+
+@pytest.mark.parametrize("fen, counts", PERFT_SUITE)
+def test_generators_agree(fen, counts):
+    walk(Board.from_fen(fen, TILES), Board.from_fen(fen, BITBOARD), 2)
@@ -0,0 +1,41 @@
+import io
+
+from pgn import read_games, replay
+
+GAMES = """[Event "One"]
+[White "A"]
+[Black "B"]
+
+1. e4 {a comment that
+[goes on] over lines} e5 2. Nf3 Nc6 1-0
+1. d4 d5 0-1
+1. c4 e5 1/2-1/2
+
+[Event "Four"]
+
+1. e4 ; the rest of the line
+c5 (1... e5 2. Nf3) 2. Nf3 *
+"""
+
+
+def test_games_end_at_their_result():
+    games = list(read_games(io.StringIO(GAMES)))
+    assert [headers.get("Event") for headers, _ in games] == ["One", None, None, "Four"]
+
+
+def test_comments_and_variations_are_skipped():
+    played = [(moves, error) for _, moves, _, error in replay(io.StringIO(GAMES))]
+    assert [error for _, error in played] == [None] * 4
+    assert [len(moves) for moves, _ in played] == [4, 2, 2, 3]
+
+
+def test_game_without_result_ends_at_next_headers():
+    text = '[Event "One"]\n\n1. e4 e5\n\n[Event "Two"]\n\n1. d4 *\n'
+    games = list(read_games(io.StringIO(text)))
+    assert [headers["Event"] for headers, _ in games] == ["One", "Two"]
+
+
+def test_replay_reports_illegal_moves():
+    (headers, moves, board, error), = replay(io.StringIO("1. e4 e5 2. Ke3 *\n"))
+    assert len(moves) == 2 and "Ke3" in str(error)
+    assert board.to_fen() == "rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq e6 0 2"
@@ -0,0 +1,99 @@
+import asyncio
+import json
+
+import pytest
+
+import instrument
+from compact import CompactBoard
+from constants import START_FEN
+from server import GameServer, percentile
+
+
+def ask(server, owned, **request):
+    return asyncio.run(server.respond(json.dumps(request).encode(), owned))
+
+
+@pytest.fixture
+def server():
+    server = GameServer(engine_time=0.1)
+    yield server
+    server.close()
+
+
+def test_moves_are_checked(server):
+    owned = set()
+    game = ask(server, owned, cmd="new")["game"]
+    response = ask(server, owned, cmd="move", game=game, move="e2e4", id=7)
+    assert response["ok"] and response["id"] == 7 and "e7e5" in response["legal"]
+    assert not ask(server, owned, cmd="move", game=game, move="e2e4")["ok"]
+    assert not ask(server, set(), cmd="state", game=game)["ok"]
+
+
+@pytest.mark.parametrize("line", [b"NaN", b"[1]", b"{", b'{"cmd": "nothing"}'])
+def test_malformed_requests(server, line):
+    assert not asyncio.run(server.respond(line, set()))["ok"]
+
+
+@pytest.mark.parametrize("seconds", [float("nan"), float("inf"), -1, 0, "soon"])
+def test_go_rejects_bad_times(server, seconds):
+    owned = set()
+    game = ask(server, owned, cmd="new")["game"]
+    # json.dumps writes NaN and Infinity, which json.loads reads back
+    response = ask(server, owned, cmd="go", game=game, time=seconds)
+    assert not response["ok"]
+    assert server.pool is None
+
+
+def test_unexpected_errors_are_answered(server):
+    def broken(request, owned):
+        raise KeyError("broken")
+
+    server.commands["broken"] = broken
+    response = ask(server, set(), cmd="broken", id=1)
+    assert response == {"ok": False, "error": "KeyError: 'broken'", "id": 1}
+
+
+def test_go_plays_the_best_move(server):
+    owned = set()
+    game = ask(server, owned, cmd="new", fen="6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1")["game"]
+    response = ask(server, owned, cmd="go", game=game, time=0.5, play=True)
+    assert response["move"] == "a1a8" and response["status"] == "checkmate"
+
+
+def test_new_rejects_impossible_positions(server):
+    response = ask(server, set(), cmd="new", fen="8/8/8/8/8/8/8/8 w - - 0 1")
+    assert not response["ok"] and "king" in response["error"]
+
+
+def test_metrics_count_worker_searches():
+    server = GameServer(engine_time=0.1, instrumented=True)
+    instrument.reset()
+    try:
+        owned = set()
+        game = ask(server, owned, cmd="new")["game"]
+        assert ask(server, owned, cmd="go", game=game)["ok"]
+        phases = ask(server, owned, cmd="metrics")["metrics"]["phases"]
+        assert phases["compact_make_move"]["calls"] > 0
+    finally:
+        server.close()
+        instrument.reset()
+
+
+def test_percentile_is_nearest_rank():
+    assert percentile([1, 2], 0.5) == 1
+    assert percentile([1, 2, 3, 4], 0.99) == 4
+
+
+def test_failed_move_is_taken_back(server, monkeypatch):
+    owned = set()
+    game = ask(server, owned, cmd="new")["game"]
+
+    def broken(board):
+        raise ValueError("negative shift count")
+
+    monkeypatch.setattr(CompactBoard, "in_check", broken)
+    response = ask(server, owned, cmd="move", game=game, move="e2e4")
+    assert not response["ok"] and "e2e4" in response["error"]
+    monkeypatch.undo()
+    state = ask(server, owned, cmd="state", game=game)
+    assert state["fen"] == START_FEN and not server.sessions[game].moves
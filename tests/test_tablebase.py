@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+pytest.importorskip("numpy")
+
+import tbgen
+from board import Board
+from constants import QUEEN
+from tablebase import TableFile, Tablebases, best_move, table_name, HEADER, MAGIC, WIN, LOSS
+
+
+@pytest.fixture(scope="module")
+def directory(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("tables")
+    tbgen.solve((QUEEN,), tbgen.SOLVED)
+    for roles, table in tbgen.SOLVED.items():
+        if roles:
+            tbgen.write(table, os.path.join(directory, table_name(roles) + ".tb"))
+    return str(directory)
+
+
+def test_generated_tables_match_their_moves(directory):
+    assert tbgen.check(tbgen.SOLVED[(QUEEN,)], 300) == 0
+
+
+def test_best_move_mates_in_the_distance_probed(directory):
+    tablebases = Tablebases(directory)
+    try:
+        board = Board.from_fen("8/8/8/4k3/8/8/8/KQ6 w - - 0 1", calc_moves=False)
+        result, distance = tablebases.probe(board)
+        assert result == WIN and distance > 0
+        for _ in range(distance):
+            board.make_move(best_move(board, tablebases))
+        assert not board.legal_moves() and board.in_check()
+        assert tablebases.probe(board) == (LOSS, 0)
+    finally:
+        tablebases.close()
+
+
+@pytest.mark.parametrize("data", [
+    b"",
+    MAGIC[:2],
+    b"NOTATABL" + bytes(HEADER.size - 8),
+    # Fewer positions than the header counts
+    HEADER.pack(MAGIC, b"KQK", 4) + bytes(2),
+    HEADER.pack(MAGIC, b"KXK", 4) + bytes(5),
+])
+def test_damaged_table_is_rejected(tmp_path, data):
+    path = tmp_path / "KQK.tb"
+    path.write_bytes(data)
+    with pytest.raises(ValueError):
+        TableFile(str(path))
+
+
+def test_damaged_table_is_skipped(directory, tmp_path):
+    for name in os.listdir(directory):
+        with open(os.path.join(directory, name), "rb") as source:
+            (tmp_path / name).write_bytes(source.read())
+    (tmp_path / "KRK.tb").write_bytes(MAGIC[:2])
+    tablebases = Tablebases(str(tmp_path))
+    try:
+        assert list(tablebases.skipped) == ["KRK.tb"]
+        board = Board.from_fen("8/8/8/4k3/8/8/8/KQ6 w - - 0 1", calc_moves=False)
+        assert tablebases.probe(board)[0] == WIN
+    finally:
+        tablebases.close()
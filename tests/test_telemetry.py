@@ -0,0 +1,50 @@
+
+import time
+
+import pytest
+
+from telemetry import Samples, Telemetry
+
+
+@pytest.mark.parametrize("values, fraction, expected", [
+    ([1.0, 2.0], 0.5, 1.0),
+    ([1.0, 2.0], 0.99, 2.0),
+    ([3.0, 1.0, 2.0, 4.0], 0.5, 2.0),
+    ([3.0, 1.0, 2.0, 4.0], 0.75, 3.0),
+    ([5.0], 0.0, 5.0),
+    ([], 0.5, 0.0),
+])
+def test_percentile_is_nearest_rank(values, fraction, expected):
+    samples = Samples()
+    for value in values:
+        samples.add(value)
+    assert samples.percentile(fraction) == expected
+
+
+def test_nested_phase_pauses_the_outer_one(monkeypatch):
+    clock = iter(range(100))
+    monkeypatch.setattr(time, "perf_counter", lambda: next(clock))
+    telemetry = Telemetry()
+    telemetry.start_frame()
+    with telemetry.phase("events"):
+        with telemetry.phase("moves"):
+            pass
+    telemetry.end_frame()
+    summary = telemetry.summary()
+    # The frame runs from 1 to 6, events from 2 to 3 and 4 to 5, moves from 3 to 4
+    assert summary["phases"]["events"]["max_ms"] == 2000 and summary["phases"]["moves"]["max_ms"] == 1000
+    assert summary["frames"]["max_ms"] == 5000
+
+
+def test_click_is_timed_from_when_it_was_queued(monkeypatch):
+    now = [10.0]
+    monkeypatch.setattr(time, "perf_counter", lambda: now[0])
+    telemetry = Telemetry()
+    now[0] = 12.0
+    # The queue was empty at 10, the click found at 12 may have been queued right after
+    telemetry.events_read()
+    telemetry.click()
+    telemetry.click(age=0.5)
+    now[0] = 13.0
+    telemetry.end_frame()
+    assert sorted(telemetry.clicks.values) == [1.5, 3.0]
@@ -0,0 +1,95 @@
+"""
+    Transposition table: a fixed number of slots, each a 64-bit key and a 64-bit packed entry,
+    stored in two flat arrays so the memory used is set once and never grows.
+
+    ENTRY LAYOUT (bits):
+        0-31: score + SCORE_OFFSET
+        32-39: depth
+        40-41: bound
+        42-57: best move
+        58-63: age of the search that stored it
+"""
+
+from array import array
+
+## Bound types, 0 marks an empty slot
+EXACT = 1
+LOWER = 2
+UPPER = 3
+
+SCORE_OFFSET = 1 << 31
+AGE_MASK = 63
+BYTES_PER_ENTRY = 16
+
+
+class TranspositionTable:
+    """Fixed size hash table of search results, keyed by Board.hash"""
+
+    def __init__(self, size_mb=16):
+        """Allocates the table
+
+        Args:
+            size_mb (float): The memory to use, rounded down to a power of two number of slots
+        """
+        entries = max(1, int(size_mb * (1 << 20)) // BYTES_PER_ENTRY)
+        # Power of two, so the slot is the low bits of the key
+        self.size = 1 << (entries.bit_length() - 1)
+        self.mask = self.size - 1
+        self.keys = array("Q", bytes(8 * self.size))
+        self.data = array("Q", bytes(8 * self.size))
+        self.age = 0
+
+    def clear(self):
+        self.keys = array("Q", bytes(8 * self.size))
+        self.data = array("Q", bytes(8 * self.size))
+        self.age = 0
+
+    def new_search(self):
+        """Ages the table, so entries of earlier searches are replaced first"""
+        self.age = (self.age + 1) & AGE_MASK
+
+    def probe(self, key):
+        """Looks up a position
+
+        Args:
+            key (int): The hash of the position
+
+        Returns:
+            tuple: (score, depth, bound, move), or None if the position is not stored
+        """
+        index = key & self.mask
+        if self.keys[index] != key:
+            return None
+        data = self.data[index]
+        if not data >> 40 & 3:
+            return None
+        return (data & 0xFFFFFFFF) - SCORE_OFFSET, data >> 32 & 0xFF, data >> 40 & 3, data >> 42 & 0xFFFF
+
+    def store(self, key, score, depth, bound, move):
+        """Stores a search result, unless the slot holds a deeper result of the current search
+
+        Args:
+            key (int): The hash of the position
+            score (int): The score of the position
+            depth (int): The depth it was searched to
+            bound (int): EXACT, LOWER or UPPER
+            move (int): The best move found, 0 if there is none
+        """
+        index = key & self.mask
+        old = self.data[index]
+        if old and self.keys[index] != key and old >> 58 == self.age and old >> 32 & 0xFF > depth:
+            return
+        if move is None:
+            move = 0
+        elif not move and self.keys[index] == key:
+            # Keep the best move of an earlier search of the same position
+            move = old >> 42 & 0xFFFF
+        self.keys[index] = key
+        self.data[index] = ((score + SCORE_OFFSET) | min(depth, 255) << 32 | bound << 40
+                            | move << 42 | self.age << 58)
+
+    def hashfull(self):
+        """Returns the permille of the first thousand slots used by the current search"""
+        sample = min(1000, self.size)
+        used = sum(1 for index in range(sample) if self.data[index] and self.data[index] >> 58 == self.age)
+        return used * 1000 // sample
@@ -0,0 +1,53 @@
+"""
+    Zobrist keys: one random 64-bit number per (color, piece type, square), side to move,
+    castling right and en passant file. The hash of a position is the XOR of the keys of
+    everything in it, so a move updates it by XOR-ing the keys that changed.
+"""
+
+import random
+
+from constants import *
+
+## Fixed seed, so hashes are the same in every process and can be stored on disk
+SEED = 0x5EED_C4E55
+
+_random = random.Random(SEED)
+PIECE_KEYS = [[[_random.getrandbits(64) for _ in range(64)] for _ in range(6)] for _ in range(2)]
+BLACK_TO_MOVE_KEY = _random.getrandbits(64)
+CASTLE_KEYS = [[_random.getrandbits(64) for _ in range(2)] for _ in range(2)]
+EN_PASSANT_KEYS = [_random.getrandbits(64) for _ in range(8)]
+
+
+def castles_key(castles):
+    """Returns the XOR of the keys of the castling rights that are available"""
+    key = 0
+    for color in (W, B):
+        for side in (QUEEN_SIDE, KING_SIDE):
+            if castles[color][side]:
+                key ^= CASTLE_KEYS[color][side]
+    return key
+
+
+def hash_position(bitboard, turn, castles, en_passant):
+    """Computes the hash of a position from scratch
+
+    Args:
+        bitboard (BitBoard): The placement of the pieces
+        turn (int): The side to move
+        castles (list): Castling rights, indexed as castles[color][side]
+        en_passant (int): The en passant target square, or None
+
+    Returns:
+        int: The 64-bit Zobrist hash
+    """
+    key = 0
+    for sq in range(64):
+        color = bitboard.colors[sq]
+        if color is not None:
+            key ^= PIECE_KEYS[color][bitboard.roles[sq]][sq]
+    if turn is B:
+        key ^= BLACK_TO_MOVE_KEY
+    key ^= castles_key(castles)
+    if en_passant is not None:
+        key ^= EN_PASSANT_KEYS[en_passant % 8]
+    return key